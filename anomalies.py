@@ -0,0 +1,295 @@
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import data_manager
+import storage
+
+ANOMALIES_FILE = 'data/anomalies.csv'
+ANOMALY_COLUMNS = ['detected_at', 'date', 'scope', 'key', 'kind', 'value', 'expected', 'message']
+
+# Days the rolling statistics effectively remember, and how many days of
+# history a book or client needs before it can be flagged
+WINDOW_DAYS = 28
+MIN_HISTORY_DAYS = 14
+
+# Standard deviations from the rolling mean that count as a spike or drop,
+# and the smallest standard deviation used, so steady low sellers aren't
+# flagged for selling one extra copy
+THRESHOLD = 3.0
+MIN_STD = 1.0
+
+# Identical sales (same book, date, quantity and price) posted again in one write that make a burst
+DUPLICATE_THRESHOLD = 3
+
+# (sales version, detector) it was built from
+_detector = None
+_lock = threading.Lock()
+
+
+class AnomalyDetector:
+    """Rolling daily-sales statistics per book and per client.
+
+    Each series keeps a Welford-style running mean and variance that turns
+    into an exponentially weighted one after WINDOW_DAYS days, plus the
+    total of the day currently receiving sales. A new sale is an O(1)
+    update: it either adds to the open day or closes it (and any empty
+    days since) into the statistics, and is checked against them as it
+    arrives. Sales dated before a series' open day are late and don't
+    change the statistics.
+    """
+
+    def __init__(self):
+        self._series = {}  # (scope, key) -> dict of n, mean, var, day, total, flagged, signatures
+
+    def __len__(self):
+        return len(self._series)
+
+    def _observe(self, state, value):
+        """Fold one completed day into a series' running mean and variance."""
+        state['n'] += 1
+        weight = max(1 / state['n'], 2 / (WINDOW_DAYS + 1))
+        delta = value - state['mean']
+        state['mean'] += weight * delta
+        state['var'] = (1 - weight) * (state['var'] + weight * delta * delta)
+
+    @staticmethod
+    def _bounds(state):
+        """Return the (low, high) daily totals outside which a day is anomalous."""
+        std = max(np.sqrt(state['var']), MIN_STD)
+        return state['mean'] - THRESHOLD * std, state['mean'] + THRESHOLD * std
+
+    def _close_day(self, scope, key, state, new_day, flags):
+        """Close the open day and any empty days before new_day, flagging drops."""
+        low, _ = self._bounds(state)
+        if state['n'] >= MIN_HISTORY_DAYS and state['total'] < low:
+            flags.append(_flag(state['day'], scope, key, 'drop', state['total'], state['mean'],
+                               f"Sold {state['total']:,.0f} copies against an expected {state['mean']:,.1f}"))
+        self._observe(state, state['total'])
+
+        # Days without any sales count as zeros; beyond the window they no longer matter
+        empty_days = (new_day - state['day']).days - 1
+        if empty_days > 0:
+            low, _ = self._bounds(state)
+            if state['n'] >= MIN_HISTORY_DAYS and low > 0:
+                flags.append(_flag(state['day'] + pd.Timedelta(days=1), scope, key, 'drop', 0, state['mean'],
+                                   f"No sales for {empty_days} day(s) against an expected {state['mean']:,.1f} per day"))
+            for _ in range(min(empty_days, WINDOW_DAYS)):
+                self._observe(state, 0.0)
+
+        state.update(day=new_day, total=0.0, flagged=False, signatures={})
+
+    def add(self, scope, key, day, quantity, signature=None):
+        """Record a sale for one series and return any flags it raises."""
+        flags = []
+        state = self._series.get((scope, key))
+
+        if state is None:
+            state = {'n': 0, 'mean': 0.0, 'var': 0.0, 'day': day, 'total': 0.0, 'flagged': False, 'signatures': {}}
+            self._series[(scope, key)] = state
+        elif day < state['day']:
+            return flags
+        elif day > state['day']:
+            self._close_day(scope, key, state, day, flags)
+
+        state['total'] += quantity
+        if signature is not None:
+            state['signatures'][signature] = state['signatures'].get(signature, 0) + 1
+
+        _, high = self._bounds(state)
+        if state['n'] >= MIN_HISTORY_DAYS and state['total'] > high and not state['flagged']:
+            state['flagged'] = True
+            flags.append(_flag(day, scope, key, 'spike', state['total'], state['mean'],
+                               f"Sold {state['total']:,.0f} copies against an expected {state['mean']:,.1f}"))
+
+        return flags
+
+    def signature_count(self, scope, key, day, signature):
+        """Return how many times a sale signature has been seen on a series' open day."""
+        state = self._series.get((scope, key))
+        if state is None or state['day'] != day:
+            return 0
+        return state['signatures'].get(signature, 0)
+
+    def load(self, scope, keys, last_days, n, mean, var, open_totals):
+        """Load precomputed statistics for many series at once."""
+        for position, key in enumerate(keys):
+            self._series[(scope, key)] = {
+                'n': int(n[position]),
+                'mean': float(mean[position]),
+                'var': float(var[position]),
+                'day': last_days[position],
+                'total': float(open_totals[position]),
+                'flagged': False,
+                'signatures': {}
+            }
+
+
+def _flag(day, scope, key, kind, value, expected, message):
+    """Build an anomaly record."""
+    return {
+        'detected_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'date': pd.Timestamp(day).strftime('%Y-%m-%d'),
+        'scope': scope,
+        'key': str(key),
+        'kind': kind,
+        'value': float(value),
+        'expected': round(float(expected), 2),
+        'message': message
+    }
+
+
+def _rolling_statistics(series, first, last):
+    """Run the rolling statistics over dense daily series, one day at a time for all keys.
+
+    `series` is (days, keys); each key is observed from its first sale day
+    up to, but not including, its last sale day, which stays open.
+    """
+    keys = series.shape[1]
+    n = np.zeros(keys)
+    mean = np.zeros(keys)
+    var = np.zeros(keys)
+    floor = 2 / (WINDOW_DAYS + 1)
+
+    for day in range(series.shape[0]):
+        active = (day >= first) & (day < last)
+        if not active.any():
+            continue
+        n = np.where(active, n + 1, n)
+        weight = np.maximum(1 / np.maximum(n, 1), floor)
+        delta = series[day] - mean
+        mean = np.where(active, mean + weight * delta, mean)
+        var = np.where(active, (1 - weight) * (var + weight * delta * delta), var)
+
+    return n, mean, var
+
+
+def build_detector():
+    """Build a detector from the sales history without raising flags.
+
+    Daily totals per book and per client come from the sales cube and the
+    statistics are computed for every series together, one day at a time.
+    """
+    detector = AnomalyDetector()
+    cube = data_manager.get_sales_cube()
+    books_df = data_manager.get_books()
+    if cube.empty:
+        return detector
+
+    owners = books_df.set_index('id')['owner'] if not books_df.empty else pd.Series(dtype=object)
+    start_day = pd.Timestamp(cube['day'].iloc[0])
+    day_positions = (cube['day'] - start_day).dt.days.to_numpy()
+    days = day_positions.max() + 1
+
+    for scope, keys in [('book', cube['book_id']), ('client', cube['book_id'].map(owners))]:
+        known = keys.notna().to_numpy()
+        codes, uniques = pd.factorize(keys[known])
+        series = np.zeros((days, len(uniques)))
+        np.add.at(series, (day_positions[known], codes), cube['quantity'].to_numpy()[known])
+
+        sold = series > 0
+        first = sold.argmax(axis=0)
+        last = days - 1 - sold[::-1].argmax(axis=0)
+        n, mean, var = _rolling_statistics(series, first, last)
+
+        last_days = [start_day + pd.Timedelta(days=int(position)) for position in last]
+        open_totals = series[last, np.arange(len(uniques))]
+        detector.load(scope, uniques.tolist(), last_days, n, mean, var, open_totals)
+
+    return detector
+
+
+def get_detector():
+    """Return the shared detector, rebuilding it if sales have changed outside the write hooks."""
+    global _detector
+
+    with storage.snapshot(), _lock:
+        version = data_manager.get_table_version('sales')
+        if _detector is not None and _detector[0] == version:
+            return _detector[1]
+
+        detector = build_detector()
+        # A reader pinned to older sales doesn't replace a detector built from newer ones
+        if _detector is None or not storage.is_older(version, _detector[0]):
+            _detector = (version, detector)
+        return detector
+
+
+@storage.write_locked
+def _record(flags):
+    """Append flags to the anomalies file."""
+    if not flags:
+        return
+    flags_df = pd.DataFrame(flags, columns=ANOMALY_COLUMNS)
+    if os.path.exists(ANOMALIES_FILE) and os.path.getsize(ANOMALIES_FILE) > 0:
+        with storage.appender(ANOMALIES_FILE) as anomalies_file:
+            flags_df.to_csv(anomalies_file, header=False, index=False)
+    else:
+        with storage.atomic_writer(ANOMALIES_FILE) as anomalies_file:
+            flags_df.to_csv(anomalies_file, index=False)
+    storage.bump_version('anomalies')
+
+
+def apply_sales(previous_version, current_version, new_sales, books_df):
+    """Feed newly written sales to the detector and record any flags.
+
+    Sales are processed in date order. The update is only applied when the
+    detector was built from the version of sales.csv that the write
+    started from; otherwise it is rebuilt on the next use. Returns the
+    flags raised.
+    """
+    global _detector
+
+    with _lock:
+        if _detector is None or _detector[0] != previous_version or new_sales.empty:
+            return []
+        detector = _detector[1]
+
+        owners = books_df.set_index('id')['owner'] if not books_df.empty else pd.Series(dtype=object)
+        sales = new_sales.assign(day=pd.to_datetime(new_sales['date'])).sort_values('day', kind='mergesort')
+
+        # Identical rows already seen on the same day point to a feed posted twice
+        flags = []
+        repeats = {}
+        for book_id, day, quantity, price in zip(sales['book_id'], sales['day'], sales['quantity'], sales['price']):
+            signature = (int(quantity), round(float(price), 2))
+            if detector.signature_count('book', int(book_id), day, signature):
+                repeats[(int(book_id), day)] = repeats.get((int(book_id), day), 0) + 1
+
+            flags.extend(detector.add('book', int(book_id), day, quantity, signature))
+            owner = owners.get(book_id)
+            if owner is not None:
+                flags.extend(detector.add('client', owner, day, quantity))
+
+        for (book_id, day), count in repeats.items():
+            if count >= DUPLICATE_THRESHOLD:
+                flags.append(_flag(day, 'book', book_id, 'duplicate', count, 0,
+                                   f"{count} sales repeat others already recorded for the same day"))
+
+        _detector = (current_version, detector)
+
+    _record(flags)
+    return flags
+
+
+def get_anomalies():
+    """Get every recorded anomaly, newest first."""
+    if not os.path.exists(ANOMALIES_FILE):
+        return pd.DataFrame(columns=ANOMALY_COLUMNS)
+    anomalies = pd.read_csv(storage.open_table('anomalies'), dtype={'key': str})
+    return anomalies.iloc[::-1]
+
+
+@storage.write_locked
+def dismiss_anomaly(index):
+    """Remove a reviewed anomaly."""
+    anomalies = get_anomalies()
+    if index not in anomalies.index:
+        return False
+    with storage.atomic_writer(ANOMALIES_FILE) as anomalies_file:
+        anomalies.drop(index).sort_index().to_csv(anomalies_file, index=False)
+    storage.bump_version('anomalies')
+    return True
@@ -0,0 +1,280 @@
+import base64
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+import data_manager
+import storage
+import user_directory
+import utils
+
+# Time periods accepted by the API, as short codes or the labels used in the app
+PERIODS = {
+    '7d': 'Last 7 Days',
+    '30d': 'Last 30 Days',
+    '90d': 'Last 90 Days',
+    '365d': 'Last Year',
+    'all': 'All Time'
+}
+PERIOD_DAYS = {'Last 7 Days': 7, 'Last 30 Days': 30, 'Last 90 Days': 90, 'Last Year': 365}
+
+# Rendered responses kept per ETag, so repeated unconditional requests skip the query too
+RESPONSE_CACHE_SIZE = 256
+
+REALM = 'Book Sales Tracker'
+
+_responses = OrderedDict()
+_lock = threading.Lock()
+
+
+class ApiError(Exception):
+    """A request the API refuses, with the HTTP status to answer it with."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _records(df):
+    """Convert a DataFrame to a list of JSON-ready records."""
+    return json.loads(df.to_json(orient='records', date_format='iso'))
+
+
+def _period(params):
+    """Return the app time period named by the `period` parameter (default: all time)."""
+    period = params.get('period', 'all')
+    if period in PERIODS:
+        return PERIODS[period]
+    if period in PERIODS.values():
+        return period
+    raise ApiError(400, f"Unknown period: {period}. Use one of {', '.join(PERIODS)}.")
+
+
+def _granularity(params):
+    """Return the trend resample rule named by the `granularity` parameter (default: auto)."""
+    granularity = params.get('granularity', 'auto')
+    allowed = ['auto', *utils.GRANULARITY_LABELS]
+    if granularity not in allowed:
+        raise ApiError(400, f"Unknown granularity: {granularity}. Use one of {', '.join(allowed)}.")
+    return granularity
+
+
+def _limit(params, default=5):
+    """Return the `limit` parameter as a positive integer."""
+    try:
+        limit = int(params.get('limit', default))
+    except ValueError:
+        raise ApiError(400, "limit must be an integer.")
+    if limit < 1:
+        raise ApiError(400, "limit must be at least 1.")
+    return limit
+
+
+def get_trend(username, params):
+    """Sales trend for the period, bucketed by `granularity` (default: auto)."""
+    trend = data_manager.get_sales_trend(username, _period(params), granularity=_granularity(params))
+    return {'granularity': trend.attrs.get('granularity'), 'trend': _records(trend)}
+
+
+def get_top_books(username, params):
+    """Best-selling books for the period."""
+    return {'books': _records(data_manager.get_top_books(username, _period(params), limit=_limit(params)))}
+
+
+def get_genres(username, params):
+    """Copies sold per genre for the period."""
+    return {'genres': _records(data_manager.get_sales_by_genre(username, _period(params)))}
+
+
+def get_royalties(username, params):
+    """Royalties per book for the period, plus the client's balance."""
+    period = _period(params)
+    result = {
+        'total': float(data_manager.get_total_royalties(username, period)),
+        'books': _records(data_manager.get_royalties_by_book(username, period))
+    }
+    if username != 'admin':
+        result['balance'] = data_manager.get_client_balance(username)
+    return result
+
+
+def get_totals(username, params):
+    """Copies sold, revenue, royalties and number of sales for the period, from the sales cube."""
+    period = _period(params)
+    start_date = None
+    if period in PERIOD_DAYS:
+        # Same boundary as filter_sales_by_time_period: days on or after now minus the period
+        start_date = pd.Timestamp(datetime.now() - timedelta(days=PERIOD_DAYS[period])).ceil('D')
+
+    filters = None if username == 'admin' else {'owner': username}
+    totals = data_manager.query_cube([], filters=filters, start_date=start_date).iloc[0]
+    return {
+        'copies': int(totals['quantity']),
+        'revenue': float(totals['revenue']),
+        'royalties': float(totals['royalty']),
+        'sales': int(totals['sales'])
+    }
+
+
+ENDPOINTS = {
+    '/api/trend': get_trend,
+    '/api/top-books': get_top_books,
+    '/api/genres': get_genres,
+    '/api/royalties': get_royalties,
+    '/api/totals': get_totals
+}
+
+
+def data_version():
+    """Return a token that changes whenever data behind any endpoint changes."""
+    return data_manager.get_data_version() + (data_manager.get_table_version('payments'),)
+
+
+def make_etag(path, username, params, version):
+    """Derive a response's ETag from what was asked, for whom, and the data version it reflects.
+
+    The day is part of it too: time periods are relative to today, so the
+    same data gives a different response after midnight.
+    """
+    key = repr((path, username, sorted(params.items()), version, date.today()))
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+
+def etag_matches(header, etag):
+    """Return True if an If-None-Match header names the ETag, or is `*`.
+
+    Uses the weak comparison If-None-Match calls for, so a tag sent back
+    as W/"..." (as many proxies and HTTP libraries do) still matches.
+    """
+    tags = [tag.strip() for tag in (header or '').split(',')]
+    return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+
+def authenticate(header):
+    """Return the username for a Basic Authorization header, or None if the credentials are wrong."""
+    if not header or not header.startswith('Basic '):
+        return None
+    try:
+        username, _, password = base64.b64decode(header[6:]).decode('utf-8').partition(':')
+    except (ValueError, UnicodeDecodeError):
+        return None
+    success, _, _ = user_directory.authenticate(username, password)
+    return username if success else None
+
+
+def _scope(username, params):
+    """Return whose data a request reads: the client themself, or any client for admin."""
+    user = user_directory.get_user(username)
+    client = params.pop('client', None)
+    if user['role'] == 'admin':
+        return client or 'admin'
+    if client not in (None, username):
+        raise ApiError(403, "Clients can only read their own data.")
+    return username
+
+
+def render(path, username, params, etag):
+    """Run an endpoint and return its JSON body, reusing the body rendered for the same ETag."""
+    with _lock:
+        if etag in _responses:
+            _responses.move_to_end(etag)
+            return _responses[etag]
+
+    body = json.dumps({
+        'data': ENDPOINTS[path](username, params),
+        'version': etag.strip('"')
+    }).encode('utf-8')
+
+    with _lock:
+        _responses[etag] = body
+        while len(_responses) > RESPONSE_CACHE_SIZE:
+            _responses.popitem(last=False)
+    return body
+
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    """Serves the read-only JSON endpoints with Basic auth and conditional GETs."""
+
+    # Keep-alive connections; headers and body go out as separate writes, so
+    # Nagle's algorithm would hold each response back waiting for an ACK
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    server_version = 'BookSalesTrackerAPI/1.0'
+    quiet = True
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def _send_error(self, status, message, headers=None):
+        self._send(status, json.dumps({'error': message}).encode('utf-8'), headers)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        username = authenticate(self.headers.get('Authorization'))
+        if username is None:
+            self._send_error(401, "Authentication required.", {'WWW-Authenticate': f'Basic realm="{REALM}"'})
+            return
+
+        if url.path == '/api':
+            self._send(200, json.dumps({'endpoints': {path: handler.__doc__ for path, handler in ENDPOINTS.items()}}).encode('utf-8'))
+            return
+        if url.path not in ENDPOINTS:
+            self._send_error(404, f"Unknown endpoint: {url.path}")
+            return
+
+        try:
+            # The ETag and the body both come from the same version of the data
+            with storage.snapshot():
+                scope = _scope(username, params)
+                etag = make_etag(url.path, scope, params, data_version())
+                headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+
+                # A client that already has this version gets an empty 304 without the query running
+                if etag_matches(self.headers.get('If-None-Match'), etag):
+                    self._send(304, headers=headers)
+                    return
+
+                body = render(url.path, scope, params, etag)
+            self._send(200, body, headers)
+        except ApiError as e:
+            self._send_error(e.status, e.message)
+        except ValueError as e:
+            self._send_error(400, str(e))
+        except Exception as e:
+            print(f"Error serving {url.path}: {e}")
+            self._send_error(500, "Internal server error.")
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+def serve(host='127.0.0.1', port=8502, quiet=True):
+    """Run the API server until interrupted."""
+    ApiRequestHandler.quiet = quiet
+    server = ThreadingHTTPServer((host, port), ApiRequestHandler)
+    server.daemon_threads = True
+    print(f"Serving the API on http://{host}:{port}/api")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -5,7 +5,9 @@ import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import auth
+import charts
 import data_manager
+import storage
 import utils
 
 # Configure the page
@@ -16,6 +18,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Read one consistent version of the data for the whole render
+storage.begin_snapshot()
+
 # Display logo in sidebar
 with st.sidebar:
     st.image("attached_assets/logo.png", width=200)
@@ -126,32 +131,48 @@ else:
             
             # Sales over time chart
             st.subheader("Sales Trend")
-            sales_trend = data_manager.get_sales_trend(st.session_state.username, time_period)
+            def build_trend_figure():
+                sales_trend = data_manager.get_sales_trend(st.session_state.username, time_period)
+                granularity_label = utils.GRANULARITY_LABELS[sales_trend.attrs['granularity']]
+                
+                fig = px.line(
+                    sales_trend, 
+                    x='date', 
+                    y='sales',
+                    title=f'Book Sales Over Time ({granularity_label})',
+                    labels={'date': 'Date', 'sales': 'Books Sold'}
+                )
+                fig.update_layout(height=400)
+                return fig
             
-            fig = px.line(
-                sales_trend, 
-                x='date', 
-                y='sales',
-                title='Book Sales Over Time',
-                labels={'date': 'Date', 'sales': 'Books Sold'}
+            fig = charts.cached_figure(
+                'home_sales_trend', build_trend_figure,
+                username=st.session_state.username, time_period=time_period
             )
-            fig.update_layout(height=400)
             st.plotly_chart(fig, use_container_width=True)
             
             # Top selling books
             st.subheader("Top Selling Books")
-            top_books = data_manager.get_top_books(st.session_state.username, time_period, limit=5)
             
-            fig = px.bar(
-                top_books,
-                x='title',
-                y='sales',
-                title='Top Selling Books',
-                labels={'title': 'Book Title', 'sales': 'Books Sold'},
-                color='sales',
-                color_continuous_scale=px.colors.sequential.Blues
+            def build_top_books_figure():
+                top_books = data_manager.get_top_books(st.session_state.username, time_period, limit=5)
+                
+                fig = px.bar(
+                    top_books,
+                    x='title',
+                    y='sales',
+                    title='Top Selling Books',
+                    labels={'title': 'Book Title', 'sales': 'Books Sold'},
+                    color='sales',
+                    color_continuous_scale=px.colors.sequential.Blues
+                )
+                fig.update_layout(height=400)
+                return fig
+            
+            fig = charts.cached_figure(
+                'home_top_books', build_top_books_figure,
+                username=st.session_state.username, time_period=time_period
             )
-            fig.update_layout(height=400)
             st.plotly_chart(fig, use_container_width=True)
             
             # Recent sales table
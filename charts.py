@@ -0,0 +1,90 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+
+import plotly.graph_objects as go
+import plotly.io as pio
+
+import data_manager
+
+# Scatter traces with more points than this in total are drawn with WebGL
+WEBGL_POINT_THRESHOLD = int(os.environ.get('CHART_WEBGL_POINT_THRESHOLD', 1000))
+
+# Maximum number of serialized figures kept per process
+FIGURE_CACHE_SIZE = int(os.environ.get('CHART_FIGURE_CACHE_SIZE', 256))
+
+_figure_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_MISSING = object()
+
+
+def count_points(fig):
+    """Count the data points across all scatter traces of a figure."""
+    total = 0
+    for trace in fig.data:
+        if trace.type in ('scatter', 'scattergl') and trace.x is not None:
+            total += len(trace.x)
+    return total
+
+
+def use_webgl(fig, threshold=None):
+    """Return the figure with its scatter traces switched to Scattergl above a point threshold."""
+    threshold = WEBGL_POINT_THRESHOLD if threshold is None else threshold
+
+    if count_points(fig) <= threshold:
+        return fig
+
+    traces = []
+    for trace in fig.data:
+        if trace.type == 'scatter':
+            properties = trace.to_plotly_json()
+            properties.pop('type', None)
+            trace = go.Scattergl(properties, skip_invalid=True)
+        traces.append(trace)
+
+    return go.Figure(data=traces, layout=fig.layout)
+
+
+def cached_figure(name, build, username=None, **filters):
+    """Return a chart figure, building it only when its inputs have changed.
+
+    Figures are cached as serialized JSON keyed by chart name, user, filter
+    values, the current data version and today's date (time periods such as
+    "Last 7 Days" are relative to today), so reruns that don't change any
+    of those (e.g. clicking Export) skip both the data preparation inside
+    `build` and the Plotly figure construction. `build` may return None to
+    signal that there is nothing to plot; that result is cached too.
+    """
+    key = (
+        name,
+        username,
+        tuple(sorted((field, str(value)) for field, value in filters.items())),
+        data_manager.get_data_version(),
+        date.today()
+    )
+
+    with _cache_lock:
+        cached = _figure_cache.get(key, _MISSING)
+        if cached is not _MISSING:
+            _figure_cache.move_to_end(key)
+
+    if cached is _MISSING:
+        fig = build()
+        cached = None if fig is None else use_webgl(fig).to_json()
+
+        with _cache_lock:
+            _figure_cache[key] = cached
+            while len(_figure_cache) > FIGURE_CACHE_SIZE:
+                _figure_cache.popitem(last=False)
+
+    if cached is None:
+        return None
+
+    return pio.from_json(cached, skip_invalid=True)
+
+
+def clear_figure_cache():
+    """Drop all cached figures."""
+    with _cache_lock:
+        _figure_cache.clear()
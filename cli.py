@@ -0,0 +1,314 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import data_manager
+import storage
+
+
+def progress(message):
+    """Print a progress message to stderr."""
+    print(f"[{time.strftime('%H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+
+def ingest_sales(args):
+    """Append sales from one or more CSV files, chunk by chunk."""
+    books_df = data_manager.get_books()
+    total_appended = 0
+    total_rejected = 0
+    rejection_reports = []
+
+    for path in args.files:
+        progress(f"Ingesting {path}")
+        rows_seen = 0
+
+        for chunk in pd.read_csv(path, chunksize=args.chunk_size, dtype=str):
+            appended, rejections = data_manager.append_sales(chunk, books_df)
+
+            if not rejections.empty:
+                rejections['row'] += rows_seen
+                rejections.insert(0, 'file', path)
+                rejection_reports.append(rejections)
+
+            rows_seen += len(chunk)
+            total_appended += len(appended)
+            total_rejected += len(rejections)
+            progress(f"  {rows_seen:,} rows read, {total_appended:,} appended, {total_rejected:,} rejected")
+
+    if rejection_reports and args.rejections:
+        pd.concat(rejection_reports, ignore_index=True).to_csv(args.rejections, index=False)
+        progress(f"Rejection report written to {args.rejections}")
+
+    progress(f"Done: {total_appended:,} sales appended, {total_rejected:,} rejected")
+    return 0
+
+
+def recompute_royalties(args):
+    """Recalculate royalties for every sale."""
+    progress("Recomputing royalties")
+    processed = data_manager.recompute_royalties(chunksize=args.chunk_size)
+    progress(f"Done: {processed:,} sales updated")
+    return 0
+
+
+def rebuild_aggregates(args):
+    """Rebuild derived aggregates from the raw data and save them for the app to load."""
+    names = args.names or None
+    unknown = [name for name in (names or []) if name not in data_manager.AGGREGATE_BUILDERS]
+    if unknown:
+        progress(f"Unknown aggregates: {', '.join(unknown)}")
+        return 2
+
+    rebuilt = data_manager.rebuild_aggregates(names)
+    for name in rebuilt:
+        progress(f"Rebuilt and saved {name}")
+    progress(f"Done: {len(rebuilt)} aggregates rebuilt")
+    return 0
+
+
+def check(args):
+    """Run integrity checks and exit non-zero if any fail."""
+    progress("Checking data integrity")
+    problems = data_manager.check_integrity(chunksize=args.chunk_size)
+
+    for check_name, count in problems:
+        print(f"{check_name}: {count:,}")
+
+    if problems:
+        progress(f"Done: {len(problems)} checks failed")
+        return 1
+
+    progress("Done: no problems found")
+    return 0
+
+
+def _write_client_chunk(out_dir, username, client_sales, write_header):
+    """Append one client's share of a sales chunk to their report file."""
+    path = os.path.join(out_dir, f"{username}_sales.csv")
+    client_sales.to_csv(path, mode='w' if write_header else 'a', header=write_header, index=False)
+
+
+def export_reports(args):
+    """Write a sales file and a per-book summary for every client."""
+    os.makedirs(args.out, exist_ok=True)
+
+    books_df = data_manager.get_books()
+    if books_df.empty:
+        progress("No books found")
+        return 0
+
+    book_details = books_df[['id', 'title', 'owner']].rename(columns={'id': 'book_id'})
+    clients = data_manager.get_clients()
+    usernames = args.clients or (clients['username'].tolist() if not clients.empty else [])
+
+    started = set()
+    summaries = []
+    rows_seen = 0
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for chunk in pd.read_csv(storage.open_table('sales'), chunksize=args.chunk_size):
+            chunk = chunk.merge(book_details, on='book_id', how='inner')
+            chunk = chunk[chunk['owner'].isin(usernames)]
+
+            # Per-client files are independent, so each chunk is written in parallel
+            futures = []
+            for username, client_sales in chunk.groupby('owner'):
+                futures.append(executor.submit(
+                    _write_client_chunk, args.out, username,
+                    client_sales.drop(columns=['owner']), username not in started
+                ))
+                started.add(username)
+            for future in futures:
+                future.result()
+
+            summaries.append(
+                chunk.groupby(['owner', 'book_id', 'title'])[['quantity', 'revenue', 'royalty']].sum()
+            )
+            rows_seen += len(chunk)
+            progress(f"  {rows_seen:,} client sales exported")
+
+    if summaries:
+        summary = pd.concat(summaries).groupby(level=[0, 1, 2]).sum().reset_index()
+        for username, client_summary in summary.groupby('owner'):
+            path = os.path.join(args.out, f"{username}_summary.csv")
+            client_summary.drop(columns=['owner']).sort_values('revenue', ascending=False).to_csv(path, index=False)
+
+    progress(f"Done: reports written for {len(started)} clients to {args.out}")
+    return 0
+
+
+def generate_statements(args):
+    """Write royalty statements for every client."""
+    import statements
+
+    progress("Generating royalty statements")
+    paths = statements.write_statements(
+        args.out,
+        freq=args.freq,
+        periods=args.periods,
+        clients=args.clients,
+        formats=args.formats,
+        workers=args.workers
+    )
+    progress(f"Done: {len(paths):,} statement files written to {args.out}")
+    return 0
+
+
+def send_digests(args):
+    """Build and deliver sales digests to every subscribed user."""
+    import digests
+
+    if args.backend == 'smtp':
+        backend = digests.SMTPBackend(args.smtp_host, args.smtp_port)
+    else:
+        backend = digests.OutboxBackend(args.outbox)
+
+    frequencies = digests.due_frequencies(args.date) if args.frequency == 'due' else [args.frequency]
+    failed = 0
+
+    for frequency in frequencies:
+        progress(f"Sending {frequency} digests")
+        results = digests.send_digests(frequency, backend, as_of=args.date, usernames=args.users, force=args.force)
+
+        for username, delivered, detail in results:
+            if not delivered:
+                progress(f"  {username}: not delivered ({detail})")
+                failed += 1
+
+        progress(f"Done: {sum(delivered for _, delivered, _ in results):,} {frequency} digests delivered")
+
+    return 1 if failed else 0
+
+
+def serve_api(args):
+    """Serve the read-only JSON API."""
+    import api
+
+    api.serve(args.host, args.port, quiet=not args.verbose)
+    return 0
+
+
+def generate_dataset(args):
+    """Generate a synthetic dataset for load testing."""
+    import loadtest
+
+    progress(f"Generating {args.sales:,} sales for {args.books:,} books")
+    success, message = loadtest.generate_dataset(args.books, args.clients, args.sales, args.days, args.seed)
+    progress(message)
+    return 0 if success else 1
+
+
+def load_test(args):
+    """Simulate concurrent users and report throughput and latency percentiles."""
+    import loadtest
+
+    try:
+        mix = loadtest.parse_mix(args.mix) if args.mix else None
+    except ValueError as e:
+        progress(str(e))
+        return 1
+
+    progress(f"Running {args.users} sessions on {args.processes} process(es) for {args.duration:g}s")
+    summary, elapsed = loadtest.run_load_test(
+        args.users, args.processes, args.duration, mix,
+        seed=args.seed, think_time=args.think_time, warmup=not args.no_warmup
+    )
+    print(loadtest.format_summary(summary))
+    if args.output:
+        summary.to_csv(args.output, index=False)
+    progress(f"Done in {elapsed:.1f}s")
+    return 1 if summary['errors'].sum() else 0
+
+
+def build_parser():
+    """Build the command-line argument parser."""
+    parser = argparse.ArgumentParser(
+        description="Run Book Sales Tracker data jobs without the Streamlit UI."
+    )
+    parser.add_argument('--data-dir', default='.', help="directory containing the data/ folder (default: current directory)")
+    parser.add_argument('--chunk-size', type=int, default=100000, help="rows read per chunk, bounding memory use (default: 100000)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="parallel workers for jobs that support them")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = subparsers.add_parser('ingest-sales', help="append sales from CSV files")
+    ingest_parser.add_argument('files', nargs='+', help="CSV files with date, book_id, quantity and optional price columns")
+    ingest_parser.add_argument('--rejections', help="write rejected rows to this CSV file")
+    ingest_parser.set_defaults(handler=ingest_sales)
+
+    royalties_parser = subparsers.add_parser('recompute-royalties', help="recalculate royalties for every sale")
+    royalties_parser.set_defaults(handler=recompute_royalties)
+
+    aggregates_parser = subparsers.add_parser('rebuild-aggregates', help="rebuild derived aggregates and save them for the app to load")
+    aggregates_parser.add_argument('names', nargs='*', help="aggregates to rebuild (default: all)")
+    aggregates_parser.set_defaults(handler=rebuild_aggregates)
+
+    check_parser = subparsers.add_parser('check', help="run data integrity checks")
+    check_parser.set_defaults(handler=check)
+
+    export_parser = subparsers.add_parser('export-reports', help="export per-client sales reports")
+    export_parser.add_argument('--out', default='reports', help="output directory (default: reports)")
+    export_parser.add_argument('--clients', nargs='*', help="only export these clients")
+    export_parser.set_defaults(handler=export_reports)
+
+    statements_parser = subparsers.add_parser('statements', help="generate royalty statements for all clients")
+    statements_parser.add_argument('--out', default='statements', help="output directory (default: statements)")
+    statements_parser.add_argument('--freq', default='M', choices=['M', 'Q', 'Y'], help="statement period: monthly, quarterly or yearly (default: M)")
+    statements_parser.add_argument('--periods', nargs='*', help="only these periods, e.g. 2024-08 or 2024Q3 (default: all)")
+    statements_parser.add_argument('--clients', nargs='*', help="only these clients")
+    statements_parser.add_argument('--formats', nargs='+', default=['csv', 'html'], choices=['csv', 'html'], help="files to write (default: csv html)")
+    statements_parser.set_defaults(handler=generate_statements)
+
+    digests_parser = subparsers.add_parser('digests', help="send daily/weekly sales digests to subscribed users")
+    digests_parser.add_argument('--frequency', default='due', choices=['daily', 'weekly', 'due'], help="digests to send; 'due' sends daily ones and weekly ones on Sundays (default: due)")
+    digests_parser.add_argument('--date', help="last day the digests cover (default: yesterday)")
+    digests_parser.add_argument('--users', nargs='*', help="only these users, subscribed or not")
+    digests_parser.add_argument('--backend', default='outbox', choices=['outbox', 'smtp'], help="delivery backend (default: outbox)")
+    digests_parser.add_argument('--outbox', default='outbox', help="directory the outbox backend writes to (default: outbox)")
+    digests_parser.add_argument('--smtp-host', default='localhost', help="SMTP server host (default: localhost)")
+    digests_parser.add_argument('--smtp-port', type=int, default=1025, help="SMTP server port (default: 1025)")
+    digests_parser.add_argument('--force', action='store_true', help="resend digests already delivered for the period")
+    digests_parser.set_defaults(handler=send_digests)
+
+    api_parser = subparsers.add_parser('serve-api', help="serve the read-only JSON API")
+    api_parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    api_parser.add_argument('--port', type=int, default=8502, help="port to listen on (default: 8502)")
+    api_parser.add_argument('--verbose', action='store_true', help="log every request")
+    api_parser.set_defaults(handler=serve_api)
+
+    dataset_parser = subparsers.add_parser('generate-dataset', help="generate a synthetic dataset for load testing")
+    dataset_parser.add_argument('--books', type=int, default=500, help="books in the catalog (default: 500)")
+    dataset_parser.add_argument('--clients', type=int, default=50, help="client accounts (default: 50)")
+    dataset_parser.add_argument('--sales', type=int, default=1000000, help="sales rows (default: 1000000)")
+    dataset_parser.add_argument('--days', type=int, default=730, help="days of history the sales cover (default: 730)")
+    dataset_parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+    dataset_parser.set_defaults(handler=generate_dataset)
+
+    load_parser = subparsers.add_parser('load-test', help="simulate concurrent users and report latency percentiles")
+    load_parser.add_argument('--users', type=int, default=20, help="concurrent simulated sessions (default: 20)")
+    load_parser.add_argument('--processes', type=int, default=1, help="worker processes the sessions are split over (default: 1)")
+    load_parser.add_argument('--duration', type=float, default=30.0, help="seconds to run (default: 30)")
+    load_parser.add_argument('--mix', help="operation weights, e.g. client_dashboard=4,book_analytics=3,admin_filter=1,login=1,add_sale=1")
+    load_parser.add_argument('--think-time', type=float, default=0.0, help="mean seconds each session waits between operations (default: 0)")
+    load_parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+    load_parser.add_argument('--no-warmup', action='store_true', help="don't build the caches before timing starts")
+    load_parser.add_argument('--output', help="also write the summary to this CSV file")
+    load_parser.set_defaults(handler=load_test)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    os.chdir(args.data_dir)
+
+    # Each job reads one version of the data, however long it runs
+    with storage.snapshot():
+        return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
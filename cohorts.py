@@ -0,0 +1,193 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+import data_manager
+import storage
+
+# Days in each lifecycle unit
+UNIT_DAYS = {'day': 1, 'week': 7, 'month': 30}
+
+# Ways books can be grouped into cohorts
+COHORT_COLUMNS = {
+    'publication_month': "Publication Month",
+    'publication_year': "Publication Year",
+    'genre': "Genre",
+    'owner': "Client"
+}
+
+# (data version, lifecycle tables) they were built from
+_lifecycle = None
+_lock = threading.Lock()
+
+
+def build_lifecycle(cube, books_df, as_of=None):
+    """Align every book's sales to the number of days since its publication.
+
+    Takes the (day, book) sales cube and the catalog and returns a tuple of
+    (sales, books): `sales` has one row per (book, age in days) with copies
+    sold and revenue; `books` has each book's cohort columns and the age it
+    has reached by `as_of` (default: the latest sale day), which is how far
+    its curve can be observed. Sales before publication count at age 0.
+    """
+    books = pd.DataFrame({
+        'book_id': books_df['id'].astype(int).to_numpy(),
+        'title': books_df['title'].to_numpy(),
+        'genre': books_df['genre'].to_numpy(),
+        'owner': books_df['owner'].to_numpy(),
+        'publication_date': pd.to_datetime(books_df['publication_date'], errors='coerce').to_numpy()
+    }).dropna(subset=['publication_date'])
+    books['publication_month'] = books['publication_date'].dt.strftime('%Y-%m')
+    books['publication_year'] = books['publication_date'].dt.strftime('%Y')
+
+    if as_of is None:
+        as_of = cube['day'].max() if not cube.empty else pd.Timestamp.now().normalize()
+    books['observed_days'] = (pd.Timestamp(as_of) - books['publication_date']).dt.days.clip(lower=0)
+
+    publication = books.set_index('book_id')['publication_date']
+    sales = cube[cube['book_id'].isin(publication.index)]
+    ages = (sales['day'] - sales['book_id'].map(publication)).dt.days.clip(lower=0)
+
+    sales = pd.DataFrame({
+        'book_id': sales['book_id'].astype(int).to_numpy(),
+        'age': ages.to_numpy(dtype=int),
+        'quantity': sales['quantity'].to_numpy(),
+        'revenue': sales['revenue'].to_numpy()
+    }).groupby(['book_id', 'age'], as_index=False).sum()
+
+    return sales, books.set_index('book_id')
+
+
+def get_lifecycle():
+    """Return the lifecycle tables, rebuilt only when books or sales have changed."""
+    global _lifecycle
+
+    with storage.snapshot(), _lock:
+        version = data_manager.get_data_version()
+        if _lifecycle is not None and _lifecycle[0] == version:
+            return _lifecycle[1]
+
+        books_df = data_manager.get_books()
+        if books_df.empty:
+            lifecycle = (
+                pd.DataFrame(columns=['book_id', 'age', 'quantity', 'revenue']),
+                pd.DataFrame(columns=['title', 'publication_date', 'observed_days', *COHORT_COLUMNS], index=pd.Index([], name='book_id'))
+            )
+        else:
+            lifecycle = build_lifecycle(data_manager.get_sales_cube(), books_df)
+
+        # A reader pinned to older data doesn't replace tables built from newer data
+        if _lifecycle is None or not storage.is_older(version, _lifecycle[0]):
+            _lifecycle = (version, lifecycle)
+        return lifecycle
+
+
+def cohort_curves(by='genre', unit='week', max_age=52, measure='quantity'):
+    """Get the average sales curve of each cohort by time since publication.
+
+    For every cohort and age (in days, weeks or months since publication)
+    returns the average sold per book and the average cumulative total.
+    Each age is averaged only over books old enough to have reached it, so
+    recent titles don't drag the tail of a curve down. Returns columns
+    cohort, age, books, average and cumulative.
+    """
+    columns = ['cohort', 'age', 'books', 'average', 'cumulative']
+    sales, books = get_lifecycle()
+    if books.empty:
+        return pd.DataFrame(columns=columns)
+
+    unit_days = UNIT_DAYS[unit]
+    ages = np.arange(max_age + 1)
+
+    # Books observed for at least each age, per cohort
+    book_ages = (books['observed_days'] // unit_days).to_numpy()
+    cohorts = books[by].astype(str)
+    cohort_codes, cohort_names = pd.factorize(cohorts, sort=True)
+    exposure = np.zeros((len(cohort_names), len(ages)))
+    np.add.at(exposure, cohort_codes, (book_ages[:, np.newaxis] >= ages).astype(float))
+
+    # Sales per cohort and age
+    totals = np.zeros((len(cohort_names), len(ages)))
+    sales_ages = (sales['age'] // unit_days).to_numpy()
+    in_range = sales_ages <= max_age
+    sales_cohorts = pd.Index(books.index).get_indexer(sales['book_id'])
+    np.add.at(
+        totals,
+        (cohort_codes[sales_cohorts[in_range]], sales_ages[in_range]),
+        sales[measure].to_numpy()[in_range]
+    )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average = np.where(exposure > 0, totals / exposure, np.nan)
+    cumulative = np.nancumsum(average, axis=1)
+    cumulative[exposure == 0] = np.nan
+
+    curves = pd.DataFrame({
+        'cohort': np.repeat(np.asarray(cohort_names), len(ages)),
+        'age': np.tile(ages, len(cohort_names)),
+        'books': exposure.ravel().astype(int),
+        'average': average.ravel(),
+        'cumulative': cumulative.ravel()
+    })
+    return curves[curves['books'] > 0].reset_index(drop=True)
+
+
+def book_curve(book_id, unit='week', max_age=52, measure='quantity'):
+    """Get one book's sales and cumulative sales by time since publication."""
+    sales, books = get_lifecycle()
+    if book_id not in books.index:
+        return pd.DataFrame(columns=['age', 'value', 'cumulative'])
+
+    unit_days = UNIT_DAYS[unit]
+    reached = min(int(books.loc[book_id, 'observed_days'] // unit_days), max_age)
+    book_sales = sales[sales['book_id'] == book_id]
+    values = book_sales.groupby(book_sales['age'] // unit_days)[measure].sum().reindex(range(reached + 1), fill_value=0)
+
+    return pd.DataFrame({
+        'age': values.index,
+        'value': values.to_numpy(),
+        'cumulative': values.cumsum().to_numpy()
+    })
+
+
+def time_to_copies(thresholds=(100, 500, 1000)):
+    """Get the number of days each book took to reach each cumulative copy count.
+
+    Returns one row per book with its cohort columns and a days_to_<N>
+    column per threshold (empty when the book hasn't reached it yet).
+    """
+    sales, books = get_lifecycle()
+    if books.empty:
+        return pd.DataFrame(columns=['title', *COHORT_COLUMNS, *(f'days_to_{threshold}' for threshold in thresholds)])
+
+    result = books[['title'] + list(COHORT_COLUMNS)].copy()
+
+    ordered = sales.sort_values(['book_id', 'age'])
+    cumulative = ordered.groupby('book_id')['quantity'].cumsum()
+
+    for threshold in thresholds:
+        reached = ordered[cumulative >= threshold]
+        result[f'days_to_{threshold}'] = reached.groupby('book_id')['age'].first()
+
+    return result
+
+
+def cohort_milestones(by='genre', thresholds=(100, 500, 1000)):
+    """Summarise time-to-N-copies per cohort.
+
+    Returns, per cohort, the number of books and for each threshold the
+    share of books that reached it and the median days they took.
+    """
+    milestones = time_to_copies(thresholds)
+    if milestones.empty:
+        return pd.DataFrame()
+
+    grouped = milestones.groupby(milestones[by].astype(str))
+    summary = pd.DataFrame({'books': grouped.size()})
+    for threshold in thresholds:
+        column = f'days_to_{threshold}'
+        summary[f'reached_{threshold}'] = grouped[column].count() / summary['books']
+        summary[f'median_days_to_{threshold}'] = grouped[column].median()
+
+    return summary.reset_index(names='cohort')
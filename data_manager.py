@@ -1,17 +1,359 @@
-import streamlit as st
 import pandas as pd
 import numpy as np
 import os
+import pickle
 from datetime import datetime, timedelta
+import storage
+import user_directory
 import utils
 
+# Column order of sales.csv
+SALES_COLUMNS = ['date', 'book_id', 'quantity', 'price', 'revenue', 'royalty']
+
+# Column order of book_versions.csv, the effective-dated history of book prices and royalty rates
+BOOK_VERSION_COLUMNS = ['book_id', 'effective_date', 'price', 'royalty_percentage']
+
+# Column order of royalty_schedules.csv, the tiered royalty rates by cumulative copies sold
+ROYALTY_SCHEDULE_COLUMNS = ['book_id', 'min_copies', 'royalty_percentage']
+
+# Column order of payments.csv, the ledger of royalty payments made to clients
+PAYMENT_COLUMNS = ['date', 'username', 'amount', 'reference']
+
+# Cached aggregates, each a (version, value) pair replaced in one assignment
+# so a reader never sees a value with another value's version
+
+# Copies sold and last sale date per book, by the sales version they were counted from
+_sales_totals = None
+
+# Royalties earned and paid per client, by the data version they were counted from
+_balances = None
+
+# Per-book seasonality cube, by the sales version it was built from
+_seasonality = None
+
+# Sales cube of (day, book) cells, by the sales version it was built from
+_sales_cube = None
+
+def _cache_get(cache, version):
+    """Return the value of a (version, value) cache if it was built from `version`, else None."""
+    if cache is not None and cache[0] == version:
+        return cache[1]
+    return None
+
+def _cache_store(cache, version, value):
+    """Return the cache to keep after building `value` from `version`.
+    
+    A reader pinned to an older snapshot gets its value but doesn't
+    replace one built from newer data, so sessions on different versions
+    don't keep rebuilding each other's caches.
+    """
+    if cache is not None and storage.is_older(version, cache[0]):
+        return cache
+    return (version, value)
+
+# Aggregates saved by rebuild_aggregates() (e.g. from the CLI), so processes
+# starting on data that hasn't changed since load them instead of scanning sales
+AGGREGATES_DIR = 'data/aggregates'
+
+def _save_aggregate(name, version, value):
+    """Save an aggregate built from `version` to data/aggregates/<name>.pkl."""
+    os.makedirs(AGGREGATES_DIR, exist_ok=True)
+    with storage.atomic_writer(os.path.join(AGGREGATES_DIR, f'{name}.pkl'), binary=True) as aggregate_file:
+        # The version goes first so a stale file is rejected without loading the value
+        pickle.dump(version, aggregate_file, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(value, aggregate_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _load_aggregate(name, version):
+    """Return the saved aggregate if it was built from `version`, else None."""
+    try:
+        with open(os.path.join(AGGREGATES_DIR, f'{name}.pkl'), 'rb') as aggregate_file:
+            if pickle.load(aggregate_file) != version:
+                return None
+            return pickle.load(aggregate_file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Error loading saved aggregate {name}: {e}")
+        return None
+
+def _write_table(name, df):
+    """Replace data/<name>.csv with a DataFrame and publish the new version.
+    
+    The file is written beside the old one and swapped in, so readers
+    holding the old version keep reading it undisturbed.
+    """
+    with storage.atomic_writer(f'data/{name}.csv') as table_file:
+        df.to_csv(table_file, index=False)
+    storage.bump_version(name)
+
+def _append_table(name, df):
+    """Append a DataFrame's rows to data/<name>.csv and publish them."""
+    with storage.appender(f'data/{name}.csv') as table_file:
+        df.to_csv(table_file, header=False, index=False)
+    storage.bump_version(name)
+
+def _seed_book_versions(books_df):
+    """Build an initial version for every book, effective from its publication date."""
+    if books_df.empty:
+        return pd.DataFrame(columns=BOOK_VERSION_COLUMNS)
+    
+    effective_dates = pd.to_datetime(books_df['publication_date'], errors='coerce').fillna(pd.Timestamp('1970-01-01'))
+    royalty_pct = books_df['royalty_percentage'] if 'royalty_percentage' in books_df.columns else 10.0
+    
+    return pd.DataFrame({
+        'book_id': books_df['id'].to_numpy(),
+        'effective_date': effective_dates.dt.strftime('%Y-%m-%d').to_numpy(),
+        'price': books_df['price'].to_numpy(),
+        'royalty_percentage': royalty_pct if np.isscalar(royalty_pct) else royalty_pct.to_numpy()
+    })[BOOK_VERSION_COLUMNS]
+
+def get_book_versions():
+    """Get the effective-dated price and royalty rate history of every book."""
+    if os.path.exists('data/book_versions.csv'):
+        return pd.read_csv(storage.open_table('book_versions'))
+    return _seed_book_versions(get_books())
+
+def get_book_history(book_id):
+    """Get the price and royalty rate versions of a single book, oldest first."""
+    versions = get_book_versions()
+    history = versions[versions['book_id'] == book_id]
+    return history.sort_values('effective_date', kind='mergesort').reset_index(drop=True)
+
+@storage.write_locked
+def _append_book_versions(new_versions):
+    """Append versions to book_versions.csv, creating it from books.csv if needed."""
+    versions = get_book_versions()
+    updated_versions = pd.concat([versions, new_versions[BOOK_VERSION_COLUMNS]], ignore_index=True)
+    _write_table('book_versions', updated_versions)
+
+def lookup_book_versions(sales_df, versions_df=None, books_df=None):
+    """Return the price and royalty rate in force for each sale on its date.
+    
+    Sales are matched to the latest version of their book whose effective
+    date is on or before the sale date with a sorted as-of join. Sales dated
+    before a book's first version use that first version, and books with no
+    versions at all fall back to their current values in books.csv (or a 10%
+    royalty). The result is aligned with sales_df's index.
+    """
+    if versions_df is None:
+        versions_df = get_book_versions()
+    
+    sales = pd.DataFrame({
+        'book_id': sales_df['book_id'].astype('int64').to_numpy(),
+        'date': pd.to_datetime(sales_df['date']).to_numpy(),
+        'position': np.arange(len(sales_df))
+    }).sort_values('date', kind='mergesort')
+    
+    versions = pd.DataFrame({
+        'book_id': versions_df['book_id'].astype('int64').to_numpy(),
+        'date': pd.to_datetime(versions_df['effective_date']).to_numpy(),
+        'price': versions_df['price'].astype(float).to_numpy(),
+        'royalty_percentage': versions_df['royalty_percentage'].astype(float).to_numpy()
+    }).sort_values('date', kind='mergesort')
+    
+    matched = pd.merge_asof(sales, versions, on='date', by='book_id', direction='backward')
+    
+    # Sales before a book's first version take the first version
+    first_versions = versions.drop_duplicates('book_id', keep='first').set_index('book_id')
+    for column in ['price', 'royalty_percentage']:
+        matched[column] = matched[column].fillna(matched['book_id'].map(first_versions[column]))
+    
+    # Books without any version fall back to the catalog
+    if books_df is None and matched['royalty_percentage'].isna().any():
+        books_df = get_books()
+    if books_df is not None and not books_df.empty:
+        catalog = books_df.set_index('id')
+        matched['price'] = matched['price'].fillna(matched['book_id'].map(catalog['price']))
+        if 'royalty_percentage' in catalog.columns:
+            matched['royalty_percentage'] = matched['royalty_percentage'].fillna(matched['book_id'].map(catalog['royalty_percentage']))
+    matched['royalty_percentage'] = matched['royalty_percentage'].fillna(10.0)
+    
+    matched = matched.sort_values('position')
+    return pd.DataFrame({
+        'price': matched['price'].to_numpy(),
+        'royalty_percentage': matched['royalty_percentage'].to_numpy()
+    }, index=sales_df.index)
+
+def get_royalty_schedules():
+    """Get the tiered royalty schedules of every book that has one."""
+    if os.path.exists('data/royalty_schedules.csv'):
+        return pd.read_csv(storage.open_table('royalty_schedules'))
+    return pd.DataFrame(columns=ROYALTY_SCHEDULE_COLUMNS)
+
+def get_royalty_schedule(book_id):
+    """Get a book's royalty tiers ordered by their starting copy count."""
+    schedules = get_royalty_schedules()
+    schedule = schedules[schedules['book_id'] == book_id]
+    return schedule.sort_values('min_copies').reset_index(drop=True)
+
+@storage.write_locked
+def set_royalty_schedule(book_id, tiers):
+    """Replace a book's royalty schedule and re-rate its sales.
+    
+    tiers is a list of (min_copies, royalty_percentage) pairs; the first
+    tier must start at 0 copies. An empty list removes the schedule so the
+    book's flat royalty percentage applies again.
+    """
+    tiers = sorted((int(min_copies), float(percentage)) for min_copies, percentage in tiers)
+    
+    if tiers and tiers[0][0] != 0:
+        return False, "The first tier must start at 0 copies."
+    if len({min_copies for min_copies, _ in tiers}) != len(tiers):
+        return False, "Each tier must start at a different copy count."
+    if any(percentage < 0 or percentage > 100 for _, percentage in tiers):
+        return False, "Royalty percentages must be between 0 and 100."
+    
+    schedules = get_royalty_schedules()
+    schedules = schedules[schedules['book_id'] != book_id]
+    new_tiers = pd.DataFrame(
+        [(book_id, min_copies, percentage) for min_copies, percentage in tiers],
+        columns=ROYALTY_SCHEDULE_COLUMNS
+    )
+    if not schedules.empty:
+        new_tiers = pd.concat([schedules, new_tiers], ignore_index=True)
+    _write_table('royalty_schedules', new_tiers)
+    
+    recompute_royalties(book_ids=[book_id])
+    
+    return True, "Royalty schedule saved successfully!"
+
+def calculate_tiered_royalties(sales_df, schedules_df, copies_before=None):
+    """Return royalties for sales of books with tiered schedules.
+    
+    Sales are ordered by date within each book (ties keep their original
+    order) and a running copy count is taken, offset by copies_before, a
+    Series of copies already sold per book. Each sale is then intersected
+    with every tier of its book, so a sale that straddles a tier boundary
+    earns each tier's rate on the copies that fall inside it. The result
+    is aligned with sales_df's index.
+    """
+    sales = pd.DataFrame({
+        'position': np.arange(len(sales_df)),
+        'book_id': sales_df['book_id'].astype('int64').to_numpy(),
+        'date': pd.to_datetime(sales_df['date']).to_numpy(),
+        'quantity': sales_df['quantity'].astype('int64').to_numpy(),
+        'revenue': sales_df['revenue'].astype(float).to_numpy()
+    }).sort_values(['book_id', 'date'], kind='mergesort')
+    
+    # Running copy count at the end and start of each sale
+    copies_end = sales.groupby('book_id')['quantity'].cumsum()
+    if copies_before is not None:
+        copies_end = copies_end + sales['book_id'].map(copies_before).fillna(0)
+    sales['copies_end'] = copies_end
+    sales['copies_start'] = copies_end - sales['quantity']
+    
+    # Each tier runs from its min_copies up to the next tier's min_copies
+    tiers = pd.DataFrame({
+        'book_id': schedules_df['book_id'].astype('int64').to_numpy(),
+        'min_copies': schedules_df['min_copies'].astype(float).to_numpy(),
+        'royalty_percentage': schedules_df['royalty_percentage'].astype(float).to_numpy()
+    }).sort_values(['book_id', 'min_copies'])
+    tiers['max_copies'] = tiers.groupby('book_id')['min_copies'].shift(-1).fillna(np.inf)
+    tiers.loc[tiers.groupby('book_id').cumcount() == 0, 'min_copies'] = 0
+    
+    matched = sales.merge(tiers, on='book_id')
+    copies_in_tier = (
+        np.minimum(matched['copies_end'], matched['max_copies'])
+        - np.maximum(matched['copies_start'], matched['min_copies'])
+    ).clip(lower=0)
+    unit_revenue = (matched['revenue'] / matched['quantity']).where(matched['quantity'] != 0, 0)
+    matched['royalty'] = copies_in_tier * unit_revenue * (matched['royalty_percentage'] / 100)
+    
+    royalties = matched.groupby('position')['royalty'].sum().reindex(np.arange(len(sales_df)))
+    return pd.Series(royalties.to_numpy(), index=sales_df.index)
+
+def calculate_royalties(sales_df, books_df=None, versions_df=None, schedules_df=None, copies_before=None):
+    """Return the royalty for each sale from its revenue and the royalty rate in force on its date.
+    
+    Books with a tiered schedule are rated by cumulative copies sold
+    instead, treating sales_df as the sales that follow copies_before
+    copies per book (by default, as the book's whole sales history).
+    """
+    if sales_df.empty:
+        return pd.Series(dtype='float64', index=sales_df.index)
+    
+    rates = lookup_book_versions(sales_df, versions_df, books_df)
+    royalties = sales_df['revenue'] * (rates['royalty_percentage'] / 100)
+    
+    if schedules_df is None:
+        schedules_df = get_royalty_schedules()
+    tiered = sales_df['book_id'].isin(schedules_df['book_id'])
+    if tiered.any():
+        royalties[tiered] = calculate_tiered_royalties(sales_df[tiered], schedules_df, copies_before)
+    
+    return royalties
+
+def _count_sales_totals(sales_df):
+    """Return copies sold and last sale date per book for a frame of sales."""
+    return sales_df.assign(date=pd.to_datetime(sales_df['date'])).groupby('book_id').agg(
+        copies=('quantity', 'sum'),
+        last_date=('date', 'max')
+    )
+
+def get_sales_totals(chunksize=100000):
+    """Get copies sold and last sale date per book.
+    
+    The totals are counted once per sales version and then kept up to
+    date by append_sales and add_sale, so tiered royalties for new sales
+    don't need a scan of the full sales history.
+    """
+    global _sales_totals
+    
+    # Count from the same version the cache is labelled with
+    with storage.snapshot():
+        version = get_table_version('sales')
+        totals = _cache_get(_sales_totals, version)
+        if totals is not None:
+            return totals
+        
+        totals = _count_sales_totals(pd.DataFrame(columns=['date', 'book_id', 'quantity']))
+        if os.path.exists('data/sales.csv'):
+            partial_totals = [
+                _count_sales_totals(chunk)
+                for chunk in pd.read_csv(storage.open_table('sales'), usecols=['date', 'book_id', 'quantity'], chunksize=chunksize)
+            ]
+            if partial_totals:
+                totals = pd.concat(partial_totals).groupby(level=0).agg({'copies': 'sum', 'last_date': 'max'})
+    
+    _sales_totals = _cache_store(_sales_totals, version, totals)
+    return totals
+
+def _apply_sales_appended(previous_version, current_version, new_sales):
+    """Add appended sales to the cached totals if they were counted from previous_version."""
+    global _sales_totals
+    
+    totals = _cache_get(_sales_totals, previous_version)
+    if totals is None:
+        return
+    
+    if not new_sales.empty:
+        combined = pd.concat([totals, _count_sales_totals(new_sales)]) if not totals.empty else _count_sales_totals(new_sales)
+        totals = combined.groupby(level=0).agg({'copies': 'sum', 'last_date': 'max'})
+    _sales_totals = (current_version, totals)
+
+def _rerate_backdated_sales(new_sales, totals, schedules_df):
+    """Re-rate tiered books that received sales dated before their latest existing sale.
+    
+    A backdated sale moves every later sale of its book further along the
+    schedule, so those books are recomputed from their full history.
+    """
+    tiered = new_sales[new_sales['book_id'].isin(schedules_df['book_id'])]
+    if tiered.empty:
+        return
+    
+    last_dates = tiered['book_id'].map(totals['last_date'])
+    backdated = tiered.loc[pd.to_datetime(tiered['date']) < last_dates, 'book_id'].unique()
+    if len(backdated):
+        recompute_royalties(book_ids=backdated.tolist())
+
+@storage.write_locked
 def update_sales_royalties():
     """Update all sales with royalty calculations if they're missing."""
     if not os.path.exists('data/sales.csv') or not os.path.exists('data/books.csv'):
         return
     
-    sales_df = pd.read_csv('data/sales.csv')
-    books_df = pd.read_csv('data/books.csv')
+    sales_df = pd.read_csv(storage.open_table('sales'))
+    books_df = pd.read_csv(storage.open_table('books'))
     
     # Check if we need to update royalties
     if 'royalty' not in sales_df.columns or sales_df['royalty'].isna().any():
@@ -21,29 +363,16 @@ def update_sales_royalties():
         if 'royalty_percentage' not in books_df.columns:
             # Add default royalty percentage if missing
             books_df['royalty_percentage'] = 10.0
-            books_df.to_csv('data/books.csv', index=False)
+            _write_table('books', books_df)
         
-        # Create a dictionary mapping book_id to royalty_percentage
-        royalty_map = dict(zip(books_df['id'], books_df['royalty_percentage']))
-        
-        # Calculate royalty for each sale
-        for idx, row in sales_df.iterrows():
-            book_id = row['book_id']
-            revenue = row['revenue']
-            
-            # Get royalty percentage for this book (default to 10%)
-            royalty_pct = royalty_map.get(book_id, 10.0)
-            
-            # Calculate royalty
-            royalty = revenue * (royalty_pct / 100)
-            
-            # Update the dataframe
-            sales_df.at[idx, 'royalty'] = royalty
+        # Calculate royalty for every sale in one pass
+        sales_df['royalty'] = calculate_royalties(sales_df, books_df)
         
         # Save updated sales data
-        sales_df.to_csv('data/sales.csv', index=False)
+        _write_table('sales', sales_df)
         print("Royalty values updated successfully.")
 
+@storage.write_locked
 def initialize_data():
     """Initialize default data if it doesn't exist."""
     if not os.path.exists('data'):
@@ -112,7 +441,7 @@ def initialize_data():
         }
         
         books_df = pd.DataFrame(books_data)
-        books_df.to_csv('data/books.csv', index=False)
+        _write_table('books', books_df)
     
     # Initialize sales data
     if not os.path.exists('data/sales.csv'):
@@ -120,7 +449,7 @@ def initialize_data():
         sales_data = []
         today = datetime.now()
         
-        books_df = pd.read_csv('data/books.csv')
+        books_df = pd.read_csv(storage.open_table('books'))
         book_ids = books_df['id'].tolist()
         
         # Generate random sales data for the past year
@@ -156,12 +485,20 @@ def initialize_data():
             })
         
         sales_df = pd.DataFrame(sales_data)
-        sales_df.to_csv('data/sales.csv', index=False)
+        _write_table('sales', sales_df)
+
+def get_table_version(name):
+    """Return a token identifying the current contents of data/<name>.csv, shared across processes."""
+    return storage.table_version(name)
+
+def get_data_version():
+    """Return a token that changes whenever books or sales data is rewritten."""
+    return (get_table_version('books'), get_table_version('sales'))
 
 def get_books():
     """Get all books from the dataset."""
     if os.path.exists('data/books.csv'):
-        return pd.read_csv('data/books.csv')
+        return pd.read_csv(storage.open_table('books'))
     return pd.DataFrame()
 
 def get_user_books(username):
@@ -180,9 +517,10 @@ def get_user_books(username):
 def get_sales():
     """Get all sales from the dataset."""
     if os.path.exists('data/sales.csv'):
-        return pd.read_csv('data/sales.csv')
+        return pd.read_csv(storage.open_table('sales'))
     return pd.DataFrame()
 
+@storage.write_locked
 def add_book(title, author, genre, owner, price, publication_date, isbn='', royalty_percentage=10.0):
     """Add a new book to the dataset."""
     books_df = get_books()
@@ -206,14 +544,138 @@ def add_book(title, author, genre, owner, price, publication_date, isbn='', roya
         'publication_date': [publication_date]
     })
     
+    # Record the opening price and royalty rate in the version history
+    _append_book_versions(_seed_book_versions(new_book))
+    
     # Append to existing books
+    previous_version = get_table_version('books')
     updated_books = pd.concat([books_df, new_book], ignore_index=True)
-    updated_books.to_csv('data/books.csv', index=False)
+    _write_table('books', updated_books)
+    
+    # Keep the search index in step with the catalog
+    import search
+    search.apply_book_change(previous_version, get_table_version('books'), int(new_id), new_book.iloc[0].to_dict())
     
     return new_id
 
-def update_book(book_id, title, author, genre, owner, price, publication_date, isbn=None, royalty_percentage=None):
-    """Update an existing book in the dataset."""
+def validate_book_import(import_df):
+    """Validate a batch of books for import.
+    
+    Returns a tuple of (valid_books, rejections) where valid_books holds the
+    normalised rows that passed every check and rejections lists each failed
+    row with its 1-based row number and the reasons it was rejected.
+    """
+    books = import_df.copy()
+    books.columns = [str(col).strip().lower() for col in books.columns]
+    
+    # Optional columns fall back to the same defaults as add_book
+    for column, default in [('author', ''), ('genre', 'Other'), ('isbn', ''), ('royalty_percentage', 10.0)]:
+        if column not in books.columns:
+            books[column] = default
+    
+    for column in ['title', 'author', 'genre', 'owner', 'isbn', 'publication_date']:
+        if column not in books.columns:
+            books[column] = ''
+        books[column] = books[column].fillna('').astype(str).str.strip()
+    books.loc[books['genre'] == '', 'genre'] = 'Other'
+    
+    if 'price' not in books.columns:
+        books['price'] = np.nan
+    books['price'] = pd.to_numeric(books['price'], errors='coerce')
+    books['royalty_percentage'] = pd.to_numeric(books['royalty_percentage'], errors='coerce').fillna(10.0)
+    
+    publication_dates = pd.to_datetime(books['publication_date'], format='%Y-%m-%d', errors='coerce')
+    
+    # Existing catalog state used for cross-checks
+    existing_books = get_books()
+    existing_isbns = set()
+    if not existing_books.empty and 'isbn' in existing_books.columns:
+        existing_isbns = set(existing_books['isbn'].dropna().astype(str).str.replace(r'[\s-]', '', regex=True))
+    clients = get_clients()
+    client_names = clients['username'].tolist() if not clients.empty else []
+    
+    normalised_isbns = books['isbn'].str.replace(r'[\s-]', '', regex=True)
+    has_isbn = normalised_isbns != ''
+    
+    # Each check is a boolean mask over the whole batch
+    checks = [
+        (books['title'] == '', "missing title"),
+        (books['author'] == '', "missing author"),
+        (books['owner'] == '', "missing owner"),
+        ((books['owner'] != '') & ~books['owner'].isin(client_names), "unknown owner"),
+        (books['price'].isna(), "invalid price"),
+        ((books['price'] < 0) | (books['price'] > 100000), "price out of range"),
+        ((books['royalty_percentage'] < 0) | (books['royalty_percentage'] > 100), "royalty percentage out of range"),
+        (publication_dates.isna(), "invalid publication date"),
+        (has_isbn & ~utils.validate_isbns(books['isbn']), "invalid ISBN checksum"),
+        (has_isbn & normalised_isbns.isin(existing_isbns), "ISBN already in catalog"),
+        (has_isbn & normalised_isbns.duplicated(keep='first'), "duplicate ISBN in file"),
+    ]
+    
+    reasons = pd.Series('', index=books.index)
+    for mask, message in checks:
+        mask = mask.fillna(False)
+        reasons = reasons.where(~mask, reasons + '; ' + message)
+    reasons = reasons.str.lstrip('; ')
+    rejected = reasons != ''
+    
+    rejections = pd.DataFrame({
+        'row': np.flatnonzero(rejected.to_numpy()) + 1,
+        'title': books.loc[rejected, 'title'].to_numpy(),
+        'reason': reasons[rejected].to_numpy()
+    })
+    
+    # Only the catalog columns are kept: an incoming id (e.g. from an exported
+    # catalog) is dropped, since import_books allocates new IDs
+    columns = ['title', 'author', 'genre', 'owner', 'isbn', 'royalty_percentage', 'price', 'publication_date']
+    valid_books = books.loc[~rejected, columns].copy()
+    valid_books['publication_date'] = publication_dates[~rejected].dt.strftime('%Y-%m-%d')
+    
+    return valid_books, rejections
+
+@storage.write_locked
+def import_books(import_df):
+    """Import a batch of books in a single write.
+    
+    Rows are validated with validate_book_import; the valid ones are given a
+    contiguous block of new IDs and appended to books.csv in one write.
+    Returns a tuple of (imported_books, rejections).
+    """
+    valid_books, rejections = validate_book_import(import_df)
+    
+    if valid_books.empty:
+        return valid_books, rejections
+    
+    books_df = get_books()
+    
+    # Allocate a contiguous block of IDs after the current maximum
+    first_id = 1 if books_df.empty else int(books_df['id'].max()) + 1
+    valid_books.insert(0, 'id', np.arange(first_id, first_id + len(valid_books)))
+    
+    columns = ['id', 'title', 'author', 'genre', 'owner', 'isbn', 'royalty_percentage', 'price', 'publication_date']
+    new_books = valid_books[columns].reset_index(drop=True)
+    
+    # Record the opening prices and royalty rates in the version history
+    _append_book_versions(_seed_book_versions(new_books))
+    
+    previous_version = get_table_version('books')
+    updated_books = pd.concat([books_df, new_books], ignore_index=True)
+    _write_table('books', updated_books)
+    
+    # Keep the search index in step with the catalog
+    import search
+    search.apply_books_added(previous_version, get_table_version('books'), new_books)
+    
+    return new_books, rejections
+
+@storage.write_locked
+def update_book(book_id, title, author, genre, owner, price, publication_date, isbn=None, royalty_percentage=None, effective_date=None):
+    """Update an existing book in the dataset.
+    
+    A change of price or royalty percentage is recorded as a new version
+    effective from effective_date (default today), so sales before that
+    date keep the price and rate that applied when they were made.
+    """
     books_df = get_books()
     
     if books_df.empty:
@@ -225,6 +687,24 @@ def update_book(book_id, title, author, genre, owner, price, publication_date, i
     if len(book_index) == 0:
         return False
     
+    # Detect price and royalty rate changes before overwriting them
+    current_book = books_df.loc[book_index[0]]
+    new_royalty = royalty_percentage if royalty_percentage is not None else current_book.get('royalty_percentage', 10.0)
+    rate_changed = (
+        not np.isclose(float(current_book['price']), float(price))
+        or not np.isclose(float(current_book.get('royalty_percentage', 10.0)), float(new_royalty))
+    )
+    
+    if rate_changed:
+        if effective_date is None:
+            effective_date = datetime.now().strftime('%Y-%m-%d')
+        _append_book_versions(pd.DataFrame({
+            'book_id': [book_id],
+            'effective_date': [effective_date],
+            'price': [price],
+            'royalty_percentage': [new_royalty]
+        }))
+    
     # Update book details
     books_df.loc[book_index, 'title'] = title
     books_df.loc[book_index, 'author'] = author
@@ -240,10 +720,20 @@ def update_book(book_id, title, author, genre, owner, price, publication_date, i
     if royalty_percentage is not None and 'royalty_percentage' in books_df.columns:
         books_df.loc[book_index, 'royalty_percentage'] = royalty_percentage
     
-    books_df.to_csv('data/books.csv', index=False)
+    previous_version = get_table_version('books')
+    _write_table('books', books_df)
+    
+    # Keep the search index in step with the catalog
+    import search
+    search.apply_book_change(previous_version, get_table_version('books'), int(book_id), books_df.loc[book_index[0]].to_dict())
+    
+    # Re-rate sales made on or after the effective date
+    if rate_changed:
+        recompute_royalties(book_ids=[book_id])
     
     return True
 
+@storage.write_locked
 def delete_book(book_id):
     """Delete a book from the dataset."""
     books_df = get_books()
@@ -256,17 +746,31 @@ def delete_book(book_id):
         return False
     
     # Remove book
+    previous_version = get_table_version('books')
     books_df = books_df[books_df['id'] != book_id]
-    books_df.to_csv('data/books.csv', index=False)
+    _write_table('books', books_df)
+    
+    # Keep the search index in step with the catalog
+    import search
+    search.apply_book_change(previous_version, get_table_version('books'), int(book_id))
     
-    # Remove associated sales
+    # Remove associated sales and version history
     sales_df = get_sales()
     if not sales_df.empty:
         sales_df = sales_df[sales_df['book_id'] != book_id]
-        sales_df.to_csv('data/sales.csv', index=False)
+        _write_table('sales', sales_df)
+    
+    if os.path.exists('data/book_versions.csv'):
+        versions = get_book_versions()
+        _write_table('book_versions', versions[versions['book_id'] != book_id])
+    
+    if os.path.exists('data/royalty_schedules.csv'):
+        schedules = get_royalty_schedules()
+        _write_table('royalty_schedules', schedules[schedules['book_id'] != book_id])
     
     return True
 
+@storage.write_locked
 def add_sale(book_id, date, quantity, price=None):
     """Add a new sale to the dataset."""
     sales_df = get_sales()
@@ -277,18 +781,10 @@ def add_sale(book_id, date, quantity, price=None):
     if book.empty:
         return False
     
-    # If price is not provided, use the book's current price
+    # If price is not provided, use the book's price on the sale date
     if price is None:
-        price = book.iloc[0]['price']
-    
-    # Get royalty percentage (default to 10% if not available)
-    royalty_percentage = 10.0
-    if 'royalty_percentage' in book.columns:
-        royalty_percentage = book.iloc[0]['royalty_percentage']
-    
-    # Calculate revenue and royalty
-    revenue = quantity * price
-    royalty = revenue * (royalty_percentage / 100)
+        rates = lookup_book_versions(pd.DataFrame({'book_id': [book_id], 'date': [date]}), books_df=books_df)
+        price = rates['price'].iloc[0]
     
     # Create new sale entry
     new_sale = pd.DataFrame({
@@ -296,16 +792,299 @@ def add_sale(book_id, date, quantity, price=None):
         'book_id': [book_id],
         'quantity': [quantity],
         'price': [price],
-        'revenue': [revenue],
-        'royalty': [royalty]
+        'revenue': [quantity * price]
     })
     
+    # Calculate royalty, continuing the book's tiers from the copies already sold
+    schedules_df = get_royalty_schedules()
+    totals = get_sales_totals()
+    new_sale['royalty'] = calculate_royalties(new_sale, books_df, schedules_df=schedules_df, copies_before=totals['copies'])
+    
+    # Make sure the anomaly detector is current before the write so it sees the new sale
+    import anomalies
+    anomalies.get_detector()
+    
     # Append to existing sales
+    previous_version = get_table_version('sales')
+    previous_balances_version = _balances_source_version()
     updated_sales = pd.concat([sales_df, new_sale], ignore_index=True)
-    updated_sales.to_csv('data/sales.csv', index=False)
+    _write_table('sales', updated_sales)
+    _apply_sales_appended(previous_version, get_table_version('sales'), new_sale)
+    _apply_seasonality_sales(previous_version, get_table_version('sales'), new_sale)
+    _apply_cube_sales(previous_version, get_table_version('sales'), new_sale)
+    anomalies.apply_sales(previous_version, get_table_version('sales'), new_sale, books_df)
+    
+    import sketches
+    sketches.apply_sales(previous_version, get_table_version('sales'), new_sale)
+    
+    import leaderboards
+    leaderboards.apply_sales(previous_version, get_table_version('sales'), new_sale)
+    _apply_balance_changes(
+        previous_balances_version, _balances_source_version(),
+        earned=pd.Series({book.iloc[0]['owner']: new_sale['royalty'].iloc[0]})
+    )
+    
+    _rerate_backdated_sales(new_sale, totals, schedules_df)
     
     return True
 
+def prepare_sales(import_df, books_df=None):
+    """Validate and complete a batch of sales for import.
+    
+    Missing prices are filled with the book's price on the sale date, and revenue
+    and royalty are calculated for every row. Returns a tuple of
+    (valid_sales, rejections) where rejections lists each failed row with
+    its 1-based row number and the reasons it was rejected.
+    """
+    if books_df is None:
+        books_df = get_books()
+    
+    sales = import_df.copy()
+    sales.columns = [str(col).strip().lower() for col in sales.columns]
+    for column in ['date', 'book_id', 'quantity', 'price']:
+        if column not in sales.columns:
+            sales[column] = np.nan
+    
+    book_ids = pd.to_numeric(sales['book_id'], errors='coerce')
+    quantities = pd.to_numeric(sales['quantity'], errors='coerce')
+    dates = pd.to_datetime(sales['date'], format='%Y-%m-%d', errors='coerce')
+    
+    known_books = books_df['id'] if not books_df.empty else pd.Series(dtype='int64')
+    prices = pd.to_numeric(sales['price'], errors='coerce')
+    
+    # Missing prices default to the book's price on the sale date
+    priceable = prices.isna() & dates.notna() & book_ids.isin(known_books)
+    if priceable.any():
+        versions_df = get_book_versions()
+        rates = lookup_book_versions(
+            pd.DataFrame({'book_id': book_ids[priceable], 'date': dates[priceable]}),
+            versions_df, books_df
+        )
+        prices[priceable] = rates['price']
+    
+    # Each check is a boolean mask over the whole batch
+    checks = [
+        (dates.isna(), "invalid date"),
+        (book_ids.isna(), "invalid book ID"),
+        (book_ids.notna() & ~book_ids.isin(known_books), "unknown book"),
+        (quantities.isna() | (quantities <= 0) | (quantities % 1 != 0), "invalid quantity"),
+        ((book_ids.isin(known_books) & prices.isna()) | (prices < 0), "invalid price"),
+    ]
+    
+    reasons = pd.Series('', index=sales.index)
+    for mask, message in checks:
+        reasons = reasons.where(~mask, reasons + '; ' + message)
+    reasons = reasons.str.lstrip('; ')
+    rejected = reasons != ''
+    
+    rejections = pd.DataFrame({
+        'row': np.flatnonzero(rejected.to_numpy()) + 1,
+        'reason': reasons[rejected].to_numpy()
+    })
+    
+    valid = ~rejected
+    valid_sales = pd.DataFrame({
+        'date': dates[valid].dt.strftime('%Y-%m-%d'),
+        'book_id': book_ids[valid].astype('int64'),
+        'quantity': quantities[valid].astype('int64'),
+        'price': prices[valid]
+    })
+    valid_sales['revenue'] = valid_sales['quantity'] * valid_sales['price']
+    # Tiered royalties continue from the copies already sold
+    schedules_df = get_royalty_schedules()
+    copies_before = get_sales_totals()['copies'] if valid_sales['book_id'].isin(schedules_df['book_id']).any() else None
+    valid_sales['royalty'] = calculate_royalties(
+        valid_sales, books_df, versions_df if priceable.any() else None, schedules_df, copies_before
+    )
+    
+    return valid_sales[SALES_COLUMNS].reset_index(drop=True), rejections
+
+@storage.write_locked
+def append_sales(import_df, books_df=None):
+    """Validate a batch of sales and append the valid rows to sales.csv.
+    
+    Rows are appended to the end of the file instead of rewriting it, so
+    large imports can be fed in chunks with bounded memory. Returns a tuple
+    of (appended_sales, rejections).
+    """
+    if books_df is None:
+        books_df = get_books()
+    
+    valid_sales, rejections = prepare_sales(import_df, books_df)
+    
+    if valid_sales.empty:
+        return valid_sales, rejections
+    
+    totals = get_sales_totals()
+    
+    # Make sure the anomaly detector is current before the write so it sees the new sales
+    import anomalies
+    anomalies.get_detector()
+    
+    previous_version = get_table_version('sales')
+    previous_balances_version = _balances_source_version()
+    
+    if os.path.exists('data/sales.csv') and os.path.getsize('data/sales.csv') > 0:
+        # Match the column order of the existing file
+        columns = pd.read_csv(storage.open_table('sales'), nrows=0).columns.tolist()
+        _append_table('sales', valid_sales.reindex(columns=columns))
+    else:
+        _write_table('sales', valid_sales)
+    
+    _apply_sales_appended(previous_version, get_table_version('sales'), valid_sales)
+    _apply_seasonality_sales(previous_version, get_table_version('sales'), valid_sales)
+    _apply_cube_sales(previous_version, get_table_version('sales'), valid_sales)
+    anomalies.apply_sales(previous_version, get_table_version('sales'), valid_sales, books_df)
+    
+    import sketches
+    sketches.apply_sales(previous_version, get_table_version('sales'), valid_sales)
+    
+    import leaderboards
+    leaderboards.apply_sales(previous_version, get_table_version('sales'), valid_sales)
+    _apply_balance_changes(
+        previous_balances_version, _balances_source_version(),
+        earned=valid_sales['royalty'].groupby(valid_sales['book_id'].map(books_df.set_index('id')['owner'])).sum()
+    )
+    _rerate_backdated_sales(valid_sales, totals, get_royalty_schedules())
+    
+    return valid_sales, rejections
+
+def _scheduled_royalties(chunksize=100000, book_ids=None, schedules_df=None):
+    """Compute tiered royalties for every sale of a book with a schedule.
+    
+    Tiers depend on each book's whole sales history in date order, which a
+    single chunked pass can't see, so the tiered books' sales are gathered
+    first (only the columns the tiers need) and rated together. Returns a
+    Series of royalties indexed by row number in sales.csv.
+    """
+    if schedules_df is None:
+        schedules_df = get_royalty_schedules()
+    
+    scheduled_books = schedules_df['book_id']
+    if book_ids is not None:
+        scheduled_books = scheduled_books[scheduled_books.isin(book_ids)]
+    
+    if scheduled_books.empty or not os.path.exists('data/sales.csv'):
+        return pd.Series(dtype='float64')
+    
+    tiered_sales = [
+        chunk[chunk['book_id'].isin(scheduled_books)]
+        for chunk in pd.read_csv(storage.open_table('sales'), usecols=['date', 'book_id', 'quantity', 'revenue'], chunksize=chunksize)
+    ]
+    tiered_sales = pd.concat(tiered_sales) if tiered_sales else pd.DataFrame()
+    
+    if tiered_sales.empty:
+        return pd.Series(dtype='float64')
+    
+    return calculate_tiered_royalties(tiered_sales, schedules_df)
+
+@storage.write_locked
+def recompute_royalties(chunksize=100000, book_ids=None):
+    """Recalculate royalties from the rates in force on each sale's date.
+    
+    Sales are processed in chunks and streamed to a temporary file that
+    replaces sales.csv at the end, so memory use is bounded by the chunk
+    size. When book_ids is given only those books' sales are re-rated.
+    Returns the number of sales recalculated.
+    """
+    if not os.path.exists('data/sales.csv'):
+        return 0
+    
+    books_df = get_books()
+    versions_df = get_book_versions()
+    schedules_df = get_royalty_schedules()
+    tiered_royalties = _scheduled_royalties(chunksize, book_ids, schedules_df)
+    processed = 0
+    rows_written = 0
+    
+    # Quantities are unchanged, so the sales totals carry over to the new file
+    previous_version = get_table_version('sales')
+    with storage.atomic_writer('data/sales.csv') as temp_file:
+        for chunk_number, chunk in enumerate(pd.read_csv(storage.open_table('sales'), chunksize=chunksize)):
+            selected = chunk['book_id'].isin(book_ids) if book_ids is not None else pd.Series(True, index=chunk.index)
+            if selected.any():
+                chunk.loc[selected, 'royalty'] = calculate_royalties(chunk[selected], books_df, versions_df, schedules_df.iloc[0:0])
+                tiered = chunk.index.intersection(tiered_royalties.index)
+                chunk.loc[tiered, 'royalty'] = tiered_royalties[tiered]
+                processed += int(selected.sum())
+            chunk.to_csv(temp_file, header=chunk_number == 0, index=False)
+            rows_written += len(chunk)
+        
+        if rows_written == 0:
+            pd.DataFrame(columns=SALES_COLUMNS).to_csv(temp_file, index=False)
+    
+    storage.bump_version('sales')
+    _apply_sales_appended(previous_version, get_table_version('sales'), pd.DataFrame())
+    
+    return processed
+
+def check_integrity(chunksize=100000):
+    """Check books.csv and sales.csv for inconsistencies.
+    
+    Sales are scanned in chunks so memory use is bounded by the chunk size.
+    Returns a list of (check, count) tuples for every check that found
+    problems; an empty list means the data is consistent.
+    """
+    problems = {}
+    
+    def record(check, count):
+        if count:
+            problems[check] = problems.get(check, 0) + int(count)
+    
+    books_df = get_books()
+    versions_df = get_book_versions()
+    schedules_df = get_royalty_schedules()
+    tiered_royalties = _scheduled_royalties(chunksize, schedules_df=schedules_df)
+    clients = get_clients()
+    client_names = clients['username'].tolist() if not clients.empty else []
+    
+    if not books_df.empty:
+        record("duplicate book IDs", books_df['id'].duplicated().sum())
+        record("books owned by unknown clients", (~books_df['owner'].isin(client_names)).sum())
+        record("books with invalid prices", (pd.to_numeric(books_df['price'], errors='coerce').isna() | (books_df['price'] < 0)).sum())
+    
+    if os.path.exists('data/sales.csv'):
+        known_books = books_df['id'] if not books_df.empty else pd.Series(dtype='int64')
+        
+        for chunk in pd.read_csv(storage.open_table('sales'), chunksize=chunksize):
+            dates = pd.to_datetime(chunk['date'], format='%Y-%m-%d', errors='coerce')
+            record("sales with invalid dates", dates.isna().sum())
+            record("sales for unknown books", (~chunk['book_id'].isin(known_books)).sum())
+            record("sales with non-positive quantities", (chunk['quantity'] <= 0).sum())
+            record("sales whose revenue is not quantity x price", (~np.isclose(chunk['revenue'], chunk['quantity'] * chunk['price'], atol=0.01)).sum())
+            
+            if 'royalty' in chunk.columns:
+                expected = calculate_royalties(chunk, books_df, versions_df, schedules_df.iloc[0:0])
+                tiered = chunk.index.intersection(tiered_royalties.index)
+                expected[tiered] = tiered_royalties[tiered]
+                record("sales with missing royalties", chunk['royalty'].isna().sum())
+                record("sales with outdated royalties", (chunk['royalty'].notna() & ~np.isclose(chunk['royalty'], expected, atol=0.01)).sum())
+            else:
+                record("sales with missing royalties", len(chunk))
+    
+    return list(problems.items())
+
+# Functions that rebuild derived aggregates from the raw data and save them, keyed by name
+AGGREGATE_BUILDERS = {}
+
+def rebuild_aggregates(names=None):
+    """Rebuild derived aggregates from the data files and save them under data/aggregates.
+    
+    Each is saved with the data version it was built from. Any process
+    that needs the aggregate while the data is still at that version
+    loads it instead of scanning sales; after a write it is rebuilt in
+    memory as usual and the saved copy is ignored until the next rebuild.
+    Returns the names of the aggregates that were rebuilt.
+    """
+    rebuilt = []
+    for name, builder in AGGREGATE_BUILDERS.items():
+        if names is None or name in names:
+            builder()
+            rebuilt.append(name)
+    
+    return rebuilt
+
+@storage.write_locked
 def delete_sale(index):
     """Delete a sale from the dataset."""
     sales_df = get_sales()
@@ -314,8 +1093,13 @@ def delete_sale(index):
         return False
     
     # Drop the sale by index
+    book_id = sales_df.loc[index, 'book_id']
     sales_df = sales_df.drop(index)
-    sales_df.to_csv('data/sales.csv', index=False)
+    _write_table('sales', sales_df)
+    
+    # Later sales of a tiered book move back down its schedule
+    if book_id in get_royalty_schedules()['book_id'].values:
+        recompute_royalties(book_ids=[book_id])
     
     return True
 
@@ -364,61 +1148,64 @@ def filter_sales_by_time_period(username, time_period):
     # Filter by date range
     return sales_df[sales_df['date'] >= start_date]
 
-def get_sales_trend(username, time_period):
-    """Get sales trend data for visualization."""
-    sales_df = filter_sales_by_time_period(username, time_period)
-    
+# Upper bound on the number of points a trend chart sends to the browser
+TREND_MAX_POINTS = 500
+
+def build_sales_trend(sales_df, granularity='auto', max_points=TREND_MAX_POINTS):
+    """Aggregate sales quantities into a zero-filled trend series.
+    
+    With granularity='auto' the resample rule is picked from the span of the
+    sales dates (see utils.choose_trend_granularity). The series is then reduced to at most
+    max_points with LTTB downsampling. The chosen rule is stored in
+    result.attrs['granularity'].
+    """
     if sales_df.empty:
-        return pd.DataFrame(columns=['date', 'sales'])
-    
-    # Group by date and sum quantities
-    sales_by_date = sales_df.groupby(sales_df['date'].dt.date)['quantity'].sum().reset_index()
-    sales_by_date.columns = ['date', 'sales']
+        result = pd.DataFrame(columns=['date', 'sales'])
+        result.attrs['granularity'] = 'D' if granularity == 'auto' else granularity
+        return result
     
-    # Sort by date
-    sales_by_date = sales_by_date.sort_values('date')
+    dates = pd.to_datetime(sales_df['date']).dt.normalize()
     
-    # Fill in missing dates with zero sales
-    date_range = pd.date_range(
-        start=sales_by_date['date'].min(),
-        end=sales_by_date['date'].max()
-    )
+    if granularity == 'auto':
+        granularity = utils.choose_trend_granularity(dates.min(), dates.max())
     
-    full_date_df = pd.DataFrame({'date': date_range})
-    full_date_df['date'] = full_date_df['date'].dt.date
+    # Resampling sums each bucket and fills empty buckets with zero sales
+    quantities = pd.Series(sales_df['quantity'].to_numpy(), index=dates).sort_index()
+    trend = quantities.resample(granularity, label='left', closed='left').sum()
+    result = trend.reset_index()
+    result.columns = ['date', 'sales']
     
-    result = pd.merge(full_date_df, sales_by_date, on='date', how='left')
-    result['sales'] = result['sales'].fillna(0)
+    if max_points and len(result) > max_points:
+        keep = utils.lttb_downsample(result['date'].astype('int64'), result['sales'], max_points)
+        result = result.iloc[keep].reset_index(drop=True)
     
+    result.attrs['granularity'] = granularity
     return result
 
-def get_top_books(username, time_period, limit=5):
-    """Get top selling books for the given time period."""
+def get_sales_trend(username, time_period, granularity='auto', max_points=TREND_MAX_POINTS):
+    """Get sales trend data for visualization."""
     sales_df = filter_sales_by_time_period(username, time_period)
     
-    if sales_df.empty:
-        return pd.DataFrame(columns=['title', 'sales'])
-    
-    # Group by book title and sum quantities
-    top_books = sales_df.groupby('title')['quantity'].sum().reset_index()
-    top_books.columns = ['title', 'sales']
+    return build_sales_trend(sales_df, granularity=granularity, max_points=max_points)
+
+def get_book_sales_trend(username, time_period, book_id, granularity='auto', max_points=TREND_MAX_POINTS):
+    """Get the sales trend for a single book."""
+    sales_df = filter_sales_by_time_period(username, time_period)
     
-    # Sort by sales in descending order and limit results
-    top_books = top_books.sort_values('sales', ascending=False).head(limit)
+    if not sales_df.empty:
+        sales_df = sales_df[sales_df['book_id'] == book_id]
     
-    return top_books
+    return build_sales_trend(sales_df, granularity=granularity, max_points=max_points)
+
+def get_top_books(username, time_period, limit=5):
+    """Get top selling books for the given time period from the maintained leaderboards."""
+    import leaderboards
+    return leaderboards.get_leaderboard('book', time_period, username, limit)[['title', 'sales']]
 
 def get_recent_sales(username, limit=10):
-    """Get recent sales data."""
-    sales_df = get_user_sales(username)
-    
-    if sales_df.empty:
-        return pd.DataFrame()
-    
-    # Sort by date in descending order and limit results
-    recent_sales = sales_df.sort_values('date', ascending=False).head(limit)
-    
-    return recent_sales
+    """Get recent sales data from the recent-sales buffer."""
+    import leaderboards
+    return leaderboards.get_recent_sales(username, limit)
 
 def get_sales_by_genre(username, time_period):
     """Get sales distribution by genre."""
@@ -469,9 +1256,9 @@ def get_royalties_by_book(username, time_period="All Time"):
         # Get only necessary columns from books_df to avoid duplicates
         books_subset = books_df[['id', 'title']].copy()
         
-        # Merge sales with books to get book titles
+        # Merge sales with books to get book titles (replacing any titles already joined)
         merged_df = pd.merge(
-            sales_df, 
+            sales_df.drop(columns=['title'], errors='ignore'), 
             books_subset, 
             left_on='book_id', 
             right_on='id',
@@ -498,13 +1285,11 @@ def get_royalties_by_book(username, time_period="All Time"):
 
 def get_users():
     """Get all users from the dataset."""
-    if os.path.exists('data/users.csv'):
-        users_df = pd.read_csv('data/users.csv')
-        # Don't return password column for security
-        if 'password' in users_df.columns:
-            return users_df.drop(columns=['password'])
-        return users_df
-    return pd.DataFrame()
+    # The directory never returns password hashes
+    users = user_directory.list_users()
+    if not users:
+        return pd.DataFrame()
+    return pd.DataFrame(users)
 
 def get_clients():
     """Get all client users from the dataset."""
@@ -514,3 +1299,426 @@ def get_clients():
         return pd.DataFrame()
     
     return users_df[users_df['role'] == 'client']
+
+def get_payments(username=None):
+    """Get royalty payments made to clients, optionally for a single client."""
+    if not os.path.exists('data/payments.csv'):
+        return pd.DataFrame(columns=PAYMENT_COLUMNS)
+    
+    payments_df = pd.read_csv(storage.open_table('payments'), keep_default_na=False, dtype={'reference': str})
+    if username is not None:
+        payments_df = payments_df[payments_df['username'] == username]
+    return payments_df
+
+@storage.write_locked
+def add_payment(username, amount, date=None, reference=''):
+    """Record a royalty payment to a client."""
+    user = user_directory.get_user(username)
+    if user is None or user['role'] != 'client':
+        return False, "Payments can only be made to clients."
+    
+    if amount <= 0:
+        return False, "Payment amount must be greater than zero."
+    
+    if date is None:
+        date = datetime.now().strftime('%Y-%m-%d')
+    
+    new_payment = pd.DataFrame({
+        'date': [date],
+        'username': [username],
+        'amount': [float(amount)],
+        'reference': [reference]
+    })
+    
+    # Append to the ledger instead of rewriting it
+    previous_version = _balances_source_version()
+    if os.path.exists('data/payments.csv') and os.path.getsize('data/payments.csv') > 0:
+        _append_table('payments', new_payment)
+    else:
+        _write_table('payments', new_payment)
+    _apply_balance_changes(previous_version, _balances_source_version(), paid=pd.Series({username: float(amount)}))
+    
+    return True, "Payment recorded successfully!"
+
+@storage.write_locked
+def delete_payment(index):
+    """Delete a payment from the ledger."""
+    payments_df = get_payments()
+    
+    if payments_df.empty or index not in payments_df.index:
+        return False
+    
+    _write_table('payments', payments_df.drop(index))
+    
+    return True
+
+def _balances_source_version():
+    """Return a token that changes whenever the data behind client balances changes."""
+    return (get_table_version('books'), get_table_version('sales'), get_table_version('payments'))
+
+def build_balances(chunksize=100000):
+    """Count royalties earned and payments received by every client.
+    
+    Sales are scanned in chunks so memory use is bounded by the chunk size.
+    Returns a dict of {username: {'earned': ..., 'paid': ...}}.
+    """
+    balances = {}
+    
+    books_df = get_books()
+    if not books_df.empty and os.path.exists('data/sales.csv'):
+        owners = books_df.set_index('id')['owner']
+        for chunk in pd.read_csv(storage.open_table('sales'), usecols=['book_id', 'royalty'], chunksize=chunksize):
+            earned = chunk['royalty'].groupby(chunk['book_id'].map(owners)).sum()
+            for username, amount in earned.items():
+                balances.setdefault(username, {'earned': 0.0, 'paid': 0.0})['earned'] += float(amount)
+    
+    payments_df = get_payments()
+    if not payments_df.empty:
+        for username, amount in payments_df.groupby('username')['amount'].sum().items():
+            balances.setdefault(username, {'earned': 0.0, 'paid': 0.0})['paid'] += float(amount)
+    
+    return balances
+
+def _load_balances():
+    """Return the client balances, rebuilding them only when the data behind them has changed."""
+    global _balances
+    
+    with storage.snapshot():
+        version = _balances_source_version()
+        balances = _cache_get(_balances, version)
+        if balances is not None:
+            return balances
+        balances = _load_aggregate('balances', version)
+        if balances is None:
+            balances = build_balances()
+    
+    _balances = _cache_store(_balances, version, balances)
+    return balances
+
+def rebuild_balances():
+    """Rebuild client balances from the sales and payments files and save them."""
+    global _balances
+    
+    with storage.snapshot():
+        _balances = (_balances_source_version(), build_balances())
+    _save_aggregate('balances', *_balances)
+
+def _apply_balance_changes(previous_version, current_version, earned=None, paid=None):
+    """Add new royalties and payments to the cached balances if they were built from previous_version.
+    
+    earned and paid are Series of amounts keyed by username. Otherwise the
+    balances are left to be rebuilt on the next read.
+    """
+    global _balances
+    
+    cached = _cache_get(_balances, previous_version)
+    if cached is None:
+        return
+    
+    # Copy on write so readers holding the old dict never see a partial update
+    balances = {username: dict(balance) for username, balance in cached.items()}
+    for column, amounts in [('earned', earned), ('paid', paid)]:
+        if amounts is None:
+            continue
+        for username, amount in amounts.items():
+            balances.setdefault(username, {'earned': 0.0, 'paid': 0.0})[column] += float(amount)
+    
+    _balances = (current_version, balances)
+
+def get_client_balance(username):
+    """Get royalties earned, payments received and the amount outstanding for a client."""
+    balance = _load_balances().get(username, {'earned': 0.0, 'paid': 0.0})
+    return {
+        'earned': balance['earned'],
+        'paid': balance['paid'],
+        'outstanding': balance['earned'] - balance['paid']
+    }
+
+def get_balances():
+    """Get the balance of every client."""
+    clients = get_clients()
+    if clients.empty:
+        return pd.DataFrame(columns=['username', 'name', 'earned', 'paid', 'outstanding'])
+    
+    balances = pd.DataFrame([
+        {'username': username, **get_client_balance(username)}
+        for username in clients['username']
+    ])
+    return clients[['username', 'name']].merge(balances, on='username')
+
+AGGREGATE_BUILDERS['balances'] = rebuild_balances
+
+# Measures kept for every cell of the seasonality cube
+SEASONALITY_MEASURES = ['quantity', 'revenue', 'royalty', 'sales']
+
+def _seasonality_cells(sales_df):
+    """Aggregate sales into (book_id, year, month, weekday) cells."""
+    dates = pd.to_datetime(sales_df['date'])
+    cells = pd.DataFrame({
+        'book_id': sales_df['book_id'].to_numpy(),
+        'year': dates.dt.year.to_numpy(),
+        'month': dates.dt.month.to_numpy(),
+        'weekday': dates.dt.dayofweek.to_numpy(),
+        'quantity': sales_df['quantity'].to_numpy(),
+        'revenue': sales_df['revenue'].to_numpy(),
+        'royalty': sales_df['royalty'].to_numpy() if 'royalty' in sales_df.columns else 0.0,
+        'sales': 1
+    })
+    return cells.groupby(['book_id', 'year', 'month', 'weekday']).sum()
+
+def build_seasonality_cube(chunksize=100000):
+    """Build the seasonality cube from sales.csv.
+    
+    The cube holds copies sold, revenue, royalties and number of sales for
+    every (book_id, year, month, weekday) cell, so month and weekday
+    distributions of any book are read from at most a few hundred cells.
+    """
+    if not os.path.exists('data/sales.csv'):
+        return _seasonality_cells(pd.DataFrame(columns=SALES_COLUMNS))
+    
+    partial_cubes = [
+        _seasonality_cells(chunk)
+        for chunk in pd.read_csv(storage.open_table('sales'), chunksize=chunksize)
+    ]
+    if not partial_cubes:
+        return _seasonality_cells(pd.DataFrame(columns=SALES_COLUMNS))
+    
+    return pd.concat(partial_cubes).groupby(level=[0, 1, 2, 3]).sum().sort_index()
+
+def get_seasonality_cube():
+    """Get the seasonality cube, rebuilding it only when sales have changed."""
+    global _seasonality
+    
+    with storage.snapshot():
+        version = get_table_version('sales')
+        cube = _cache_get(_seasonality, version)
+        if cube is not None:
+            return cube
+        cube = _load_aggregate('seasonality', version)
+        if cube is None:
+            cube = build_seasonality_cube()
+    
+    _seasonality = _cache_store(_seasonality, version, cube)
+    return cube
+
+def rebuild_seasonality():
+    """Rebuild the seasonality cube from the sales file and save it."""
+    global _seasonality
+    
+    with storage.snapshot():
+        _seasonality = (get_table_version('sales'), build_seasonality_cube())
+    _save_aggregate('seasonality', *_seasonality)
+
+def _apply_seasonality_sales(previous_version, current_version, new_sales):
+    """Add appended sales to the cached cube if it was built from previous_version."""
+    global _seasonality
+    
+    cube = _cache_get(_seasonality, previous_version)
+    if cube is None:
+        return
+    
+    _seasonality = (current_version, cube.add(_seasonality_cells(new_sales), fill_value=0).astype(cube.dtypes))
+
+def get_book_seasonality(book_id, by='month'):
+    """Get a book's sales by month of year ('month'), day of week ('weekday') or 'year'.
+    
+    Returns one row per period with a display label, ordered by period.
+    """
+    cube = get_seasonality_cube()
+    if book_id not in cube.index.get_level_values('book_id'):
+        return pd.DataFrame(columns=[by, 'label'] + SEASONALITY_MEASURES)
+    
+    book_cells = cube.xs(book_id, level='book_id')
+    result = book_cells.groupby(level=by).sum().reset_index()
+    
+    if by == 'month':
+        result['label'] = pd.to_datetime(result['month'], format='%m').dt.strftime('%b')
+    elif by == 'weekday':
+        result['label'] = result['weekday'].map(dict(enumerate(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'])))
+    else:
+        result['label'] = result[by].astype(str)
+    
+    return result[[by, 'label'] + SEASONALITY_MEASURES]
+
+def get_book_totals(book_id):
+    """Get a book's all-time copies sold, revenue, royalties and number of sales."""
+    cube = get_seasonality_cube()
+    if book_id not in cube.index.get_level_values('book_id'):
+        return {measure: 0 for measure in SEASONALITY_MEASURES}
+    
+    book_cells = cube.xs(book_id, level='book_id')
+    return {measure: book_cells[measure].sum() for measure in SEASONALITY_MEASURES}
+
+AGGREGATE_BUILDERS['seasonality'] = rebuild_seasonality
+
+# Dimensions the sales cube can be rolled up to, and their drill-down paths from coarse to fine
+CUBE_DIMENSIONS = ['year', 'quarter', 'month', 'day', 'weekday', 'genre', 'owner', 'author', 'book']
+CUBE_HIERARCHIES = {
+    'time': ['year', 'quarter', 'month', 'day'],
+    'catalog': ['genre', 'author', 'book'],
+    'client': ['owner', 'book']
+}
+CUBE_MEASURES = ['quantity', 'revenue', 'royalty', 'sales']
+
+def _cube_cells(sales_df):
+    """Aggregate sales into (day, book_id) cells with compact column types."""
+    cells = pd.DataFrame({
+        'day': pd.to_datetime(sales_df['date']).to_numpy(dtype='datetime64[D]'),
+        'book_id': sales_df['book_id'].to_numpy(dtype='int32'),
+        'quantity': sales_df['quantity'].to_numpy(dtype='int32'),
+        'revenue': sales_df['revenue'].to_numpy(dtype='float64'),
+        'royalty': sales_df['royalty'].to_numpy(dtype='float64') if 'royalty' in sales_df.columns else 0.0,
+        'sales': np.ones(len(sales_df), dtype='int32')
+    })
+    return cells.groupby(['day', 'book_id'], as_index=False).sum()
+
+def build_sales_cube(chunksize=100000):
+    """Build the sales cube from sales.csv.
+    
+    The cube stores one row per (day, book) with copies sold, revenue,
+    royalties and number of sales, sorted by day. Book attributes (genre,
+    owner, author) are joined at query time, so catalog edits never make
+    the cube stale and each cell stays a few bytes wide.
+    """
+    empty = _cube_cells(pd.DataFrame(columns=SALES_COLUMNS))
+    if not os.path.exists('data/sales.csv'):
+        return empty
+    
+    partial_cubes = [
+        _cube_cells(chunk)
+        for chunk in pd.read_csv(storage.open_table('sales'), chunksize=chunksize)
+    ]
+    if not partial_cubes:
+        return empty
+    
+    cube = pd.concat(partial_cubes).groupby(['day', 'book_id'], as_index=False).sum()
+    return cube.astype({'quantity': 'int32', 'sales': 'int32'}).sort_values(['day', 'book_id'], ignore_index=True)
+
+def get_sales_cube():
+    """Get the sales cube, rebuilding it only when sales have changed."""
+    global _sales_cube
+    
+    with storage.snapshot():
+        version = get_table_version('sales')
+        cube = _cache_get(_sales_cube, version)
+        if cube is not None:
+            return cube
+        cube = _load_aggregate('sales_cube', version)
+        if cube is None:
+            cube = build_sales_cube()
+    
+    _sales_cube = _cache_store(_sales_cube, version, cube)
+    return cube
+
+def rebuild_sales_cube():
+    """Rebuild the sales cube from the sales file and save it."""
+    global _sales_cube
+    
+    with storage.snapshot():
+        _sales_cube = (get_table_version('sales'), build_sales_cube())
+    _save_aggregate('sales_cube', *_sales_cube)
+
+def _apply_cube_sales(previous_version, current_version, new_sales):
+    """Add appended sales to the cached cube if it was built from previous_version.
+    
+    New cells are appended rather than merged into existing ones; queries
+    aggregate anyway, and the cube is only re-sorted when the new sales
+    are dated before its last day.
+    """
+    global _sales_cube
+    
+    cached = _cache_get(_sales_cube, previous_version)
+    if cached is None:
+        return
+    
+    new_cells = _cube_cells(new_sales)
+    cube = pd.concat([cached, new_cells], ignore_index=True) if not cached.empty else new_cells
+    if not cached.empty and new_cells['day'].min() < cached['day'].iloc[-1]:
+        cube = cube.sort_values('day', kind='mergesort', ignore_index=True)
+    
+    _sales_cube = (current_version, cube)
+
+def drill_down(dimension):
+    """Return the next finer dimension below `dimension`, or None at the finest level."""
+    for levels in CUBE_HIERARCHIES.values():
+        if dimension in levels and levels.index(dimension) < len(levels) - 1:
+            return levels[levels.index(dimension) + 1]
+    return None
+
+def roll_up(dimension):
+    """Return the next coarser dimension above `dimension`, or None at the coarsest level."""
+    for levels in CUBE_HIERARCHIES.values():
+        if dimension in levels and levels.index(dimension) > 0:
+            return levels[levels.index(dimension) - 1]
+    return None
+
+def query_cube(dimensions, measures=None, filters=None, start_date=None, end_date=None):
+    """Aggregate the sales cube to the given dimensions.
+    
+    dimensions is a list drawn from CUBE_DIMENSIONS; an empty list gives
+    grand totals. filters maps a dimension to a value or list of values to
+    keep, and start_date/end_date bound the days included (inclusive).
+    The date range is cut with a binary search on the day-sorted cube, so
+    only the cells in range are touched.
+    """
+    measures = measures or CUBE_MEASURES
+    filters = filters or {}
+    
+    unknown = [dimension for dimension in list(dimensions) + list(filters) if dimension not in CUBE_DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown cube dimensions: {', '.join(unknown)}")
+    
+    cube = get_sales_cube()
+    
+    # Cut the date range from the sorted day column
+    days = cube['day'].to_numpy()
+    start = np.searchsorted(days, np.datetime64(pd.Timestamp(start_date), 'D'), side='left') if start_date is not None else 0
+    end = np.searchsorted(days, np.datetime64(pd.Timestamp(end_date), 'D'), side='right') if end_date is not None else len(cube)
+    cells = cube.iloc[start:end]
+    
+    # Derive only the dimensions the query needs. Time labels are formatted
+    # once per distinct value rather than once per cell.
+    needed = set(dimensions) | set(filters)
+    frame = cells[['book_id'] + measures].copy()
+    days = cells['day'].to_numpy(dtype='datetime64[D]')
+    time_keys = {
+        'year': lambda: days.astype('datetime64[Y]'),
+        'quarter': lambda: pd.PeriodIndex(days, freq='Q'),
+        'month': lambda: days.astype('datetime64[M]'),
+        'day': lambda: days,
+        'weekday': lambda: pd.DatetimeIndex(days).dayofweek
+    }
+    time_labels = {
+        'year': lambda values: pd.DatetimeIndex(values).strftime('%Y'),
+        'quarter': lambda values: values.astype(str),
+        'month': lambda values: pd.DatetimeIndex(values).strftime('%Y-%m'),
+        'day': lambda values: pd.DatetimeIndex(values).strftime('%Y-%m-%d'),
+        'weekday': lambda values: [['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'][value] for value in values]
+    }
+    for dimension in needed & set(time_keys):
+        codes, uniques = pd.factorize(time_keys[dimension](), sort=True)
+        frame[dimension] = pd.Categorical.from_codes(codes, categories=pd.Index(time_labels[dimension](uniques)))
+    
+    catalog_dimensions = needed & {'genre', 'owner', 'author', 'book'}
+    if catalog_dimensions:
+        books_df = get_books()
+        catalog = books_df.set_index('id') if not books_df.empty else pd.DataFrame(columns=['title', 'genre', 'owner', 'author'])
+        for dimension in catalog_dimensions:
+            column = 'title' if dimension == 'book' else dimension
+            frame[dimension] = frame['book_id'].map(catalog[column])
+    
+    for dimension, values in filters.items():
+        values = values if isinstance(values, (list, tuple, set)) else [values]
+        frame = frame[frame[dimension].isin(values)]
+    
+    if not dimensions:
+        return frame[measures].sum().to_frame().T.astype(frame[measures].dtypes)
+    
+    # Time labels sort in calendar order while they are still categorical
+    result = frame.groupby(list(dimensions), as_index=False, observed=True)[measures].sum()
+    result = result.sort_values(list(dimensions), ignore_index=True)
+    for dimension in result.columns.intersection(list(time_keys)):
+        result[dimension] = result[dimension].astype(str)
+    return result
+
+AGGREGATE_BUILDERS['sales_cube'] = rebuild_sales_cube
@@ -0,0 +1,287 @@
+import os
+import smtplib
+from datetime import datetime
+from email.message import EmailMessage
+
+import pandas as pd
+
+import data_manager
+import storage
+import user_directory
+
+PREFERENCES_FILE = 'data/preferences.csv'
+PREFERENCE_COLUMNS = ['username', 'email_notifications', 'daily_summary', 'weekly_summary']
+
+# Preferences of users who have never saved any (matching the Settings page defaults)
+DEFAULT_PREFERENCES = {'email_notifications': False, 'daily_summary': False, 'weekly_summary': True}
+
+DIGEST_LOG_FILE = 'data/digest_log.csv'
+DIGEST_LOG_COLUMNS = ['username', 'frequency', 'period_end', 'sent_at', 'backend']
+
+# Days each digest covers, and the preference that subscribes to it
+DIGEST_DAYS = {'daily': 1, 'weekly': 7}
+DIGEST_PREFERENCES = {'daily': 'daily_summary', 'weekly': 'weekly_summary'}
+
+# Books listed in each digest
+DIGEST_TOP_BOOKS = 5
+
+DIGEST_SENDER = 'Khwaab Publication <no-reply@localhost>'
+
+
+def get_all_preferences():
+    """Get the saved notification preferences of every user."""
+    if not os.path.exists(PREFERENCES_FILE):
+        return pd.DataFrame(columns=PREFERENCE_COLUMNS)
+    return pd.read_csv(storage.open_table('preferences'), dtype={'username': str})
+
+
+def get_preferences(username):
+    """Get a user's notification preferences, falling back to the defaults."""
+    preferences = get_all_preferences()
+    saved = preferences[preferences['username'] == username]
+    if saved.empty:
+        return dict(DEFAULT_PREFERENCES)
+    return {column: bool(saved.iloc[0][column]) for column in DEFAULT_PREFERENCES}
+
+
+@storage.write_locked
+def set_preferences(username, email_notifications, daily_summary, weekly_summary):
+    """Save a user's notification preferences."""
+    if user_directory.get_user(username) is None:
+        return False, "User does not exist."
+
+    preferences = get_all_preferences()
+    preferences = preferences[preferences['username'] != username]
+    saved = pd.DataFrame([{
+        'username': username,
+        'email_notifications': bool(email_notifications),
+        'daily_summary': bool(daily_summary),
+        'weekly_summary': bool(weekly_summary)
+    }])
+    if not preferences.empty:
+        saved = pd.concat([preferences, saved], ignore_index=True)
+
+    with storage.atomic_writer(PREFERENCES_FILE) as preferences_file:
+        saved[PREFERENCE_COLUMNS].to_csv(preferences_file, index=False)
+    storage.bump_version('preferences')
+    return True, "Settings saved successfully!"
+
+
+def get_subscribers(frequency):
+    """Get the usernames subscribed to a digest frequency with email notifications on."""
+    saved = get_all_preferences().set_index('username')
+    subscribers = []
+    for user in user_directory.list_users():
+        username = user['username']
+        preferences = saved.loc[username].to_dict() if username in saved.index else DEFAULT_PREFERENCES
+        if preferences['email_notifications'] and preferences[DIGEST_PREFERENCES[frequency]]:
+            subscribers.append(username)
+    return subscribers
+
+
+def digest_period(frequency, as_of=None):
+    """Return the (start, end) days a digest covers, ending on as_of (default: yesterday)."""
+    end = pd.Timestamp(as_of).normalize() if as_of is not None else pd.Timestamp.now().normalize() - pd.Timedelta(days=1)
+    return end - pd.Timedelta(days=DIGEST_DAYS[frequency] - 1), end
+
+
+def build_digests(frequency, usernames, as_of=None):
+    """Build the digests of many users from one pass over the sales cube.
+
+    The period and the one before it are cut from the cube once and
+    aggregated per client and book; each digest is then a slice of that
+    result, so the cost of the data pass doesn't grow with the number of
+    digests. Admin digests cover the whole
+    catalog. Returns a dict of {username: digest}.
+    """
+    start, end = digest_period(frequency, as_of)
+    previous_start = start - pd.Timedelta(days=DIGEST_DAYS[frequency])
+
+    books_df = data_manager.get_books()
+    cube = data_manager.get_sales_cube()
+    cells = cube.iloc[cube['day'].searchsorted(previous_start):cube['day'].searchsorted(end, side='right')]
+
+    catalog = books_df.set_index('id')[['title', 'owner']] if not books_df.empty else pd.DataFrame(columns=['title', 'owner'])
+    cells = cells[cells['book_id'].isin(catalog.index)]
+    cells = cells.assign(owner=cells['book_id'].map(catalog['owner']).to_numpy())
+    is_current = (cells['day'] >= start).to_numpy()
+
+    measures = ['quantity', 'revenue', 'royalty']
+    current_totals = cells[is_current].groupby(['owner', 'book_id'])[measures].sum()
+    previous_totals = cells[~is_current].groupby('owner')[measures].sum()
+    no_sales = current_totals.droplevel('owner').iloc[0:0]
+
+    digests = {}
+    for username in usernames:
+        user = user_directory.get_user(username)
+        if user is None:
+            continue
+
+        if user['role'] == 'admin':
+            current = current_totals.groupby(level='book_id').sum()
+            previous = previous_totals.sum()
+        else:
+            current = current_totals.loc[username] if username in current_totals.index.get_level_values('owner') else no_sales
+            previous = previous_totals.loc[username] if username in previous_totals.index else pd.Series(0, index=measures)
+
+        top_books = current.sort_values('quantity', ascending=False).head(DIGEST_TOP_BOOKS)
+        digests[username] = {
+            'username': username,
+            'name': user['name'],
+            'email': user.get('email', ''),
+            'frequency': frequency,
+            'start': start,
+            'end': end,
+            'copies': int(current['quantity'].sum()),
+            'revenue': float(current['revenue'].sum()),
+            'royalty': float(current['royalty'].sum()),
+            'previous_copies': int(previous['quantity']),
+            'previous_revenue': float(previous['revenue']),
+            'top_books': pd.DataFrame({
+                'title': catalog['title'].reindex(top_books.index).to_numpy(),
+                'quantity': top_books['quantity'].to_numpy(),
+                'revenue': top_books['revenue'].to_numpy()
+            }),
+            'outstanding': None if user['role'] == 'admin' else data_manager.get_client_balance(username)['outstanding']
+        }
+
+    return digests
+
+
+def render_digest(digest):
+    """Render a digest as a plain-text email."""
+    label = "Daily" if digest['frequency'] == 'daily' else "Weekly"
+    if digest['start'] == digest['end']:
+        period = digest['end'].strftime('%d %b %Y')
+    else:
+        period = f"{digest['start'].strftime('%d %b %Y')} - {digest['end'].strftime('%d %b %Y')}"
+
+    message = EmailMessage()
+    message['Subject'] = f"Khwaab Publication - {label} sales summary for {period}"
+    message['From'] = DIGEST_SENDER
+    message['To'] = digest['email']
+
+    lines = [
+        f"Hello {digest['name']},",
+        "",
+        f"Here is your {label.lower()} sales summary for {period}.",
+        "",
+        f"Copies sold: {digest['copies']:,} (previous period: {digest['previous_copies']:,})",
+        f"Revenue: ₹{digest['revenue']:,.2f} (previous period: ₹{digest['previous_revenue']:,.2f})",
+        f"Royalties earned: ₹{digest['royalty']:,.2f}"
+    ]
+    if digest['outstanding'] is not None:
+        lines.append(f"Outstanding royalty balance: ₹{digest['outstanding']:,.2f}")
+
+    if not digest['top_books'].empty:
+        lines += ["", "Top books:"]
+        for book in digest['top_books'].itertuples():
+            lines.append(f"  {book.title}: {book.quantity:,} copies, ₹{book.revenue:,.2f}")
+    else:
+        lines += ["", "No sales were recorded in this period."]
+
+    message.set_content("\n".join(lines) + "\n", cte="quoted-printable")
+    return message
+
+
+class OutboxBackend:
+    """Delivers digests by writing each one as an .eml file to a local directory."""
+
+    name = 'outbox'
+
+    def __init__(self, directory='outbox'):
+        self.directory = directory
+
+    def deliver(self, username, digest, message):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{digest['end'].strftime('%Y-%m-%d')}_{digest['frequency']}_{username}.eml")
+        storage.atomic_write_text(path, message.as_string())
+        return path
+
+
+class SMTPBackend:
+    """Delivers digests through an SMTP server, by default a local stand-in on port 1025."""
+
+    name = 'smtp'
+
+    def __init__(self, host='localhost', port=1025):
+        self.host = host
+        self.port = port
+
+    def deliver(self, username, digest, message):
+        with smtplib.SMTP(self.host, self.port, timeout=30) as server:
+            server.send_message(message)
+        return f"{self.host}:{self.port}"
+
+
+def get_digest_log():
+    """Get the record of digests already delivered."""
+    if not os.path.exists(DIGEST_LOG_FILE):
+        return pd.DataFrame(columns=DIGEST_LOG_COLUMNS)
+    return pd.read_csv(storage.open_table('digest_log'), dtype={'username': str, 'period_end': str})
+
+
+@storage.write_locked
+def _log_deliveries(entries):
+    """Append delivered digests to the digest log."""
+    if not entries:
+        return
+    log = pd.DataFrame(entries, columns=DIGEST_LOG_COLUMNS)
+    if os.path.exists(DIGEST_LOG_FILE) and os.path.getsize(DIGEST_LOG_FILE) > 0:
+        with storage.appender(DIGEST_LOG_FILE) as log_file:
+            log.to_csv(log_file, header=False, index=False)
+    else:
+        with storage.atomic_writer(DIGEST_LOG_FILE) as log_file:
+            log.to_csv(log_file, index=False)
+    storage.bump_version('digest_log')
+
+
+def send_digests(frequency, backend, as_of=None, usernames=None, force=False):
+    """Build and deliver one frequency's digests to every subscriber.
+
+    All digests come from one build_digests pass. Subscribers who already
+    received the digest for this period are skipped unless `force` is set,
+    so the job can safely be re-run. Returns a list of
+    (username, delivered, detail) tuples.
+    """
+    if usernames is None:
+        usernames = get_subscribers(frequency)
+
+    _, end = digest_period(frequency, as_of)
+    period_end = end.strftime('%Y-%m-%d')
+
+    if not force:
+        log = get_digest_log()
+        sent = log[(log['frequency'] == frequency) & (log['period_end'] == period_end)]['username']
+        usernames = [username for username in usernames if username not in set(sent)]
+
+    results = []
+    delivered = []
+    for username, digest in build_digests(frequency, usernames, as_of).items():
+        if not digest['email']:
+            results.append((username, False, "no email address"))
+            continue
+
+        try:
+            detail = backend.deliver(username, digest, render_digest(digest))
+        except (OSError, smtplib.SMTPException) as e:
+            results.append((username, False, str(e)))
+            continue
+
+        results.append((username, True, detail))
+        delivered.append({
+            'username': username,
+            'frequency': frequency,
+            'period_end': period_end,
+            'sent_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'backend': backend.name
+        })
+
+    _log_deliveries(delivered)
+    return results
+
+
+def due_frequencies(as_of=None):
+    """Return the digest frequencies due for a day: daily always, weekly when the week ended on it (a Sunday)."""
+    _, end = digest_period('daily', as_of)
+    return ['daily', 'weekly'] if end.dayofweek == 6 else ['daily']
@@ -0,0 +1,287 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+import data_manager
+import storage
+
+# Days of daily history each model is fitted on, and the weekly season length
+HISTORY_DAYS = 365
+SEASON_LENGTH = 7
+
+# Trend damping, so long horizons level off instead of extrapolating a trend forever
+DAMPING = 0.98
+
+# Smoothing parameters tried for every book; the best combination per book wins
+ALPHAS = (0.05, 0.2, 0.5)
+BETAS = (0.01, 0.1)
+GAMMAS = (0.05, 0.3)
+
+# z-score for the prediction intervals (95%)
+INTERVAL_Z = 1.96
+
+# (data version, models) they were fitted for
+_model = None
+_lock = threading.Lock()
+
+
+def _parameter_grid():
+    """Return the smoothing parameter combinations as three column vectors."""
+    grid = np.array([(alpha, beta, gamma) for alpha in ALPHAS for beta in BETAS for gamma in GAMMAS])
+    return grid[:, 0:1], grid[:, 1:2], grid[:, 2:3]
+
+
+def _smooth(state, observations, alpha, beta, gamma):
+    """Run the damped additive Holt-Winters recursion over new observations.
+
+    `state` holds level, trend and season arrays for every (parameter
+    combination, book) pair plus the running squared one-step error; the
+    loop runs over time only, updating every book at once. Returns the
+    advanced state.
+    """
+    level = state['level'].copy()
+    trend = state['trend'].copy()
+    season = state['season'].copy()
+    sse = state['sse'].copy()
+    errors = state['errors'].copy()
+    position = state['position']
+
+    for values in observations:
+        slot = position % SEASON_LENGTH
+        seasonal = season[..., slot]
+        error = values - (level + DAMPING * trend + seasonal)
+        if position >= SEASON_LENGTH:
+            sse += error ** 2
+            errors += 1
+
+        new_level = alpha * (values - seasonal) + (1 - alpha) * (level + DAMPING * trend)
+        trend = beta * (new_level - level) + (1 - beta) * DAMPING * trend
+        season[..., slot] = gamma * (values - new_level) + (1 - gamma) * seasonal
+        level = new_level
+        position += 1
+
+    return {'level': level, 'trend': trend, 'season': season, 'sse': sse, 'errors': errors, 'position': position}
+
+
+def fit_holt_winters(series):
+    """Fit damped additive Holt-Winters models to many series at once.
+
+    `series` is a (days, books) array of daily copies sold. Every parameter
+    combination in the grid is run for every book in one batched pass, and
+    each book keeps the combination with the lowest one-step error. Returns
+    the fitted model: per-book parameters, final state and residual spread.
+    """
+    alpha, beta, gamma = _parameter_grid()
+    series = np.asarray(series, dtype=float)
+    books = series.shape[1]
+
+    # Initialise from the first two seasons of each series
+    first_season = series[:SEASON_LENGTH]
+    second_season = series[SEASON_LENGTH:2 * SEASON_LENGTH]
+    level = first_season.mean(axis=0)
+    trend = (second_season.mean(axis=0) - level) / SEASON_LENGTH if len(second_season) else np.zeros(books)
+    season = (first_season - level).T
+
+    combinations = len(alpha)
+    state = {
+        'level': np.broadcast_to(level, (combinations, books)).copy(),
+        'trend': np.broadcast_to(trend, (combinations, books)).copy(),
+        'season': np.broadcast_to(season, (combinations, books, SEASON_LENGTH)).copy(),
+        'sse': np.zeros((combinations, books)),
+        'errors': np.zeros((combinations, books)),
+        'position': 0
+    }
+    state = _smooth(state, series, alpha, beta, gamma)
+
+    # Keep the best parameter combination for each book
+    best = np.argmin(state['sse'], axis=0)
+    columns = np.arange(books)
+    return {
+        'alpha': alpha[best, 0],
+        'beta': beta[best, 0],
+        'gamma': gamma[best, 0],
+        'level': state['level'][best, columns][np.newaxis],
+        'trend': state['trend'][best, columns][np.newaxis],
+        'season': state['season'][best, columns][np.newaxis],
+        'sse': state['sse'][best, columns][np.newaxis],
+        'errors': state['errors'][best, columns][np.newaxis],
+        'position': state['position']
+    }
+
+
+def update_holt_winters(model, observations):
+    """Advance a fitted model over new daily observations without refitting."""
+    state = _smooth(model, np.asarray(observations, dtype=float), model['alpha'], model['beta'], model['gamma'])
+    return {**model, **state}
+
+
+def forecast_holt_winters(model, horizon):
+    """Forecast `horizon` days ahead with prediction intervals.
+
+    Returns (mean, lower, upper) arrays shaped (horizon, books). Forecasts
+    and lower bounds are clipped at zero since sales can't be negative.
+    """
+    steps = np.arange(1, horizon + 1)
+    damped_steps = np.cumsum(DAMPING ** steps)
+    slots = (model['position'] + steps - 1) % SEASON_LENGTH
+
+    level = model['level'][0]
+    trend = model['trend'][0]
+    season = model['season'][0]
+    mean = level + np.outer(damped_steps, trend) + season[:, slots].T
+
+    # Variance grows with the horizon as level, trend and season errors accumulate
+    sigma = np.sqrt(model['sse'][0] / np.maximum(model['errors'][0], 1))
+    seasonal_hits = ((steps[:-1] % SEASON_LENGTH) == 0).astype(float)
+    weights = model['alpha'] * (1 + np.outer(damped_steps[:-1], model['beta'])) + np.outer(seasonal_hits, model['gamma'])
+    variance_factor = 1 + np.vstack([np.zeros((1, len(sigma))), np.cumsum(weights ** 2, axis=0)])
+    spread = INTERVAL_Z * sigma * np.sqrt(variance_factor)
+
+    mean = np.clip(mean, 0, None)
+    return mean, np.clip(mean - spread, 0, None), mean + spread
+
+
+def _daily_series(cube, book_ids, start_day, end_day):
+    """Return a dense (days, books) array of copies sold from the sales cube."""
+    days = pd.date_range(start_day, end_day, freq='D')
+    cells = cube[(cube['day'] >= start_day) & (cube['day'] <= end_day) & cube['book_id'].isin(book_ids)]
+
+    series = np.zeros((len(days), len(book_ids)))
+    if not cells.empty:
+        day_positions = (cells['day'] - start_day).dt.days.to_numpy()
+        book_positions = pd.Index(book_ids).get_indexer(cells['book_id'])
+        np.add.at(series, (day_positions, book_positions), cells['quantity'].to_numpy())
+    return series
+
+
+def _build_model(cube, book_ids, end_day):
+    """Fit models for every book on the last HISTORY_DAYS days up to end_day."""
+    start_day = end_day - pd.Timedelta(days=HISTORY_DAYS - 1)
+    series = _daily_series(cube, book_ids, start_day, end_day)
+    model = fit_holt_winters(series)
+    model.update({
+        'book_ids': book_ids,
+        'start_day': start_day,
+        'end_day': end_day,
+        'fitted_totals': series.sum(axis=0)
+    })
+    return model
+
+
+def _refresh_model(model, cube, book_ids, end_day):
+    """Bring a model up to date with the current cube, refitting only when needed.
+
+    When the catalog is unchanged and the days already fitted still hold the
+    same sales, the model is advanced over the new days only. Any change to
+    history (a backdated sale, a deletion, a new book) triggers a refit.
+    """
+    if (
+        model is not None
+        and list(model['book_ids']) == list(book_ids)
+        and end_day >= model['end_day']
+        and np.array_equal(_daily_series(cube, book_ids, model['start_day'], model['end_day']).sum(axis=0), model['fitted_totals'])
+    ):
+        if end_day == model['end_day']:
+            return model
+
+        new_series = _daily_series(cube, book_ids, model['end_day'] + pd.Timedelta(days=1), end_day)
+        updated = update_holt_winters(model, new_series)
+        updated['end_day'] = end_day
+        updated['fitted_totals'] = model['fitted_totals'] + new_series.sum(axis=0)
+        return updated
+
+    return _build_model(cube, book_ids, end_day)
+
+
+def get_model():
+    """Return forecasting models for every book, refreshed for the current data version.
+
+    Series end on the latest day with sales in the catalog, so forecasts
+    start from the most recent data rather than from the calendar date.
+    Returns None when there are no books or sales.
+    """
+    global _model
+
+    with storage.snapshot(), _lock:
+        version = data_manager.get_data_version()
+        if _model is not None and _model[0] == version:
+            return _model[1]
+
+        books_df = data_manager.get_books()
+        cube = data_manager.get_sales_cube()
+        if books_df.empty or cube.empty:
+            model = None
+        else:
+            book_ids = sorted(books_df['id'].astype(int).tolist())
+            end_day = pd.Timestamp(cube['day'].iloc[-1])
+            model = _refresh_model(_model[1] if _model is not None else None, cube, book_ids, end_day)
+
+        # A reader pinned to older data doesn't replace models fitted on newer data
+        if _model is None or not storage.is_older(version, _model[0]):
+            _model = (version, model)
+        return model
+
+
+def get_book_forecast(book_id, horizon=90):
+    """Get a book's daily sales forecast with 95% prediction intervals.
+
+    Returns a DataFrame with date, forecast, lower and upper columns, or an
+    empty DataFrame when there is nothing to forecast from.
+    """
+    model = get_model()
+    columns = ['date', 'forecast', 'lower', 'upper']
+    if model is None or book_id not in model['book_ids']:
+        return pd.DataFrame(columns=columns)
+
+    position = model['book_ids'].index(book_id)
+    mean, lower, upper = forecast_holt_winters(model, horizon)
+
+    return pd.DataFrame({
+        'date': pd.date_range(model['end_day'] + pd.Timedelta(days=1), periods=horizon, freq='D'),
+        'forecast': mean[:, position],
+        'lower': lower[:, position],
+        'upper': upper[:, position]
+    })[columns]
+
+
+def get_projected_royalties(horizon=90):
+    """Project copies, revenue and royalties for every book over the next `horizon` days.
+
+    Projected sales are priced and rated like real sales dated at the end
+    of the horizon, so effective-dated rates and royalty tiers (continuing
+    from the copies already sold) apply. Returns one row per book.
+    """
+    columns = ['book_id', 'title', 'owner', 'projected_copies', 'lower_copies', 'upper_copies',
+               'projected_revenue', 'projected_royalty']
+    model = get_model()
+    if model is None:
+        return pd.DataFrame(columns=columns)
+
+    mean, lower, upper = forecast_holt_winters(model, horizon)
+    books_df = data_manager.get_books().set_index('id')
+    book_ids = model['book_ids']
+
+    projected = pd.DataFrame({
+        'book_id': book_ids,
+        'title': books_df.loc[book_ids, 'title'].to_numpy(),
+        'owner': books_df.loc[book_ids, 'owner'].to_numpy(),
+        'projected_copies': np.round(mean.sum(axis=0)).astype(int),
+        'lower_copies': np.round(lower.sum(axis=0)).astype(int),
+        'upper_copies': np.round(upper.sum(axis=0)).astype(int)
+    })
+
+    # Rate the projected sales as if they were recorded at the end of the horizon
+    future_sales = pd.DataFrame({
+        'date': (model['end_day'] + pd.Timedelta(days=horizon)).strftime('%Y-%m-%d'),
+        'book_id': projected['book_id'],
+        'quantity': projected['projected_copies']
+    })
+    prices = data_manager.lookup_book_versions(future_sales)['price']
+    future_sales['revenue'] = future_sales['quantity'] * prices
+    projected['projected_revenue'] = future_sales['revenue']
+    projected['projected_royalty'] = data_manager.calculate_royalties(
+        future_sales, copies_before=data_manager.get_sales_totals()['copies']
+    )
+
+    return projected[columns].sort_values('projected_royalty', ascending=False, ignore_index=True)
@@ -0,0 +1,326 @@
+import heapq
+import os
+import threading
+from bisect import insort
+from collections import deque
+
+import pandas as pd
+
+import data_manager
+import storage
+
+# Leaderboard windows, by the time period names used across the app (None = all time)
+WINDOWS = {
+    'Last 7 Days': 7,
+    'Last 30 Days': 30,
+    'Last 90 Days': 90,
+    'Last Year': 365,
+    'All Time': None
+}
+
+# What a leaderboard ranks, by copies sold
+DIMENSIONS = ('book', 'author', 'genre')
+
+# Entries each leaderboard keeps in order; reads asking for more are ranked
+# from the full totals instead
+CAPACITY = 50
+
+# Sales kept in each recent-sales buffer
+RECENT_SALES_SIZE = 100
+
+RECENT_COLUMNS = ['date', 'book_id', 'quantity', 'price', 'revenue', 'royalty', 'title', 'owner']
+
+# (data version, leaderboards) they were built from
+_leaderboards = None
+_lock = threading.Lock()
+
+
+def _rank(entry):
+    """Sort key for (key, total) entries: highest total first, then by key."""
+    return (-entry[1], entry[0])
+
+
+class Leaderboard:
+    """Running totals with the largest ones kept in order.
+
+    The top CAPACITY entries are held sorted, so reading the top K is a
+    slice. An increase only touches the sorted list when the entry is
+    already on it or overtakes its last place. A decrease to a listed
+    entry re-selects the list from all totals; that only happens when days
+    leave a window.
+    """
+
+    def __init__(self, totals=None, capacity=CAPACITY):
+        self.capacity = capacity
+        self.totals = {key: total for key, total in (totals or {}).items() if total > 0}
+        self._select()
+
+    def _select(self):
+        """Pick the top entries from all totals."""
+        self._top = heapq.nsmallest(self.capacity, self.totals.items(), key=_rank)
+        self._listed = {key for key, _ in self._top}
+
+    def add(self, key, amount):
+        """Add to (or, with a negative amount, subtract from) one entry's total."""
+        total = self.totals.get(key, 0) + amount
+        if total > 0:
+            self.totals[key] = total
+        else:
+            self.totals.pop(key, None)
+
+        if key in self._listed:
+            if amount < 0:
+                self._select()
+            else:
+                self._top = sorted(
+                    [(listed, self.totals[listed]) for listed, _ in self._top],
+                    key=_rank
+                )
+        elif amount > 0 and (len(self._top) < self.capacity or _rank((key, total)) < _rank(self._top[-1])):
+            insort(self._top, (key, total), key=_rank)
+            self._listed.add(key)
+            if len(self._top) > self.capacity:
+                dropped, _ = self._top.pop()
+                self._listed.discard(dropped)
+
+    def top(self, limit):
+        """Return the `limit` largest (key, total) entries."""
+        if limit > self.capacity:
+            # list() copies the totals in one step, so a concurrent update can't break the ranking
+            return heapq.nsmallest(limit, list(self.totals.items()), key=_rank)
+        return self._top[:limit]
+
+
+def _today():
+    return pd.Timestamp.now().normalize()
+
+
+def _window_starts(today):
+    """Return the first day each window covers on `today` (None for all time)."""
+    return {
+        window: today - pd.Timedelta(days=days - 1) if days else None
+        for window, days in WINDOWS.items()
+    }
+
+
+def _catalog(books_df):
+    """Return the attributes leaderboards need for each book, keyed by book id."""
+    if books_df.empty:
+        return {}
+    return {
+        int(book['id']): {
+            'title': book['title'],
+            'author': str(book['author']),
+            'genre': str(book['genre']),
+            'owner': book['owner']
+        }
+        for book in books_df.to_dict('records')
+    }
+
+
+def _book_totals(cube, start):
+    """Return copies sold per book in the cube from `start` on (all days if None)."""
+    if start is not None:
+        cube = cube.iloc[cube['day'].searchsorted(start):]
+    return cube.groupby('book_id')['quantity'].sum()
+
+
+def _boards_for_window(book_totals, catalog):
+    """Build one window's leaderboards for every scope and dimension.
+
+    Scope None ranks the whole catalog; each client also gets boards
+    covering only their own books.
+    """
+    books = pd.DataFrame.from_dict(catalog, orient='index')
+    frame = books.join(book_totals.rename('quantity'), how='inner')
+    frame = frame.assign(book=frame.index)
+
+    boards = {}
+    for dimension in DIMENSIONS:
+        totals = frame.groupby(dimension)['quantity'].sum()
+        boards[(None, dimension)] = Leaderboard(totals.to_dict())
+        for (owner, key), total in frame.groupby(['owner', dimension])['quantity'].sum().items():
+            if total > 0:
+                boards.setdefault((owner, dimension), Leaderboard()).totals[key] = total
+    for board in boards.values():
+        board._select()
+    return boards
+
+
+def _add_book_totals(state, window, book_totals, sign=1):
+    """Add (or subtract) copies per book to one window's leaderboards."""
+    for book_id, quantity in book_totals.items():
+        book = state['catalog'].get(int(book_id))
+        if book is None or not quantity:
+            continue
+        for scope in (None, book['owner']):
+            for dimension in DIMENSIONS:
+                key = int(book_id) if dimension == 'book' else book[dimension]
+                board = state['boards'].setdefault((scope, dimension, window), Leaderboard())
+                board.add(key, sign * quantity)
+
+
+def _remember(recent, scope, record):
+    """Put a sale into a scope's recent-sales buffer, keeping it in date order.
+
+    Sales dated on or after the newest one already held (the usual case)
+    are appended; older ones are slotted into place, or ignored when the
+    buffer is full and they are older than everything in it.
+    """
+    buffer = recent.setdefault(scope, deque(maxlen=RECENT_SALES_SIZE))
+    if len(buffer) == buffer.maxlen:
+        if record['date'] < buffer[0]['date']:
+            return
+        buffer.popleft()
+
+    position = len(buffer)
+    while position and buffer[position - 1]['date'] > record['date']:
+        position -= 1
+    buffer.insert(position, record)
+
+
+def _remember_sales(recent, sales, catalog):
+    """Feed sales, in file order, to the overall and per-client recent-sales buffers."""
+    sales = sales[sales['book_id'].isin(list(catalog))]
+    if sales.empty:
+        return
+
+    records = sales.assign(
+        date=pd.to_datetime(sales['date']).dt.strftime('%Y-%m-%d'),
+        book_id=sales['book_id'].astype(int),
+        title=sales['book_id'].map(lambda book_id: catalog[int(book_id)]['title']),
+        owner=sales['book_id'].map(lambda book_id: catalog[int(book_id)]['owner'])
+    ).sort_values('date', kind='mergesort')
+
+    # Only each client's newest sales can make it into any buffer
+    records = records.groupby('owner', sort=False).tail(RECENT_SALES_SIZE)
+    for record in records.reindex(columns=RECENT_COLUMNS).to_dict('records'):
+        _remember(recent, None, record)
+        _remember(recent, record['owner'], record)
+
+
+def build_leaderboards(chunksize=100000):
+    """Build the leaderboards and recent-sales buffers.
+
+    Window totals come from the sales cube; the recent-sales buffers come
+    from one chunked pass over sales.csv.
+    """
+    books_df = data_manager.get_books()
+    catalog = _catalog(books_df)
+    today = _today()
+    starts = _window_starts(today)
+    state = {'catalog': catalog, 'today': today, 'starts': starts, 'boards': {}, 'recent': {}}
+    if not catalog:
+        return state
+
+    cube = data_manager.get_sales_cube()
+    for window, start in starts.items():
+        for (scope, dimension), board in _boards_for_window(_book_totals(cube, start), catalog).items():
+            state['boards'][(scope, dimension, window)] = board
+
+    if os.path.exists('data/sales.csv'):
+        for chunk in pd.read_csv(storage.open_table('sales'), chunksize=chunksize):
+            _remember_sales(state['recent'], chunk, catalog)
+
+    return state
+
+
+def _advance(state, today):
+    """Move the windows forward to `today`, subtracting the days that left them."""
+    cube = data_manager.get_sales_cube()
+    starts = _window_starts(today)
+    for window, start in starts.items():
+        previous_start = state['starts'][window]
+        if start is None or start <= previous_start:
+            continue
+        expired = cube.iloc[cube['day'].searchsorted(previous_start):cube['day'].searchsorted(start)]
+        _add_book_totals(state, window, expired.groupby('book_id')['quantity'].sum(), sign=-1)
+    state['starts'] = starts
+    state['today'] = today
+
+
+def get_leaderboards():
+    """Return the leaderboards, rebuilt only when books or sales have changed.
+
+    Between writes, the windows are moved forward when the day changes.
+    """
+    global _leaderboards
+
+    with storage.snapshot(), _lock:
+        version = data_manager.get_data_version()
+        if _leaderboards is None or _leaderboards[0] != version or _today() < _leaderboards[1]['today']:
+            state = build_leaderboards()
+            # A reader pinned to older data doesn't replace leaderboards built from newer data
+            if _leaderboards is None or not storage.is_older(version, _leaderboards[0]):
+                _leaderboards = (version, state)
+            return state
+        if _today() > _leaderboards[1]['today']:
+            _advance(_leaderboards[1], _today())
+        return _leaderboards[1]
+
+
+def apply_sales(previous_version, current_version, new_sales):
+    """Add newly written sales to the leaderboards and recent-sales buffers.
+
+    The versions are those of sales.csv before and after the write; the
+    update is only applied when the leaderboards were built from the
+    previous one (and the catalog hasn't changed since), otherwise they
+    are rebuilt on the next read.
+    """
+    global _leaderboards
+
+    books_version = data_manager.get_table_version('books')
+    with _lock:
+        if _leaderboards is None or _leaderboards[0] != (books_version, previous_version) or new_sales.empty:
+            return
+
+        state = _leaderboards[1]
+        if _today() > state['today']:
+            _advance(state, _today())
+
+        days = pd.to_datetime(new_sales['date'])
+        for window, start in state['starts'].items():
+            in_window = new_sales if start is None else new_sales[(days >= start).to_numpy()]
+            _add_book_totals(state, window, in_window.groupby('book_id')['quantity'].sum())
+
+        _remember_sales(state['recent'], new_sales, state['catalog'])
+        _leaderboards = ((books_version, current_version), state)
+
+
+def _scope(username):
+    """Return the leaderboard scope for a user: everything for admin, their own books otherwise."""
+    return None if username == 'admin' else username
+
+
+def get_leaderboard(dimension, time_period='All Time', username='admin', limit=10):
+    """Get the best sellers by book, author or genre for a time period.
+
+    Returns the top `limit` entries with copies sold as `sales`; book
+    leaderboards also carry the book's title. Up to CAPACITY entries are
+    read from the maintained order, larger limits rank every total.
+    """
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"Unknown leaderboard dimension: {dimension}")
+
+    # Any other period means all time, as in filter_sales_by_time_period
+    if time_period not in WINDOWS:
+        time_period = 'All Time'
+
+    state = get_leaderboards()
+    board = state['boards'].get((_scope(username), dimension, time_period))
+    entries = board.top(limit) if board is not None else []
+
+    if dimension == 'book':
+        return pd.DataFrame(
+            [(book_id, state['catalog'][book_id]['title'], total) for book_id, total in entries],
+            columns=['book_id', 'title', 'sales']
+        )
+    return pd.DataFrame(entries, columns=[dimension, 'sales'])
+
+
+def get_recent_sales(username='admin', limit=10):
+    """Get the newest sales, by date, from the recent-sales buffer (at most RECENT_SALES_SIZE)."""
+    state = get_leaderboards()
+    buffer = state['recent'].get(_scope(username), ())
+    rows = [buffer[-1 - position] for position in range(min(limit, len(buffer)))]
+    return pd.DataFrame(rows, columns=RECENT_COLUMNS)
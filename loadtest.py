@@ -0,0 +1,373 @@
+import multiprocessing
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import auth
+import cohorts
+import data_manager
+import forecasting
+import storage
+import user_directory
+
+TIME_PERIODS = ["Last 7 Days", "Last 30 Days", "Last 90 Days", "Last Year", "All Time"]
+
+GENRES = ['Technology', 'Business', 'Marketing', 'Fiction', 'Biography', 'Self-Help', 'History', 'Poetry']
+
+# Password of every client in a generated dataset (admin keeps the default admin123)
+CLIENT_PASSWORD = 'client123'
+ADMIN_PASSWORD = 'admin123'
+
+# Relative weight of each operation in a simulated session
+DEFAULT_MIX = {
+    'login': 1,
+    'client_dashboard': 4,
+    'book_analytics': 3,
+    'admin_filter': 1,
+    'add_sale': 1
+}
+
+# Latency percentiles reported per operation
+PERCENTILES = (50, 95, 99)
+
+
+def generate_dataset(books=500, clients=50, sales=1000000, days=730, seed=0):
+    """Write a synthetic catalog, client list and sales history to an empty data/ folder.
+
+    Book popularity follows a long tail, so a few books carry most sales as
+    in real catalogs. Sales are spread over the last `days` days and rated
+    with the books' flat royalty percentages. Clients are client1..clientN,
+    all with the password CLIENT_PASSWORD. Returns (success, message).
+    """
+    if os.path.exists('data/books.csv') or os.path.exists('data/sales.csv'):
+        return False, "data/ already holds books or sales; generate into an empty directory."
+
+    os.makedirs('data', exist_ok=True)
+    rng = np.random.default_rng(seed)
+    today = pd.Timestamp.now().normalize()
+
+    usernames = [f'client{number}' for number in range(1, clients + 1)]
+    existing = {user['username'] for user in user_directory.list_users()}
+    for username in usernames:
+        if username not in existing:
+            user_directory.add_user(username, CLIENT_PASSWORD, f"Client {username[6:]}", 'client', f'{username}@example.com')
+
+    book_ids = np.arange(1, books + 1)
+    publication_days = rng.integers(0, days * 2, size=books)
+    books_df = pd.DataFrame({
+        'id': book_ids,
+        'title': [f"Load Test Book {book_id}" for book_id in book_ids],
+        'author': [f"Author {number}" for number in rng.integers(1, max(books // 3, 1) + 1, size=books)],
+        'genre': rng.choice(GENRES, size=books),
+        'owner': rng.choice(usernames, size=books),
+        'isbn': [f"978-0-{book_id:06d}-0" for book_id in book_ids],
+        'royalty_percentage': rng.choice([8.0, 10.0, 12.5, 15.0], size=books),
+        'price': np.round(rng.uniform(9.99, 39.99, size=books), 2),
+        'publication_date': (today - pd.to_timedelta(publication_days, unit='D')).strftime('%Y-%m-%d')
+    })
+
+    popularity = 1.0 / np.arange(1, books + 1)
+    sold_books = rng.choice(rng.permutation(book_ids), size=sales, p=popularity / popularity.sum())
+    sale_days = np.sort(rng.integers(0, days, size=sales))[::-1]
+    sales_df = pd.DataFrame({
+        'date': (today - pd.to_timedelta(sale_days, unit='D')).strftime('%Y-%m-%d'),
+        'book_id': sold_books,
+        'quantity': rng.integers(1, 11, size=sales)
+    })
+    sales_df['price'] = sales_df['book_id'].map(books_df.set_index('id')['price']).to_numpy()
+    sales_df['revenue'] = (sales_df['quantity'] * sales_df['price']).round(2)
+
+    with storage.write_lock():
+        with storage.atomic_writer('data/books.csv') as books_file:
+            books_df.to_csv(books_file, index=False)
+        storage.bump_version('books')
+
+        # Rated once the catalog is in place, from the book versions seeded from it
+        sales_df['royalty'] = data_manager.calculate_royalties(sales_df, books_df)
+        with storage.atomic_writer('data/sales.csv') as sales_file:
+            sales_df[data_manager.SALES_COLUMNS].to_csv(sales_file, index=False)
+        storage.bump_version('sales')
+
+    return True, f"Generated {books:,} books, {clients:,} clients and {sales:,} sales over {days:,} days."
+
+
+def client_dashboard(session):
+    """The data_manager calls of one Client Dashboard render, with random filters."""
+    username = session['username']
+    rng = session['rng']
+
+    data_manager.update_sales_royalties()
+    user_books = data_manager.get_user_books(username)
+    if user_books.empty:
+        return
+
+    data_manager.get_client_balance(username)
+    data_manager.get_payments(username)
+
+    time_period = rng.choice(TIME_PERIODS)
+    selected_book = rng.choice(["All Books"] + user_books['title'].tolist())
+    filtered_data = data_manager.filter_sales_by_time_period(username, time_period)
+    if selected_book != "All Books" and not filtered_data.empty:
+        filtered_data = filtered_data[filtered_data['title'] == selected_book]
+    if filtered_data.empty:
+        return
+
+    # The comparison selector; anything but "None" reads all of the client's sales
+    if rng.choice(["None", "Previous Period", "Year-over-Year"]) != "None":
+        data_manager.get_user_sales(username)
+
+    if selected_book == "All Books":
+        data_manager.get_sales_trend(username, time_period)
+    else:
+        book_id = user_books[user_books['title'] == selected_book]['id'].iloc[0]
+        data_manager.get_book_sales_trend(username, time_period, book_id)
+
+    data_manager.get_top_books(username, time_period)
+    data_manager.get_sales_by_genre(username, time_period)
+    data_manager.get_royalties_by_book(username, time_period)
+
+
+def book_analytics(session):
+    """The data_manager calls of one Book Analytics render, for a random book and period."""
+    username = session['username']
+    rng = session['rng']
+
+    data_manager.update_sales_royalties()
+    user_books = data_manager.get_user_books(username)
+    if user_books.empty:
+        return
+
+    book_id = int(rng.choice(user_books['id'].tolist()))
+    time_period = rng.choice(TIME_PERIODS)
+
+    all_sales = data_manager.get_user_sales(username)
+    book_sales = all_sales[all_sales['book_id'] == book_id] if not all_sales.empty else pd.DataFrame()
+    if book_sales.empty:
+        return
+
+    filtered_sales = data_manager.filter_sales_by_time_period(username, time_period)
+    filtered_sales = filtered_sales[filtered_sales['book_id'] == book_id] if not filtered_sales.empty else pd.DataFrame()
+
+    data_manager.get_book_totals(book_id)
+    if not filtered_sales.empty:
+        data_manager.build_sales_trend(filtered_sales)
+        data_manager.get_book_seasonality(book_id, by='month')
+        data_manager.get_book_seasonality(book_id, by='weekday')
+
+    curve = cohorts.book_curve(book_id, unit='week', max_age=104)
+    if not curve.empty:
+        cohorts.cohort_curves(by='genre', unit='week', max_age=int(curve['age'].max()))
+    forecasting.get_book_forecast(book_id, rng.choice([30, 90, 180]))
+
+
+def admin_filter(session):
+    """The Admin Panel's sales table and pivot explorer, with a random client and period."""
+    rng = session['rng']
+
+    clients = data_manager.get_clients()
+    client_filter = rng.choice(['All Clients'] + clients['username'].tolist())
+    date_filter = rng.choice(TIME_PERIODS)
+
+    sales_df = data_manager.get_user_sales('admin')
+    if not sales_df.empty:
+        if client_filter != 'All Clients':
+            sales_df = sales_df[sales_df['owner'] == client_filter]
+        if date_filter != "All Time":
+            sales_df = data_manager.filter_sales_by_time_period('admin', date_filter)
+
+    filters = {'owner': [client_filter]} if client_filter != 'All Clients' else {}
+    data_manager.query_cube(['month', 'genre'], ['revenue'], filters=filters)
+
+
+def login(session):
+    """A login through auth.authenticate."""
+    success, _, _ = auth.authenticate(session['username'], session['password'])
+    if not success:
+        raise RuntimeError(f"Login failed for {session['username']}")
+
+
+def add_sale(session):
+    """A sale of one of the session's books, recorded today."""
+    book_id = int(session['rng'].choice(session['book_ids']))
+    if not data_manager.add_sale(book_id, datetime.now().strftime('%Y-%m-%d'), session['rng'].randint(1, 5)):
+        raise RuntimeError(f"Sale of book {book_id} was rejected")
+
+
+OPERATIONS = {
+    'login': login,
+    'client_dashboard': client_dashboard,
+    'book_analytics': book_analytics,
+    'admin_filter': admin_filter,
+    'add_sale': add_sale
+}
+
+
+def parse_mix(text):
+    """Parse an operation mix such as 'client_dashboard=4,add_sale=1' into weights."""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {name}. Use any of {', '.join(OPERATIONS)}.")
+        mix[name] = float(weight) if weight else 1.0
+    return mix
+
+
+def _sessions(first, count, seed):
+    """Return the state of simulated sessions number first..first+count-1.
+
+    Sessions are spread over the clients round-robin; admin operations
+    always run as admin.
+    """
+    clients = data_manager.get_clients()['username'].tolist()
+    books_df = data_manager.get_books()
+    sessions = []
+    for number in range(first, first + count):
+        username = clients[number % len(clients)] if clients else 'admin'
+        owned = books_df[books_df['owner'] == username]['id'].tolist() if not books_df.empty else []
+        sessions.append({
+            'number': number,
+            'username': username,
+            'password': CLIENT_PASSWORD if clients else ADMIN_PASSWORD,
+            'book_ids': owned or books_df['id'].tolist(),
+            'rng': random.Random(seed * 100003 + number)
+        })
+    return sessions
+
+
+def _run_operation(session, name):
+    """Run one operation as a page render would: inside a snapshot, as its user."""
+    if name == 'admin_filter':
+        session = dict(session, username='admin')
+    with storage.snapshot():
+        OPERATIONS[name](session)
+
+
+def run_sessions(first, count, duration, mix, seed=0, think_time=0.0, warmup=True):
+    """Run `count` simulated sessions on threads of this process for `duration` seconds.
+
+    Each session picks operations at random in proportion to `mix`,
+    waiting `think_time` seconds between them. With `warmup`, every
+    operation runs once first so the caches are built before the clock
+    starts. Returns ({operation: (latencies in seconds, error count)},
+    seconds from the start until the last operation finished).
+    """
+    sessions = _sessions(first, count, seed)
+    if warmup and sessions:
+        for name in mix:
+            try:
+                _run_operation(sessions[0], name)
+            except Exception as e:
+                print(f"Warm-up of {name} failed: {e}")
+
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = {name: ([], [0]) for name in names}
+    lock = threading.Lock()
+    started = time.monotonic()
+    deadline = started + duration
+
+    def run(session):
+        latencies = {name: [] for name in names}
+        errors = {name: 0 for name in names}
+        while time.monotonic() < deadline:
+            name = session['rng'].choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                _run_operation(session, name)
+                latencies[name].append(time.perf_counter() - started)
+            except Exception:
+                errors[name] += 1
+            if think_time:
+                time.sleep(session['rng'].expovariate(1 / think_time))
+        with lock:
+            for name in names:
+                results[name][0].extend(latencies[name])
+                results[name][1][0] += errors[name]
+
+    threads = [threading.Thread(target=run, args=(session,), daemon=True) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.monotonic() - started
+    return {name: (latencies, errors[0]) for name, (latencies, errors) in results.items()}, elapsed
+
+
+def _run_process(data_dir, first, count, duration, mix, seed, think_time, warmup):
+    """Entry point of a worker process: run its share of the sessions from data_dir."""
+    os.chdir(data_dir)
+    return run_sessions(first, count, duration, mix, seed, think_time, warmup)
+
+
+def run_load_test(users=20, processes=1, duration=30.0, mix=None, seed=0, think_time=0.0, warmup=True):
+    """Simulate `users` concurrent sessions against the data in the current directory.
+
+    Sessions are split evenly over `processes` worker processes, each
+    running its sessions on threads, so the results cover both the
+    in-process caches shared between threads and the cross-process
+    version checks. With one process everything runs in this process.
+    Returns (summary DataFrame, elapsed seconds including start-up).
+    """
+    mix = mix or DEFAULT_MIX
+    shares = [users // processes + (1 if number < users % processes else 0) for number in range(processes)]
+    firsts = [sum(shares[:number]) for number in range(processes)]
+
+    started = time.monotonic()
+    if processes == 1:
+        outcomes = [run_sessions(0, users, duration, mix, seed, think_time, warmup)]
+    else:
+        # Spawned, not forked, so workers don't inherit this process's locks or snapshot
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+            futures = [
+                executor.submit(_run_process, os.getcwd(), first, share, duration, mix, seed, think_time, warmup)
+                for first, share in zip(firsts, shares) if share
+            ]
+            outcomes = [future.result() for future in futures]
+    elapsed = time.monotonic() - started
+
+    return summarize(outcomes), elapsed
+
+
+def summarize(outcomes):
+    """Combine per-process results into throughput and latency percentiles per operation.
+
+    Throughput is measured over the longest process's run, which includes
+    the operations still finishing when the duration ran out.
+    """
+    duration = max(window for _, window in outcomes)
+    outcomes = [results for results, _ in outcomes]
+    rows = []
+    for name in outcomes[0]:
+        latencies = np.concatenate([np.asarray(outcome[name][0], dtype=float) for outcome in outcomes])
+        errors = sum(outcome[name][1] for outcome in outcomes)
+        row = {'operation': name, 'count': len(latencies), 'errors': errors, 'per_second': len(latencies) / duration}
+        for percentile in PERCENTILES:
+            row[f'p{percentile}_ms'] = np.percentile(latencies, percentile) * 1000 if len(latencies) else np.nan
+        row['max_ms'] = latencies.max() * 1000 if len(latencies) else np.nan
+        rows.append(row)
+
+    summary = pd.DataFrame(rows)
+    total = {'operation': 'all', 'count': summary['count'].sum(), 'errors': summary['errors'].sum(), 'per_second': summary['count'].sum() / duration}
+    all_latencies = np.concatenate([np.asarray(outcome[name][0], dtype=float) for outcome in outcomes for name in outcome])
+    for percentile in PERCENTILES:
+        total[f'p{percentile}_ms'] = np.percentile(all_latencies, percentile) * 1000 if len(all_latencies) else np.nan
+    total['max_ms'] = all_latencies.max() * 1000 if len(all_latencies) else np.nan
+    return pd.concat([summary, pd.DataFrame([total])], ignore_index=True)
+
+
+def format_summary(summary):
+    """Render a load test summary as a fixed-width table."""
+    return summary.to_string(
+        index=False,
+        formatters={column: '{:,.1f}'.format for column in summary.columns if column.endswith('_ms') or column == 'per_second'}
+    )
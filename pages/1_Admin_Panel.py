@@ -1,8 +1,17 @@
 import streamlit as st
 import pandas as pd
+import plotly.express as px
 from datetime import datetime, timedelta
+import anomalies
+import cohorts
 import data_manager
+import forecasting
+import leaderboards
+import session_memory
+import sketches
+import storage
 import auth
+import widgets
 
 # Set page config
 st.set_page_config(
@@ -11,6 +20,9 @@ st.set_page_config(
     layout="wide"
 )
 
+# Read one consistent version of the data for the whole render
+storage.begin_snapshot()
+
 # Display logo in sidebar
 with st.sidebar:
     st.image("attached_assets/logo.png", width=200)
@@ -31,8 +43,13 @@ auth.show_user_info()
 # Main content
 st.title("Admin Panel")
 
-# Tabs for different admin functionalities
-tab1, tab2, tab3 = st.tabs(["Book Management", "Sales Management", "User Management"])
+# Message from the last change made in one of the sections below
+widgets.show_flash()
+
+# Tabs for different admin functionalities. Each section below is a fragment,
+# so interacting with its widgets only reruns that section; writes that affect
+# other sections trigger a full rerun.
+tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["Book Management", "Sales Management", "User Management", "Payments", "Pivot Explorer", "Lifecycle", "Memory"])
 
 with tab1:
     st.header("Book Management")
@@ -41,137 +58,246 @@ with tab1:
     col1, col2 = st.columns([1, 1])
 
     with col1:
-        st.subheader("Add New Book")
-
-        # Form for adding a new book
-        with st.form("add_book_form"):
-            title = st.text_input("Book Title")
-            author = st.text_input("Author")
-            genre = st.selectbox(
-                "Genre",
-                ["Technology", "Business", "Marketing", "Science", "Fiction", "Non-Fiction", "Self-Help", "Other"]
-            )
-
-            # Get clients for owner selection
-            clients = data_manager.get_clients()
-            client_options = clients['username'].tolist() if not clients.empty else []
+        @st.fragment
+        def add_book_section():
+            st.subheader("Add New Book")
+
+            # Form for adding a new book
+            with st.form("add_book_form"):
+                title = st.text_input("Book Title")
+                author = st.text_input("Author")
+                genre = st.selectbox(
+                    "Genre",
+                    ["Technology", "Business", "Marketing", "Science", "Fiction", "Non-Fiction", "Self-Help", "Other"]
+                )
 
-            owner = st.selectbox("Owner (Client)", client_options)
-            isbn = st.text_input("ISBN", placeholder="e.g., 978-1-234567-89-0")
-            royalty_percentage = st.number_input("Royalty Percentage (%)", min_value=0.0, max_value=100.0, value=10.0, step=0.5)
-            price = st.number_input("Price (₹)", min_value=0.0, max_value=100000.0, value=1499.99, step=0.01)
-            publication_date = st.date_input("Publication Date", value=datetime.now())
+                # Get clients for owner selection
+                clients = data_manager.get_clients()
+                client_options = clients['username'].tolist() if not clients.empty else []
 
-            submit_button = st.form_submit_button("Add Book")
+                owner = st.selectbox("Owner (Client)", client_options)
+                isbn = st.text_input("ISBN", placeholder="e.g., 978-1-234567-89-0")
+                royalty_percentage = st.number_input("Royalty Percentage (%)", min_value=0.0, max_value=100.0, value=10.0, step=0.5)
+                price = st.number_input("Price (₹)", min_value=0.0, max_value=100000.0, value=1499.99, step=0.01)
+                publication_date = st.date_input("Publication Date", value=datetime.now())
 
-            if submit_button:
-                if not title or not author or not owner:
-                    st.error("Please fill out all required fields.")
-                else:
-                    book_id = data_manager.add_book(
-                        title=title,
-                        author=author,
-                        genre=genre,
-                        owner=owner,
-                        price=price,
-                        publication_date=publication_date.strftime('%Y-%m-%d'),
-                        isbn=isbn,
-                        royalty_percentage=royalty_percentage
-                    )
+                submit_button = st.form_submit_button("Add Book")
 
-                    if book_id:
-                        st.success(f"Book '{title}' added successfully with ID: {book_id}")
+                if submit_button:
+                    if not title or not author or not owner:
+                        st.error("Please fill out all required fields.")
                     else:
-                        st.error("Failed to add book. Please try again.")
+                        book_id = data_manager.add_book(
+                            title=title,
+                            author=author,
+                            genre=genre,
+                            owner=owner,
+                            price=price,
+                            publication_date=publication_date.strftime('%Y-%m-%d'),
+                            isbn=isbn,
+                            royalty_percentage=royalty_percentage
+                        )
+
+                        if book_id:
+                            widgets.flash(f"Book '{title}' added successfully with ID: {book_id}")
+                            st.rerun()
+                        else:
+                            st.error("Failed to add book. Please try again.")
+
+        add_book_section()
 
     with col2:
-        st.subheader("Edit/Delete Books")
+        @st.fragment
+        def edit_book_section():
+            st.subheader("Edit/Delete Books")
 
-        # Get all books
-        books_df = data_manager.get_books()
+            # Get all books
+            books_df = data_manager.get_books()
 
-        if books_df.empty:
-            st.info("No books available in the system.")
-        else:
-            # Select a book to edit
-            book_titles = books_df['title'].tolist()
-            book_titles.insert(0, "-- Select a book to edit --")
-            selected_book_title = st.selectbox("Select Book", book_titles)
+            if books_df.empty:
+                st.info("No books available in the system.")
+            else:
+                # Select a book to edit
+                selected_book_id = widgets.book_search_picker(
+                    "Select Book",
+                    key="edit_book",
+                    placeholder="-- Select a book to edit --"
+                )
 
-            if selected_book_title != "-- Select a book to edit --":
-                # Get the selected book
-                selected_book = books_df[books_df['title'] == selected_book_title].iloc[0]
+                if selected_book_id is not None and selected_book_id in books_df['id'].values:
+                    # Get the selected book
+                    selected_book = books_df[books_df['id'] == selected_book_id].iloc[0]
 
-                with st.form("edit_book_form"):
-                    # Pre-fill form with current values
-                    edit_title = st.text_input("Book Title", value=selected_book['title'])
-                    edit_author = st.text_input("Author", value=selected_book['author'])
+                    with st.form("edit_book_form"):
+                        # Pre-fill form with current values
+                        edit_title = st.text_input("Book Title", value=selected_book['title'])
+                        edit_author = st.text_input("Author", value=selected_book['author'])
 
-                    genre_options = ["Technology", "Business", "Marketing", "Science", "Fiction", "Non-Fiction", "Self-Help", "Other"]
-                    genre_index = genre_options.index(selected_book['genre']) if selected_book['genre'] in genre_options else 0
-                    edit_genre = st.selectbox("Genre", genre_options, index=genre_index)
+                        genre_options = ["Technology", "Business", "Marketing", "Science", "Fiction", "Non-Fiction", "Self-Help", "Other"]
+                        genre_index = genre_options.index(selected_book['genre']) if selected_book['genre'] in genre_options else 0
+                        edit_genre = st.selectbox("Genre", genre_options, index=genre_index)
 
-                    # Get clients for owner selection
-                    clients = data_manager.get_clients()
-                    client_options = clients['username'].tolist() if not clients.empty else []
+                        # Get clients for owner selection
+                        clients = data_manager.get_clients()
+                        client_options = clients['username'].tolist() if not clients.empty else []
 
-                    # Find index of current owner in client options
-                    owner_index = client_options.index(selected_book['owner']) if selected_book['owner'] in client_options else 0
-                    edit_owner = st.selectbox("Owner (Client)", client_options, index=owner_index)
+                        # Find index of current owner in client options
+                        owner_index = client_options.index(selected_book['owner']) if selected_book['owner'] in client_options else 0
+                        edit_owner = st.selectbox("Owner (Client)", client_options, index=owner_index)
 
-                    # Get ISBN value if it exists
-                    isbn_value = selected_book.get('isbn', '')
-                    edit_isbn = st.text_input("ISBN", value=isbn_value, placeholder="e.g., 978-1-234567-89-0")
+                        # Get ISBN value if it exists
+                        isbn_value = selected_book.get('isbn', '')
+                        edit_isbn = st.text_input("ISBN", value=isbn_value, placeholder="e.g., 978-1-234567-89-0")
 
-                    # Get royalty percentage if it exists
-                    royalty_value = selected_book.get('royalty_percentage', 10.0)
-                    edit_royalty = st.number_input("Royalty Percentage (%)", min_value=0.0, max_value=100.0, value=float(royalty_value), step=0.5)
+                        # Get royalty percentage if it exists
+                        royalty_value = selected_book.get('royalty_percentage', 10.0)
+                        edit_royalty = st.number_input("Royalty Percentage (%)", min_value=0.0, max_value=100.0, value=float(royalty_value), step=0.5)
 
-                    edit_price = st.number_input("Price (₹)", min_value=0.0, max_value=10000.0, value=float(selected_book['price']), step=0.01)
+                        edit_price = st.number_input("Price (₹)", min_value=0.0, max_value=10000.0, value=float(selected_book['price']), step=0.01)
+                        edit_effective_date = st.date_input(
+                            "Price/Royalty Changes Effective From",
+                            value=datetime.now(),
+                            help="Sales before this date keep the price and royalty rate that applied when they were made."
+                        )
 
-                    # Parse the publication date
-                    try:
-                        pub_date = datetime.strptime(selected_book['publication_date'], '%Y-%m-%d')
-                    except:
-                        pub_date = datetime.now()
+                        # Parse the publication date
+                        try:
+                            pub_date = datetime.strptime(selected_book['publication_date'], '%Y-%m-%d')
+                        except:
+                            pub_date = datetime.now()
 
-                    edit_publication_date = st.date_input("Publication Date", value=pub_date)
+                        edit_publication_date = st.date_input("Publication Date", value=pub_date)
 
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        update_button = st.form_submit_button("Update Book")
-                    with col2:
-                        delete_button = st.form_submit_button("Delete Book", type="primary")
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            update_button = st.form_submit_button("Update Book")
+                        with col2:
+                            delete_button = st.form_submit_button("Delete Book", type="primary")
 
-                    if update_button:
-                        if not edit_title or not edit_author or not edit_owner:
-                            st.error("Please fill out all required fields.")
-                        else:
-                            success = data_manager.update_book(
-                                book_id=selected_book['id'],
-                                title=edit_title,
-                                author=edit_author,
-                                genre=edit_genre,
-                                owner=edit_owner,
-                                price=edit_price,
-                                publication_date=edit_publication_date.strftime('%Y-%m-%d'),
-                                isbn=edit_isbn,
-                                royalty_percentage=edit_royalty
-                            )
+                        if update_button:
+                            if not edit_title or not edit_author or not edit_owner:
+                                st.error("Please fill out all required fields.")
+                            else:
+                                success = data_manager.update_book(
+                                    book_id=selected_book['id'],
+                                    title=edit_title,
+                                    author=edit_author,
+                                    genre=edit_genre,
+                                    owner=edit_owner,
+                                    price=edit_price,
+                                    publication_date=edit_publication_date.strftime('%Y-%m-%d'),
+                                    isbn=edit_isbn,
+                                    royalty_percentage=edit_royalty,
+                                    effective_date=edit_effective_date.strftime('%Y-%m-%d')
+                                )
+
+                                if success:
+                                    widgets.flash(f"Book '{edit_title}' updated successfully.")
+                                    st.rerun()
+                                else:
+                                    st.error("Failed to update book. Please try again.")
+
+                        if delete_button:
+                            success = data_manager.delete_book(selected_book['id'])
 
                             if success:
-                                st.success(f"Book '{edit_title}' updated successfully.")
+                                widgets.flash(f"Book '{selected_book['title']}' deleted successfully.")
+                                st.rerun()
                             else:
-                                st.error("Failed to update book. Please try again.")
+                                st.error("Failed to delete book. Please try again.")
+
+                    # Show the price and royalty rate history of the book
+                    with st.expander("Price & Royalty History"):
+                        history = data_manager.get_book_history(selected_book['id'])
+                        st.dataframe(
+                            history[['effective_date', 'price', 'royalty_percentage']],
+                            column_config={
+                                "effective_date": "Effective From",
+                                "price": st.column_config.NumberColumn("Price (₹)", format="₹%.2f"),
+                                "royalty_percentage": st.column_config.NumberColumn("Royalty %", format="%.1f%%")
+                            },
+                            hide_index=True,
+                            use_container_width=True
+                        )
 
-                    if delete_button:
-                        success = data_manager.delete_book(selected_book['id'])
+                    # Edit the tiered royalty schedule of the book
+                    with st.expander("Royalty Tiers"):
+                        st.caption("Pay a different royalty percentage once cumulative copies sold reach each tier. Leave empty to use the flat royalty percentage.")
+                        schedule = data_manager.get_royalty_schedule(selected_book['id'])
+                        edited_schedule = st.data_editor(
+                            schedule[['min_copies', 'royalty_percentage']],
+                            column_config={
+                                "min_copies": st.column_config.NumberColumn("From Copies", min_value=0, step=1, required=True),
+                                "royalty_percentage": st.column_config.NumberColumn("Royalty %", min_value=0.0, max_value=100.0, step=0.5, required=True)
+                            },
+                            num_rows="dynamic",
+                            hide_index=True,
+                            key=f"royalty_tiers_{selected_book['id']}"
+                        )
 
-                        if success:
-                            st.success(f"Book '{selected_book['title']}' deleted successfully.")
-                            st.rerun()
-                        else:
-                            st.error("Failed to delete book. Please try again.")
+                        if st.button("Save Royalty Tiers", key="save_royalty_tiers"):
+                            tiers = edited_schedule.dropna().itertuples(index=False, name=None)
+                            success, message = data_manager.set_royalty_schedule(selected_book['id'], list(tiers))
+
+                            if success:
+                                widgets.flash(message)
+                                st.rerun()
+                            else:
+                                st.error(message)
+
+        edit_book_section()
+
+    @st.fragment
+    def bulk_import_section():
+        # Bulk import from a publisher's catalog file
+        st.subheader("Bulk Import Books")
+        st.caption("Upload a CSV with columns: title, author, genre, owner, price, publication_date (YYYY-MM-DD), isbn, royalty_percentage.")
+
+        uploaded_catalog = st.file_uploader("Upload Catalog CSV", type="csv", key="bulk_book_upload")
+
+        if uploaded_catalog is not None:
+            try:
+                # Parsed once per upload and kept for the reruns that review and import it
+                import_df = session_memory.remember(
+                    'catalog_upload', lambda: pd.read_csv(uploaded_catalog, dtype={'isbn': str}),
+                    key=uploaded_catalog.file_id
+                )
+            except Exception as e:
+                st.error(f"Error reading catalog file: {e}")
+                import_df = None
+
+            if import_df is not None:
+                valid_books, rejections = data_manager.validate_book_import(import_df)
+                st.info(f"{len(valid_books)} of {len(import_df)} rows are valid and ready to import.")
+
+                if not rejections.empty:
+                    st.warning(f"{len(rejections)} rows will be rejected.")
+                    st.dataframe(
+                        rejections,
+                        use_container_width=True,
+                        column_config={
+                            "row": "Row",
+                            "title": "Title",
+                            "reason": "Reason"
+                        }
+                    )
+                    st.download_button(
+                        label="Download Rejection Report",
+                        data=rejections.to_csv(index=False).encode('utf-8'),
+                        file_name=f"book_import_rejections_{datetime.now().strftime('%Y%m%d')}.csv",
+                        mime="text/csv"
+                    )
+
+                if not valid_books.empty and st.button(f"Import {len(valid_books)} Books"):
+                    imported_books, rejections = data_manager.import_books(import_df)
+                    session_memory.forget('catalog_upload')
+                    widgets.flash(
+                        f"Imported {len(imported_books)} books with IDs "
+                        f"{imported_books['id'].min()}-{imported_books['id'].max()}."
+                    )
+                    st.rerun()
+
+    bulk_import_section()
 
     # Display all books
     st.subheader("All Books")
@@ -212,181 +338,324 @@ with tab2:
     col1, col2 = st.columns([1, 1])
 
     with col1:
-        st.subheader("Add New Sale")
+        @st.fragment
+        def add_sale_section():
+            st.subheader("Add New Sale")
 
-        # Form for adding a new sale
-        with st.form("add_sale_form"):
             # Get all books for selection
             books_df = data_manager.get_books()
 
+            # The picker sits outside the form so the matches update as the user types
             if books_df.empty:
                 st.info("No books available. Please add books first.")
                 book_id = None
             else:
-                book_options = [f"{row['id']} - {row['title']} ({row['owner']})" for _, row in books_df.iterrows()]
-                selected_book = st.selectbox("Select Book", book_options)
-                book_id = int(selected_book.split(' - ')[0]) if selected_book else None
-
-            sale_date = st.date_input("Sale Date", value=datetime.now())
-            quantity = st.number_input("Quantity Sold", min_value=1, max_value=1000, value=1, step=1)
-
-            # Get current book price if a book is selected
-            price = None
-            if book_id is not None:
-                book = books_df[books_df['id'] == book_id]
-                if not book.empty:
-                    price = book.iloc[0]['price']
-                    st.info(f"Current book price: ₹{price:.2f}")
-
-            # Option to override price
-            override_price = st.checkbox("Override Price")
-            if override_price:
-                price = st.number_input("Sale Price ($)", min_value=0.0, max_value=1000.0, value=price if price else 19.99, step=0.01)
-
-            submit_button = st.form_submit_button("Add Sale")
-
-            if submit_button and book_id is not None:
-                success = data_manager.add_sale(
-                    book_id=book_id,
-                    date=sale_date.strftime('%Y-%m-%d'),
-                    quantity=quantity,
-                    price=price if override_price else None
-                )
+                book_id = widgets.book_search_picker("Select Book", key="sale_book")
+
+            # Form for adding a new sale
+            with st.form("add_sale_form"):
+                sale_date = st.date_input("Sale Date", value=datetime.now())
+                quantity = st.number_input("Quantity Sold", min_value=1, max_value=1000, value=1, step=1)
+
+                # Get current book price if a book is selected
+                price = None
+                if book_id is not None:
+                    book = books_df[books_df['id'] == book_id]
+                    if not book.empty:
+                        price = book.iloc[0]['price']
+                        st.info(f"Current book price: ₹{price:.2f}")
+
+                # Option to override price
+                override_price = st.checkbox("Override Price")
+                if override_price:
+                    price = st.number_input("Sale Price ($)", min_value=0.0, max_value=1000.0, value=price if price else 19.99, step=0.01)
+
+                submit_button = st.form_submit_button("Add Sale")
+
+                if submit_button and book_id is not None:
+                    success = data_manager.add_sale(
+                        book_id=book_id,
+                        date=sale_date.strftime('%Y-%m-%d'),
+                        quantity=quantity,
+                        price=price if override_price else None
+                    )
 
-                if success:
-                    st.success(f"Sale added successfully!")
-                else:
-                    st.error("Failed to add sale. Please try again.")
+                    if success:
+                        widgets.flash("Sale added successfully!")
+                        st.rerun()
+                    else:
+                        st.error("Failed to add sale. Please try again.")
+
+        add_sale_section()
 
     with col2:
         st.subheader("Recent Sales")
 
-        # Get recent sales
-        sales_df = data_manager.get_user_sales('admin')
+        # The most recent sales come from the recent-sales buffer
+        recent_sales = data_manager.get_recent_sales('admin', limit=10)
 
-        if sales_df.empty:
+        if recent_sales.empty:
             st.info("No sales data available.")
         else:
-            # Display the most recent sales
-            recent_sales = sales_df.sort_values('date', ascending=False).head(10)
-
-            # Select columns to display
-            display_columns = ['date', 'title', 'quantity', 'price', 'revenue', 'owner']
-            column_config = {
-                "date": "Date",
-                "title": "Book Title",
-                "quantity": "Quantity",
-                "price": st.column_config.NumberColumn("Price", format="₹%.2f"),
-                "revenue": st.column_config.NumberColumn("Revenue", format="₹%.2f"),
-                "owner": "Client"
-            }
-
-            # Add royalty column if it exists
-            if 'royalty' in recent_sales.columns:
-                display_columns.append('royalty')
-                column_config["royalty"] = st.column_config.NumberColumn("Royalty", format="₹%.2f")
-
             st.dataframe(
-                recent_sales[display_columns],
+                recent_sales[['date', 'title', 'quantity', 'price', 'revenue', 'owner', 'royalty']],
                 use_container_width=True,
-                column_config=column_config
+                column_config={
+                    "date": "Date",
+                    "title": "Book Title",
+                    "quantity": "Quantity",
+                    "price": st.column_config.NumberColumn("Price", format="₹%.2f"),
+                    "revenue": st.column_config.NumberColumn("Revenue", format="₹%.2f"),
+                    "owner": "Client",
+                    "royalty": st.column_config.NumberColumn("Royalty", format="₹%.2f")
+                }
             )
 
-    # Sales filtering and display
-    st.subheader("Sales Data")
+    @st.fragment
+    def leaderboards_section():
+        st.subheader("Leaderboards")
 
-    # Filters
-    col1, col2, col3 = st.columns(3)
+        leaderboard_period = st.selectbox(
+            "Time Period",
+            list(leaderboards.WINDOWS),
+            index=len(leaderboards.WINDOWS) - 1,
+            key="leaderboard_period"
+        )
 
-    with col1:
-        # Get clients for filtering
-        clients = data_manager.get_clients()
-        client_options = ['All Clients'] + clients['username'].tolist() if not clients.empty else ['All Clients']
-        client_filter = st.selectbox("Filter by Client", client_options)
+        col1, col2, col3 = st.columns(3)
 
-    with col2:
-        # Get books for filtering
-        books = data_manager.get_books()
-        book_options = ['All Books'] + books['title'].tolist() if not books.empty else ['All Books']
-        book_filter = st.selectbox("Filter by Book", book_options)
-
-    with col3:
-        # Date range filter
-        date_filter = st.selectbox(
-            "Filter by Date",
-            ["All Time", "Last 7 Days", "Last 30 Days", "Last 90 Days", "Last Year", "Custom Range"]
-        )
+        boards = [
+            (col1, 'book', 'title', "Top Books", "Book Title"),
+            (col2, 'author', 'author', "Top Authors", "Author"),
+            (col3, 'genre', 'genre', "Top Genres", "Genre")
+        ]
+
+        for column, dimension, key_column, heading, label in boards:
+            with column:
+                st.markdown(f"**{heading}**")
+                board = leaderboards.get_leaderboard(dimension, leaderboard_period, limit=10)
+
+                if board.empty:
+                    st.info("No sales in this period.")
+                else:
+                    st.dataframe(
+                        board[[key_column, 'sales']],
+                        use_container_width=True,
+                        hide_index=True,
+                        column_config={key_column: label, "sales": "Copies Sold"}
+                    )
+
+    leaderboards_section()
+
+    # Sales filtering and display
+    @st.fragment
+    def sales_data_section():
+        st.subheader("Sales Data")
+
+        # Filters
+        col1, col2, col3 = st.columns(3)
 
-    # Custom date range
-    if date_filter == "Custom Range":
-        col1, col2 = st.columns(2)
         with col1:
-            start_date = st.date_input("Start Date", value=datetime.now() - timedelta(days=30))
+            # Get clients for filtering
+            clients = data_manager.get_clients()
+            client_options = ['All Clients'] + clients['username'].tolist() if not clients.empty else ['All Clients']
+            client_filter = st.selectbox("Filter by Client", client_options)
+
         with col2:
-            end_date = st.date_input("End Date", value=datetime.now())
-
-    # Get and filter sales data
-    sales_df = data_manager.get_user_sales('admin')
-
-    if not sales_df.empty:
-        # Apply client filter
-        if client_filter != 'All Clients':
-            sales_df = sales_df[sales_df['owner'] == client_filter]
-
-        # Apply book filter
-        if book_filter != 'All Books':
-            sales_df = sales_df[sales_df['title'] == book_filter]
-
-        # Apply date filter
-        if date_filter != "All Time" and date_filter != "Custom Range":
-            sales_df = data_manager.filter_sales_by_time_period('admin', date_filter)
-        elif date_filter == "Custom Range":
-            sales_df['date'] = pd.to_datetime(sales_df['date'])
-            sales_df = sales_df[
-                (sales_df['date'] >= pd.Timestamp(start_date)) & 
-                (sales_df['date'] <= pd.Timestamp(end_date))
-            ]
-
-        # Display filtered sales data
+            # Book filter
+            book_filter = widgets.book_search_picker(
+                "Filter by Book",
+                key="filter_book",
+                placeholder="All Books"
+            )
+
+        with col3:
+            # Date range filter
+            date_filter = st.selectbox(
+                "Filter by Date",
+                ["All Time", "Last 7 Days", "Last 30 Days", "Last 90 Days", "Last Year", "Custom Range"]
+            )
+
+        # Custom date range
+        if date_filter == "Custom Range":
+            col1, col2 = st.columns(2)
+            with col1:
+                start_date = st.date_input("Start Date", value=datetime.now() - timedelta(days=30))
+            with col2:
+                end_date = st.date_input("End Date", value=datetime.now())
+
+        # Get and filter sales data
+        sales_df = session_memory.remember('user_sales', data_manager.get_user_sales, 'admin', shared=True)
+
         if not sales_df.empty:
-            # Select columns to display
-            display_columns = ['date', 'title', 'quantity', 'price', 'revenue', 'owner']
-            column_config = {
-                "date": "Date",
-                "title": "Book Title",
-                "quantity": "Quantity",
-                "price": st.column_config.NumberColumn("Price", format="₹%.2f"),
-                "revenue": st.column_config.NumberColumn("Revenue", format="₹%.2f"),
-                "owner": "Client"
-            }
+            # Apply client filter
+            if client_filter != 'All Clients':
+                sales_df = sales_df[sales_df['owner'] == client_filter]
+
+            # Apply book filter
+            if book_filter is not None:
+                sales_df = sales_df[sales_df['book_id'] == book_filter]
+
+            # Apply date filter
+            if date_filter != "All Time" and date_filter != "Custom Range":
+                sales_df = session_memory.remember('filtered_sales', data_manager.filter_sales_by_time_period, 'admin', date_filter, shared=True)
+            elif date_filter == "Custom Range":
+                sales_df['date'] = pd.to_datetime(sales_df['date'])
+                sales_df = sales_df[
+                    (sales_df['date'] >= pd.Timestamp(start_date)) & 
+                    (sales_df['date'] <= pd.Timestamp(end_date))
+                ]
+
+            # Display filtered sales data
+            if not sales_df.empty:
+                # Select columns to display
+                display_columns = ['date', 'title', 'quantity', 'price', 'revenue', 'owner']
+                column_config = {
+                    "date": "Date",
+                    "title": "Book Title",
+                    "quantity": "Quantity",
+                    "price": st.column_config.NumberColumn("Price", format="₹%.2f"),
+                    "revenue": st.column_config.NumberColumn("Revenue", format="₹%.2f"),
+                    "owner": "Client"
+                }
+
+                # Add royalty column if it exists
+                if 'royalty' in sales_df.columns:
+                    display_columns.append('royalty')
+                    column_config["royalty"] = st.column_config.NumberColumn("Royalty", format="₹%.2f")
+
+                st.dataframe(
+                    sales_df[display_columns],
+                    use_container_width=True,
+                    column_config=column_config
+                )
 
-            # Add royalty column if it exists
-            if 'royalty' in sales_df.columns:
-                display_columns.append('royalty')
-                column_config["royalty"] = st.column_config.NumberColumn("Royalty", format="₹%.2f")
+                # Display summary statistics
+                total_sales = sales_df['quantity'].sum()
+                total_revenue = sales_df['revenue'].sum()
+
+                st.info(f"Total Books Sold: {total_sales} | Total Revenue: ₹{total_revenue:.2f}")
+
+                # Export option
+                if st.button("Export to CSV"):
+                    st.download_button(
+                        label="Download Sales Data",
+                        data=sales_df.to_csv(index=False).encode('utf-8'),
+                        file_name=f"sales_data_{datetime.now().strftime('%Y%m%d')}.csv",
+                        mime="text/csv"
+                    )
+            else:
+                st.info("No sales data available for the selected filters.")
+
+    sales_data_section()
+
+    @st.fragment
+    def anomalies_section():
+        st.subheader("Sales Anomalies")
+        st.caption("Spikes, drops and repeated sales flagged as sales are recorded, against each book's and client's recent daily sales.")
+
+        flagged = anomalies.get_anomalies()
+
+        if flagged.empty:
+            st.success("No anomalies flagged.")
+        else:
+            kind_labels = {'spike': "Spike", 'drop': "Drop", 'duplicate': "Possible duplicate"}
+            kind_filter = st.multiselect(
+                "Show",
+                list(kind_labels),
+                default=list(kind_labels),
+                format_func=kind_labels.get,
+                key="anomaly_kinds"
+            )
+            flagged = flagged[flagged['kind'].isin(kind_filter)]
 
             st.dataframe(
-                sales_df[display_columns],
+                flagged,
                 use_container_width=True,
-                column_config=column_config
+                column_config={
+                    "detected_at": "Detected",
+                    "date": "Sales Date",
+                    "scope": "Scope",
+                    "key": "Book ID / Client",
+                    "kind": "Type",
+                    "value": "Copies",
+                    "expected": st.column_config.NumberColumn("Expected", format="%.1f"),
+                    "message": "Details"
+                }
             )
 
-            # Display summary statistics
-            total_sales = sales_df['quantity'].sum()
-            total_revenue = sales_df['revenue'].sum()
+            if not flagged.empty:
+                # Dismiss an anomaly once it has been reviewed
+                anomaly_index = st.selectbox(
+                    "Select anomaly to dismiss",
+                    flagged.index.tolist(),
+                    format_func=lambda index: f"{flagged.loc[index, 'date']} - {flagged.loc[index, 'scope']} {flagged.loc[index, 'key']} - {kind_labels.get(flagged.loc[index, 'kind'], flagged.loc[index, 'kind'])}"
+                )
+
+                if st.button("Dismiss Anomaly"):
+                    if anomalies.dismiss_anomaly(anomaly_index):
+                        widgets.flash("Anomaly dismissed.")
+                        st.rerun()
+                    else:
+                        st.error("Failed to dismiss anomaly. Please try again.")
 
-            st.info(f"Total Books Sold: {total_sales} | Total Revenue: ₹{total_revenue:.2f}")
+    anomalies_section()
 
-            # Export option
-            if st.button("Export to CSV"):
-                st.download_button(
-                    label="Download Sales Data",
-                    data=sales_df.to_csv(index=False).encode('utf-8'),
-                    file_name=f"sales_data_{datetime.now().strftime('%Y%m%d')}.csv",
-                    mime="text/csv"
-                )
+    @st.fragment
+    def sales_statistics_section():
+        st.subheader("Sales Statistics")
+
+        col1, col2 = st.columns([2, 1])
+
+        with col1:
+            statistics_period = st.selectbox(
+                "Range",
+                ["Last 90 Days", "Last Year", "All Time"],
+                index=2,
+                key="statistics_period"
+            )
+
+        with col2:
+            approximate = st.toggle(
+                "Approximate mode",
+                value=True,
+                key="statistics_approximate",
+                help="Answer from monthly sketches in constant time instead of scanning every sale. Ranges are rounded out to whole months."
+            )
+
+        start_date = None
+        if statistics_period != "All Time":
+            start_date = datetime.now() - timedelta(days=90 if statistics_period == "Last 90 Days" else 365)
+
+        if approximate:
+            statistics = sketches.approximate_statistics(start_date=start_date)
+            distinct_note = f"± {statistics['distinct_error']:.1%}"
+            quantile_note = f"± {statistics['rank_error']:.1%} rank"
+        else:
+            statistics = sketches.exact_statistics(start_date=start_date)
+            distinct_note = quantile_note = "exact"
+
+        if not statistics['sales']:
+            st.info("No sales data available for the selected range.")
         else:
-            st.info("No sales data available for the selected filters.")
+            col1, col2, col3 = st.columns(3)
+
+            with col1:
+                st.metric("Distinct Books Sold", f"{statistics['distinct_books']:,.0f}", distinct_note, delta_color="off")
+
+            with col2:
+                st.metric("Median Copies per Sale", f"{statistics['median_quantity']:,.0f}", quantile_note, delta_color="off")
+                st.metric("95th Percentile Copies per Sale", f"{statistics['p95_quantity']:,.0f}", quantile_note, delta_color="off")
+
+            with col3:
+                st.metric("Median Sale Value", f"₹{statistics['median_revenue']:,.2f}", quantile_note, delta_color="off")
+                st.metric("95th Percentile Sale Value", f"₹{statistics['p95_revenue']:,.2f}", quantile_note, delta_color="off")
+
+            monthly_books = statistics['monthly_books']
+            if not monthly_books.empty:
+                st.bar_chart(monthly_books.set_index('month')['books'], y_label="Active Books", x_label="Month")
+
+    sales_statistics_section()
 
 with tab3:
     st.header("User Management")
@@ -414,172 +683,586 @@ with tab3:
             )
 
     with user_tabs[1]:
-        st.subheader("Add New User")
-
-        # Form for adding a new user
-        with st.form("add_user_form"):
-            new_username = st.text_input("Username")
-            new_password = st.text_input("Password", type="password")
-            confirm_password = st.text_input("Confirm Password", type="password")
-            new_name = st.text_input("Full Name")
-            new_email = st.text_input("Email")
-            new_role = st.selectbox("Role", ["client", "admin"])
-
-            submit_button = st.form_submit_button("Add User")
-
-            if submit_button:
-                if not new_username or not new_password or not new_name:
-                    st.error("Please fill out all required fields.")
-                elif new_password != confirm_password:
-                    st.error("Passwords do not match.")
-                else:
-                    # Call the add_user function from auth.py
-                    import auth
-                    success, message = auth.add_user(
-                        username=new_username,
-                        password=new_password,
-                        name=new_name,
-                        role=new_role,
-                        email=new_email
-                    )
-
-                    if success:
-                        st.success(message)
+        @st.fragment
+        def add_user_section():
+            st.subheader("Add New User")
+
+            # Form for adding a new user
+            with st.form("add_user_form"):
+                new_username = st.text_input("Username")
+                new_password = st.text_input("Password", type="password")
+                confirm_password = st.text_input("Confirm Password", type="password")
+                new_name = st.text_input("Full Name")
+                new_email = st.text_input("Email")
+                new_role = st.selectbox("Role", ["client", "admin"])
+
+                submit_button = st.form_submit_button("Add User")
+
+                if submit_button:
+                    if not new_username or not new_password or not new_name:
+                        st.error("Please fill out all required fields.")
+                    elif new_password != confirm_password:
+                        st.error("Passwords do not match.")
                     else:
-                        st.error(message)
-
-    with user_tabs[2]:
-        st.subheader("Edit User")
+                        # Call the add_user function from auth.py
+                        import auth
+                        success, message = auth.add_user(
+                            username=new_username,
+                            password=new_password,
+                            name=new_name,
+                            role=new_role,
+                            email=new_email
+                        )
 
-        # Get all users for selection
-        users_df = data_manager.get_users()
+                        if success:
+                            widgets.flash(message)
+                            st.rerun()
+                        else:
+                            st.error(message)
 
-        if users_df.empty:
-            st.info("No users available to edit.")
-        else:
-            # Select a user to edit
-            usernames = users_df['username'].tolist()
-            selected_username = st.selectbox("Select User to Edit", usernames)
+        add_user_section()
 
-            # Get selected user's current details
-            selected_user = users_df[users_df['username'] == selected_username].iloc[0]
+    with user_tabs[2]:
+        @st.fragment
+        def edit_user_section():
+            st.subheader("Edit User")
 
-            # Edit user form
-            with st.form("edit_user_form"):
-                edit_name = st.text_input("Full Name", value=selected_user['name'])
+            # Get all users for selection
+            users_df = data_manager.get_users()
 
-                # Email field (may not exist in older records)
-                edit_email = ""
-                if 'email' in selected_user:
-                    edit_email = st.text_input("Email", value=selected_user['email'])
-                else:
-                    edit_email = st.text_input("Email")
-
-                edit_role = st.selectbox("Role", ["client", "admin"], index=0 if selected_user['role'] == "client" else 1)
-
-                col1, col2 = st.columns(2)
-                with col1:
-                    update_button = st.form_submit_button("Update User")
-                with col2:
-                    delete_button = st.form_submit_button("Delete User")
-
-                if update_button:
-                    import auth
-                    success, message = auth.update_user(
-                        username=selected_username,
-                        name=edit_name,
-                        email=edit_email,
-                        role=edit_role
-                    )
+            if users_df.empty:
+                st.info("No users available to edit.")
+            else:
+                # Select a user to edit
+                usernames = users_df['username'].tolist()
+                selected_username = st.selectbox("Select User to Edit", usernames)
 
-                    if success:
-                        st.success(message)
-                    else:
-                        st.error(message)
+                # Get selected user's current details
+                selected_user = users_df[users_df['username'] == selected_username].iloc[0]
 
-                if delete_button:
-                    import auth
-                    success, message = auth.delete_user(selected_username)
+                # Edit user form
+                with st.form("edit_user_form"):
+                    edit_name = st.text_input("Full Name", value=selected_user['name'])
 
-                    if success:
-                        st.success(message)
-                        st.rerun()
+                    # Email field (may not exist in older records)
+                    edit_email = ""
+                    if 'email' in selected_user:
+                        edit_email = st.text_input("Email", value=selected_user['email'])
                     else:
-                        st.error(message)
-
-            # Change password section
-            st.subheader("Change Password")
+                        edit_email = st.text_input("Email")
 
-            with st.form("change_password_form"):
-                new_password = st.text_input("New Password", type="password")
-                confirm_password = st.text_input("Confirm New Password", type="password")
+                    edit_role = st.selectbox("Role", ["client", "admin"], index=0 if selected_user['role'] == "client" else 1)
 
-                password_button = st.form_submit_button("Change Password")
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        update_button = st.form_submit_button("Update User")
+                    with col2:
+                        delete_button = st.form_submit_button("Delete User")
 
-                if password_button:
-                    if not new_password:
-                        st.error("Please enter a new password.")
-                    elif new_password != confirm_password:
-                        st.error("Passwords do not match.")
-                    else:
+                    if update_button:
                         import auth
-                        success, message = auth.change_password(
+                        success, message = auth.update_user(
                             username=selected_username,
-                            new_password=new_password
+                            name=edit_name,
+                            email=edit_email,
+                            role=edit_role
                         )
 
                         if success:
-                            st.success(message)
+                            widgets.flash(message)
+                            st.rerun()
                         else:
                             st.error(message)
 
+                    if delete_button:
+                        import auth
+                        success, message = auth.delete_user(selected_username)
+
+                        if success:
+                            widgets.flash(message)
+                            st.rerun()
+                        else:
+                            st.error(message)
+
+                # Change password section
+                st.subheader("Change Password")
+
+                with st.form("change_password_form"):
+                    new_password = st.text_input("New Password", type="password")
+                    confirm_password = st.text_input("Confirm New Password", type="password")
+
+                    password_button = st.form_submit_button("Change Password")
+
+                    if password_button:
+                        if not new_password:
+                            st.error("Please enter a new password.")
+                        elif new_password != confirm_password:
+                            st.error("Passwords do not match.")
+                        else:
+                            import auth
+                            success, message = auth.change_password(
+                                username=selected_username,
+                                new_password=new_password
+                            )
+
+                            if success:
+                                st.success(message)
+                            else:
+                                st.error(message)
+
+        edit_user_section()
+
     with user_tabs[3]:
-        st.subheader("User Books")
+        @st.fragment
+        def user_books_section():
+            st.subheader("User Books")
 
-        # Get users with client role
-        users_df = data_manager.get_users()
-        client_options = users_df[users_df['role'] == 'client']['username'].tolist()
+            # Get users with client role
+            users_df = data_manager.get_users()
+            client_options = users_df[users_df['role'] == 'client']['username'].tolist()
 
-        if not client_options:
-            st.info("No client users available.")
-        else:
-            # Select a user to view their books
-            selected_client = st.selectbox("Select Client", client_options)
+            if not client_options:
+                st.info("No client users available.")
+            else:
+                # Select a user to view their books
+                selected_client = st.selectbox("Select Client", client_options)
 
-            if selected_client:
-                client_books = data_manager.get_user_books(selected_client)
+                if selected_client:
+                    client_books = data_manager.get_user_books(selected_client)
 
-                if client_books.empty:
-                    st.info(f"No books assigned to {selected_client}.")
-                else:
-                    # Prepare column configuration
-                    column_config = {
-                        "id": "ID",
-                        "title": "Title",
-                        "author": "Author",
-                        "genre": "Genre",
-                        "price": st.column_config.NumberColumn("Price", format="₹%.2f"),
-                        "publication_date": "Publication Date"
+                    if client_books.empty:
+                        st.info(f"No books assigned to {selected_client}.")
+                    else:
+                        # Prepare column configuration
+                        column_config = {
+                            "id": "ID",
+                            "title": "Title",
+                            "author": "Author",
+                            "genre": "Genre",
+                            "price": st.column_config.NumberColumn("Price", format="₹%.2f"),
+                            "publication_date": "Publication Date"
+                        }
+
+                        # Add ISBN and royalty columns if they exist
+                        if 'isbn' in client_books.columns:
+                            column_config["isbn"] = "ISBN"
+
+                        if 'royalty_percentage' in client_books.columns:
+                            column_config["royalty_percentage"] = st.column_config.NumberColumn("Royalty %", format="%.1f%%")
+
+                        st.dataframe(
+                            client_books,
+                            use_container_width=True,
+                            column_config=column_config
+                        )
+
+                        # User sales summary
+                        user_sales = data_manager.get_user_sales(selected_client)
+
+                        if not user_sales.empty:
+                            total_books_sold = user_sales['quantity'].sum()
+                            total_revenue = user_sales['revenue'].sum()
+
+                            st.info(f"Total Books Sold: {total_books_sold} | Total Revenue: ₹{total_revenue:.2f}")
+
+        user_books_section()
+
+with tab4:
+    st.header("Royalty Payments")
+
+    # Client balances are maintained as sales and payments are recorded
+    balances = data_manager.get_balances()
+
+    if balances.empty:
+        st.info("No clients available in the system.")
+    else:
+        st.subheader("Client Balances")
+        st.dataframe(
+            balances,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "username": "Username",
+                "name": "Client",
+                "earned": st.column_config.NumberColumn("Royalties Earned", format="₹%.2f"),
+                "paid": st.column_config.NumberColumn("Paid", format="₹%.2f"),
+                "outstanding": st.column_config.NumberColumn("Outstanding", format="₹%.2f")
+            }
+        )
+
+    col1, col2 = st.columns([1, 1])
+
+    with col1:
+        @st.fragment
+        def record_payment_section():
+            st.subheader("Record Payment")
+
+            clients = data_manager.get_clients()
+
+            if clients.empty:
+                st.info("No clients available. Please add clients first.")
+            else:
+                with st.form("record_payment_form"):
+                    payment_client = st.selectbox("Client", clients['username'].tolist())
+                    payment_date = st.date_input("Payment Date", value=datetime.now())
+                    payment_amount = st.number_input("Amount (₹)", min_value=0.0, value=0.0, step=100.0)
+                    payment_reference = st.text_input("Reference", placeholder="e.g., bank transfer or cheque number")
+
+                    submit_button = st.form_submit_button("Record Payment")
+
+                    if submit_button:
+                        success, message = data_manager.add_payment(
+                            payment_client,
+                            payment_amount,
+                            date=payment_date.strftime('%Y-%m-%d'),
+                            reference=payment_reference
+                        )
+
+                        if success:
+                            widgets.flash(message)
+                            st.rerun()
+                        else:
+                            st.error(message)
+
+        record_payment_section()
+
+    with col2:
+        @st.fragment
+        def payment_ledger_section():
+            st.subheader("Payment Ledger")
+
+            payments = data_manager.get_payments()
+
+            if payments.empty:
+                st.info("No payments have been recorded yet.")
+            else:
+                st.dataframe(
+                    payments.sort_values('date', ascending=False),
+                    use_container_width=True,
+                    column_config={
+                        "date": "Date",
+                        "username": "Client",
+                        "amount": st.column_config.NumberColumn("Amount", format="₹%.2f"),
+                        "reference": "Reference"
                     }
+                )
 
-                    # Add ISBN and royalty columns if they exist
-                    if 'isbn' in client_books.columns:
-                        column_config["isbn"] = "ISBN"
+                # Remove a payment recorded in error
+                payment_index = st.selectbox(
+                    "Select payment to delete",
+                    payments.index.tolist(),
+                    format_func=lambda index: f"{payments.loc[index, 'date']} - {payments.loc[index, 'username']} - ₹{payments.loc[index, 'amount']:,.2f}"
+                )
 
-                    if 'royalty_percentage' in client_books.columns:
-                        column_config["royalty_percentage"] = st.column_config.NumberColumn("Royalty %", format="%.1f%%")
+                if st.button("Delete Payment"):
+                    if data_manager.delete_payment(payment_index):
+                        widgets.flash("Payment deleted successfully.")
+                        st.rerun()
+                    else:
+                        st.error("Failed to delete payment. Please try again.")
 
-                    st.dataframe(
-                        client_books,
-                        use_container_width=True,
-                        column_config=column_config
-                    )
+        payment_ledger_section()
+
+    @st.fragment
+    def projected_royalties_section():
+        st.subheader("Projected Royalties")
+
+        horizon = st.selectbox(
+            "Projection Horizon",
+            [30, 90, 180, 365],
+            index=1,
+            format_func=lambda days: f"Next {days} Days",
+            key="projection_horizon"
+        )
 
-                    # User sales summary
-                    user_sales = data_manager.get_user_sales(selected_client)
+        projected = forecasting.get_projected_royalties(horizon)
+
+        if projected.empty:
+            st.info("Not enough sales history to project royalties.")
+        else:
+            by_client = projected.groupby('owner')[['projected_copies', 'projected_revenue', 'projected_royalty']].sum()
+
+            col1, col2 = st.columns([1, 2])
+            with col1:
+                st.metric("Projected Royalties (All Clients)", f"₹{projected['projected_royalty'].sum():,.2f}")
+                st.dataframe(
+                    by_client.sort_values('projected_royalty', ascending=False),
+                    use_container_width=True,
+                    column_config={
+                        "owner": "Client",
+                        "projected_copies": "Copies",
+                        "projected_revenue": st.column_config.NumberColumn("Revenue", format="₹%.2f"),
+                        "projected_royalty": st.column_config.NumberColumn("Royalties", format="₹%.2f")
+                    }
+                )
+            with col2:
+                st.dataframe(
+                    projected,
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={
+                        "book_id": "ID",
+                        "title": "Book Title",
+                        "owner": "Client",
+                        "projected_copies": "Copies",
+                        "lower_copies": "Copies (Low)",
+                        "upper_copies": "Copies (High)",
+                        "projected_revenue": st.column_config.NumberColumn("Revenue", format="₹%.2f"),
+                        "projected_royalty": st.column_config.NumberColumn("Royalties", format="₹%.2f")
+                    }
+                )
+
+    projected_royalties_section()
+
+with tab5:
+    st.header("Pivot Explorer")
+    st.caption("Slice sales by time, genre, client, author and book. Results come from the pre-aggregated sales cube.")
+
+    dimension_labels = {
+        'year': "Year",
+        'quarter': "Quarter",
+        'month': "Month",
+        'day': "Day",
+        'weekday': "Day of Week",
+        'genre': "Genre",
+        'owner': "Client",
+        'author': "Author",
+        'book': "Book"
+    }
+    measure_labels = {
+        'quantity': "Copies Sold",
+        'revenue': "Revenue",
+        'royalty': "Royalties",
+        'sales': "Number of Sales"
+    }
+
+    def change_pivot_level(position, dimension):
+        # Replace one row dimension with a finer or coarser level of its hierarchy
+        rows = list(st.session_state.pivot_rows)
+        rows[position] = dimension
+        st.session_state.pivot_rows = list(dict.fromkeys(rows))
+
+    @st.fragment
+    def pivot_explorer_section():
+        col1, col2, col3 = st.columns(3)
+
+        with col1:
+            rows = st.multiselect(
+                "Rows",
+                data_manager.CUBE_DIMENSIONS,
+                default=['genre'],
+                format_func=dimension_labels.get,
+                key="pivot_rows"
+            )
+
+        with col2:
+            columns = st.selectbox(
+                "Columns",
+                [None] + [dimension for dimension in data_manager.CUBE_DIMENSIONS if dimension not in rows],
+                format_func=lambda dimension: "None" if dimension is None else dimension_labels[dimension],
+                key="pivot_columns"
+            )
+
+        with col3:
+            measure = st.selectbox("Measure", data_manager.CUBE_MEASURES, format_func=measure_labels.get, key="pivot_measure")
+
+        col1, col2, col3 = st.columns(3)
+
+        with col1:
+            date_range = st.date_input("Date Range", value=(), key="pivot_dates", help="Leave empty to include all sales.")
+
+        with col2:
+            clients = data_manager.get_clients()
+            client_filter = st.multiselect("Clients", clients['username'].tolist() if not clients.empty else [], key="pivot_clients")
+
+        with col3:
+            books_df = data_manager.get_books()
+            genre_filter = st.multiselect("Genres", sorted(books_df['genre'].unique()) if not books_df.empty else [], key="pivot_genres")
+
+        # Drill down or roll up any row dimension along its hierarchy
+        if rows:
+            level_columns = st.columns(len(rows))
+            for position, dimension in enumerate(rows):
+                with level_columns[position]:
+                    finer = data_manager.drill_down(dimension)
+                    coarser = data_manager.roll_up(dimension)
+                    if finer is not None and finer not in rows:
+                        st.button(
+                            f"Drill down {dimension_labels[dimension]} → {dimension_labels[finer]}",
+                            key=f"pivot_drill_{dimension}",
+                            on_click=change_pivot_level,
+                            args=(position, finer)
+                        )
+                    if coarser is not None and coarser not in rows:
+                        st.button(
+                            f"Roll up {dimension_labels[dimension]} → {dimension_labels[coarser]}",
+                            key=f"pivot_roll_{dimension}",
+                            on_click=change_pivot_level,
+                            args=(position, coarser)
+                        )
+
+        filters = {}
+        if client_filter:
+            filters['owner'] = client_filter
+        if genre_filter:
+            filters['genre'] = genre_filter
+
+        start_date = date_range[0] if len(date_range) > 0 else None
+        end_date = date_range[1] if len(date_range) > 1 else start_date
+
+        dimensions = rows + ([columns] if columns is not None else [])
+        result = data_manager.query_cube(dimensions, [measure], filters=filters, start_date=start_date, end_date=end_date)
+
+        if result.empty or result[measure].sum() == 0:
+            st.info("No sales match the selected filters.")
+        elif columns is not None and rows:
+            # Keep the cube's calendar ordering of rows and columns
+            pivot = result.pivot_table(index=rows, columns=columns, values=measure, aggfunc='sum', fill_value=0, sort=False)
+            st.dataframe(pivot, use_container_width=True)
+        else:
+            st.dataframe(
+                result.rename(columns={**dimension_labels, **measure_labels}),
+                use_container_width=True,
+                hide_index=True
+            )
+
+            if len(dimensions) == 1:
+                st.bar_chart(result.set_index(dimensions[0])[measure], horizontal=dimensions[0] not in ('year', 'quarter', 'month', 'day'))
+
+        if not result.empty:
+            st.download_button(
+                label="Download Result",
+                data=result.to_csv(index=False).encode('utf-8'),
+                file_name=f"pivot_{datetime.now().strftime('%Y%m%d')}.csv",
+                mime="text/csv",
+                key="pivot_download"
+            )
+
+    pivot_explorer_section()
+
+with tab6:
+    st.header("Publication Lifecycle")
+    st.caption("How books sell over time since publication, averaged across cohorts of the whole catalog.")
+
+    @st.fragment
+    def lifecycle_section():
+        col1, col2, col3, col4 = st.columns(4)
+
+        with col1:
+            cohort_by = st.selectbox("Cohort", list(cohorts.COHORT_COLUMNS), format_func=cohorts.COHORT_COLUMNS.get, key="lifecycle_cohort")
+
+        with col2:
+            unit = st.selectbox("Time Unit", list(cohorts.UNIT_DAYS), index=1, format_func=lambda unit: f"{unit.title()}s Since Publication", key="lifecycle_unit")
+
+        with col3:
+            max_age = st.number_input("Horizon", min_value=1, max_value=520, value=52, step=1, key="lifecycle_horizon")
+
+        with col4:
+            measure = st.selectbox("Measure", ['quantity', 'revenue'], format_func=lambda measure: "Copies Sold" if measure == 'quantity' else "Revenue", key="lifecycle_measure")
+
+        curves = cohorts.cohort_curves(by=cohort_by, unit=unit, max_age=int(max_age), measure=measure)
+
+        if curves.empty:
+            st.info("No books with publication dates available.")
+        else:
+            measure_label = "Copies Sold" if measure == 'quantity' else "Revenue"
+            col1, col2 = st.columns(2)
+
+            with col1:
+                fig = px.line(
+                    curves, x='age', y='average', color='cohort',
+                    title=f'Average {measure_label} per Book',
+                    labels={'age': f'{unit.title()}s Since Publication', 'average': measure_label, 'cohort': cohorts.COHORT_COLUMNS[cohort_by]}
+                )
+                fig.update_layout(height=400)
+                st.plotly_chart(fig, use_container_width=True)
+
+            with col2:
+                fig = px.line(
+                    curves, x='age', y='cumulative', color='cohort',
+                    title=f'Cumulative {measure_label} per Book',
+                    labels={'age': f'{unit.title()}s Since Publication', 'cumulative': measure_label, 'cohort': cohorts.COHORT_COLUMNS[cohort_by]}
+                )
+                fig.update_layout(height=400)
+                st.plotly_chart(fig, use_container_width=True)
+
+        st.subheader("Time to Copies Sold")
+        thresholds = st.multiselect("Milestones (copies)", [100, 250, 500, 1000, 2500, 5000, 10000], default=[100, 500, 1000], key="lifecycle_milestones")
+
+        if thresholds:
+            thresholds = sorted(thresholds)
+            milestones = cohorts.cohort_milestones(by=cohort_by, thresholds=tuple(thresholds))
+
+            if milestones.empty:
+                st.info("No books with publication dates available.")
+            else:
+                column_config = {"cohort": cohorts.COHORT_COLUMNS[cohort_by], "books": "Books"}
+                for threshold in thresholds:
+                    column_config[f'reached_{threshold}'] = st.column_config.NumberColumn(f"Reached {threshold:,}", format="percent")
+                    column_config[f'median_days_to_{threshold}'] = st.column_config.NumberColumn(f"Median Days to {threshold:,}", format="%.0f")
+
+                st.dataframe(milestones, use_container_width=True, hide_index=True, column_config=column_config)
+
+    lifecycle_section()
+
+with tab7:
+    st.header("Session Memory")
+    st.caption(
+        "Data each session keeps between reruns in this server process. Frames that several sessions "
+        "read are shared and counted once; each session's own items are capped at "
+        f"{session_memory.SESSION_MEMORY_LIMIT_MB:g} MB, dropping the largest first."
+    )
+
+    @st.fragment
+    def session_memory_section():
+        st.button("Refresh", key="memory_refresh")
+
+        sessions = session_memory.get_session_usage()
+        shared = session_memory.get_shared_usage()
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Live Sessions", len(sessions))
+        with col2:
+            st.metric("Session Memory", f"{sessions['private'].sum() / 1024 ** 2:,.1f} MB")
+        with col3:
+            st.metric("Shared Frames", f"{shared['size'].sum() / 1024 ** 2:,.1f} MB", help=f"Limit: {session_memory.SHARED_MEMORY_LIMIT_MB:g} MB")
+
+        st.subheader("Sessions")
+        st.dataframe(
+            sessions.assign(private=sessions['private'] / 1024 ** 2, shared=sessions['shared'] / 1024 ** 2),
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "session": "Session",
+                "username": "User",
+                "started": "Started",
+                "items": "Items",
+                "private": st.column_config.NumberColumn("Own Memory", format="%.1f MB"),
+                "shared": st.column_config.NumberColumn("Shared Frames Used", format="%.1f MB")
+            }
+        )
+
+        st.subheader("Shared Frames")
+        if shared.empty:
+            st.info("No frames are shared at the moment.")
+        else:
+            st.dataframe(
+                shared.assign(size=shared['size'] / 1024 ** 2),
+                use_container_width=True,
+                hide_index=True,
+                column_config={
+                    "name": "Frame",
+                    "inputs": "Inputs",
+                    "rows": st.column_config.NumberColumn("Rows", format="%d"),
+                    "size": st.column_config.NumberColumn("Size", format="%.1f MB"),
+                    "sessions": "Sessions Using",
+                    "last_used": "Last Used"
+                }
+            )
 
-                    if not user_sales.empty:
-                        total_books_sold = user_sales['quantity'].sum()
-                        total_revenue = user_sales['revenue'].sum()
+            if st.button("Clear Shared Frames", key="memory_clear_shared"):
+                session_memory.clear_shared()
+                st.rerun(scope="fragment")
 
-                        st.info(f"Total Books Sold: {total_books_sold} | Total Revenue: ₹{total_revenue:.2f}")
\ No newline at end of file
+    session_memory_section()
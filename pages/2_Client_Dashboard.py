@@ -3,7 +3,10 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
+import charts
 import data_manager
+import session_memory
+import storage
 import utils
 import auth
 
@@ -14,6 +17,9 @@ st.set_page_config(
     layout="wide"
 )
 
+# Read one consistent version of the data for the whole render
+storage.begin_snapshot()
+
 # Display logo in sidebar
 with st.sidebar:
     st.image("attached_assets/logo.png", width=200)
@@ -42,11 +48,44 @@ if user_books.empty:
     st.warning("You don't have any books assigned to your account. Please contact your administrator.")
     st.stop()
 
+# Royalty balance across all time, independent of the filters below
+st.header("Royalty Balance")
+
+balance = data_manager.get_client_balance(username)
+col1, col2, col3 = st.columns(3)
+
+with col1:
+    st.metric("Royalties Earned", f"₹{balance['earned']:,.2f}")
+
+with col2:
+    st.metric("Payments Received", f"₹{balance['paid']:,.2f}")
+
+with col3:
+    st.metric("Outstanding", f"₹{balance['outstanding']:,.2f}")
+
+with st.expander("Payment History"):
+    payments = data_manager.get_payments(username)
+
+    if payments.empty:
+        st.info("No payments have been recorded yet.")
+    else:
+        st.dataframe(
+            payments.sort_values('date', ascending=False)[['date', 'amount', 'reference']],
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "date": "Date",
+                "amount": st.column_config.NumberColumn("Amount", format="₹%.2f"),
+                "reference": "Reference"
+            }
+        )
+
 # Dashboard layout
 st.header("Sales Performance Dashboard")
 
-# Filter controls
-col1, col2, col3 = st.columns(3)
+# Filter controls. These feed every section below, so changing them reruns the
+# whole page; widgets inside a section are scoped to that section's fragment.
+col1, col2 = st.columns(2)
 
 with col1:
     # Time period filter
@@ -61,15 +100,8 @@ with col2:
     book_titles = ["All Books"] + user_books['title'].tolist()
     selected_book = st.selectbox("Select Book", book_titles)
 
-with col3:
-    # Comparison option
-    comparison = st.selectbox(
-        "Comparison",
-        ["None", "Previous Period", "Year-over-Year"]
-    )
-
-# Get filtered sales data
-filtered_data = data_manager.filter_sales_by_time_period(username, time_period)
+# Get filtered sales data, shared with other sessions viewing the same sales
+filtered_data = session_memory.remember('filtered_sales', data_manager.filter_sales_by_time_period, username, time_period, shared=True)
 
 # Apply book filter if needed
 if selected_book != "All Books" and not filtered_data.empty:
@@ -81,180 +113,193 @@ st.subheader("Key Metrics")
 if filtered_data.empty:
     st.info("No sales data available for the selected filters.")
 else:
-    # Calculate current period metrics
-    total_sales = filtered_data['quantity'].sum()
-    total_revenue = filtered_data['revenue'].sum()
-    num_books_sold = len(filtered_data['book_id'].unique())
-    avg_sale_price = total_revenue / total_sales if total_sales > 0 else 0
-    total_royalties = filtered_data['royalty'].sum() if 'royalty' in filtered_data.columns else 0
-
-    # Calculate comparison metrics if requested
-    if comparison != "None":
-        # Determine comparison period
-        today = datetime.now()
-        current_period_days = utils.get_days_in_period(time_period)
-
-        if comparison == "Previous Period":
-            # Previous period of same length
-            prev_end_date = today - timedelta(days=current_period_days)
-            prev_start_date = prev_end_date - timedelta(days=current_period_days)
-        else:  # Year-over-Year
-            # Same period last year
-            prev_start_date = today - timedelta(days=365+current_period_days)
-            prev_end_date = today - timedelta(days=365)
-
-        # Get all sales data
-        all_sales = data_manager.get_user_sales(username)
-
-        if not all_sales.empty:
-            # Convert date column to datetime if it's not already
-            if not isinstance(all_sales['date'].iloc[0], pd.Timestamp):
-                all_sales['date'] = pd.to_datetime(all_sales['date'])
-
-            # Filter for previous period
-            prev_period_data = all_sales[
-                (all_sales['date'] >= pd.Timestamp(prev_start_date)) & 
-                (all_sales['date'] <= pd.Timestamp(prev_end_date))
-            ]
-
-            # Apply book filter if needed
-            if selected_book != "All Books":
-                prev_period_data = prev_period_data[prev_period_data['title'] == selected_book]
-
-            # Calculate previous period metrics
-            prev_total_sales = prev_period_data['quantity'].sum() if not prev_period_data.empty else 0
-            prev_total_revenue = prev_period_data['revenue'].sum() if not prev_period_data.empty else 0
-
-            # Calculate growth rates
-            sales_growth = utils.calculate_growth_rate(total_sales, prev_total_sales)
-            revenue_growth = utils.calculate_growth_rate(total_revenue, prev_total_revenue)
-        else:
-            sales_growth = 0
-            revenue_growth = 0
-
-    # Custom CSS for gradient cards
-    st.markdown("""
-        <style>
-            .metric-card {
-                background: linear-gradient(135deg, #6B73FF 0%, #000DFF 100%);
-                padding: 20px;
-                border-radius: 10px;
-                color: white;
-                margin: 10px 0;
-                box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-            }
-            .metric-label {
-                font-size: 0.9rem;
-                font-weight: 500;
-                margin-bottom: 8px;
-                opacity: 0.9;
-            }
-            .metric-value {
-                font-size: 1.5rem;
-                font-weight: 600;
-            }
-            .metric-delta {
-                font-size: 0.8rem;
-                margin-top: 8px;
-                opacity: 0.9;
-            }
-            .positive-delta {
-                color: #00ff9f;
-            }
-            .negative-delta {
-                color: #ff4d4d;
-            }
-        </style>
-    """, unsafe_allow_html=True)
-
-    # Display metrics in columns with custom styling
-    col1, col2, col3, col4, col5 = st.columns(5)
-
-    with col1:
-        delta_html = f"""
-            <div class="metric-delta {'positive-delta' if sales_growth >= 0 else 'negative-delta'}">
-                {sales_growth:.1f}% {utils.get_performance_indicator(sales_growth)}
-            </div>
-        """ if comparison != "None" else ""
-        
-        st.markdown(f"""
-            <div class="metric-card" style="background: linear-gradient(135deg, #6B73FF 0%, #000DFF 100%)">
-                <div class="metric-label">Total Books Sold</div>
-                <div class="metric-value">{total_sales:,}</div>
-                {delta_html}
-            </div>
-        """, unsafe_allow_html=True)
-
-    with col2:
-        delta_html = f"""
-            <div class="metric-delta {'positive-delta' if revenue_growth >= 0 else 'negative-delta'}">
-                {revenue_growth:.1f}% {utils.get_performance_indicator(revenue_growth)}
-            </div>
-        """ if comparison != "None" else ""
-        
-        st.markdown(f"""
-            <div class="metric-card" style="background: linear-gradient(135deg, #8E2DE2 0%, #4A00E0 100%)">
-                <div class="metric-label">Total Revenue</div>
-                <div class="metric-value">₹{total_revenue:,.2f}</div>
-                {delta_html}
-            </div>
-        """, unsafe_allow_html=True)
+    # Changing the comparison only reruns the metrics cards
+    @st.fragment
+    def key_metrics_section(username, time_period, selected_book, filtered_data):
+        # Comparison option
+        comparison = st.selectbox(
+            "Comparison",
+            ["None", "Previous Period", "Year-over-Year"]
+        )
 
-    with col3:
-        st.markdown(f"""
-            <div class="metric-card" style="background: linear-gradient(135deg, #4776E6 0%, #8E54E9 100%)">
-                <div class="metric-label">Total Royalties</div>
-                <div class="metric-value">₹{total_royalties:,.2f}</div>
-            </div>
+        # Calculate current period metrics
+        total_sales = filtered_data['quantity'].sum()
+        total_revenue = filtered_data['revenue'].sum()
+        num_books_sold = len(filtered_data['book_id'].unique())
+        avg_sale_price = total_revenue / total_sales if total_sales > 0 else 0
+        total_royalties = filtered_data['royalty'].sum() if 'royalty' in filtered_data.columns else 0
+
+        # Calculate comparison metrics if requested
+        if comparison != "None":
+            # Determine comparison period
+            today = datetime.now()
+            current_period_days = utils.get_days_in_period(time_period)
+
+            if comparison == "Previous Period":
+                # Previous period of same length
+                prev_end_date = today - timedelta(days=current_period_days)
+                prev_start_date = prev_end_date - timedelta(days=current_period_days)
+            else:  # Year-over-Year
+                # Same period last year
+                prev_start_date = today - timedelta(days=365+current_period_days)
+                prev_end_date = today - timedelta(days=365)
+
+            # Get all sales data
+            all_sales = session_memory.remember('user_sales', data_manager.get_user_sales, username, shared=True)
+
+            if not all_sales.empty:
+                # Convert date column to datetime if it's not already
+                if not isinstance(all_sales['date'].iloc[0], pd.Timestamp):
+                    all_sales['date'] = pd.to_datetime(all_sales['date'])
+
+                # Filter for previous period
+                prev_period_data = all_sales[
+                    (all_sales['date'] >= pd.Timestamp(prev_start_date)) & 
+                    (all_sales['date'] <= pd.Timestamp(prev_end_date))
+                ]
+
+                # Apply book filter if needed
+                if selected_book != "All Books":
+                    prev_period_data = prev_period_data[prev_period_data['title'] == selected_book]
+
+                # Calculate previous period metrics
+                prev_total_sales = prev_period_data['quantity'].sum() if not prev_period_data.empty else 0
+                prev_total_revenue = prev_period_data['revenue'].sum() if not prev_period_data.empty else 0
+
+                # Calculate growth rates
+                sales_growth = utils.calculate_growth_rate(total_sales, prev_total_sales)
+                revenue_growth = utils.calculate_growth_rate(total_revenue, prev_total_revenue)
+            else:
+                sales_growth = 0
+                revenue_growth = 0
+
+        # Custom CSS for gradient cards
+        st.markdown("""
+            <style>
+                .metric-card {
+                    background: linear-gradient(135deg, #6B73FF 0%, #000DFF 100%);
+                    padding: 20px;
+                    border-radius: 10px;
+                    color: white;
+                    margin: 10px 0;
+                    box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
+                }
+                .metric-label {
+                    font-size: 0.9rem;
+                    font-weight: 500;
+                    margin-bottom: 8px;
+                    opacity: 0.9;
+                }
+                .metric-value {
+                    font-size: 1.5rem;
+                    font-weight: 600;
+                }
+                .metric-delta {
+                    font-size: 0.8rem;
+                    margin-top: 8px;
+                    opacity: 0.9;
+                }
+                .positive-delta {
+                    color: #00ff9f;
+                }
+                .negative-delta {
+                    color: #ff4d4d;
+                }
+            </style>
         """, unsafe_allow_html=True)
 
-    with col4:
-        st.markdown(f"""
-            <div class="metric-card" style="background: linear-gradient(135deg, #0052D4 0%, #4364F7 100%)">
-                <div class="metric-label">Unique Books Sold</div>
-                <div class="metric-value">{num_books_sold}</div>
-            </div>
-        """, unsafe_allow_html=True)
+        # Display metrics in columns with custom styling
+        col1, col2, col3, col4, col5 = st.columns(5)
 
-    with col5:
-        st.markdown(f"""
-            <div class="metric-card" style="background: linear-gradient(135deg, #396afc 0%, #2948ff 100%)">
-                <div class="metric-label">Average Sale Price</div>
-                <div class="metric-value">₹{avg_sale_price:.2f}</div>
-            </div>
-        """, unsafe_allow_html=True)
+        with col1:
+            delta_html = f"""
+                <div class="metric-delta {'positive-delta' if sales_growth >= 0 else 'negative-delta'}">
+                    {sales_growth:.1f}% {utils.get_performance_indicator(sales_growth)}
+                </div>
+            """ if comparison != "None" else ""
+        
+            st.markdown(f"""
+                <div class="metric-card" style="background: linear-gradient(135deg, #6B73FF 0%, #000DFF 100%)">
+                    <div class="metric-label">Total Books Sold</div>
+                    <div class="metric-value">{total_sales:,}</div>
+                    {delta_html}
+                </div>
+            """, unsafe_allow_html=True)
+
+        with col2:
+            delta_html = f"""
+                <div class="metric-delta {'positive-delta' if revenue_growth >= 0 else 'negative-delta'}">
+                    {revenue_growth:.1f}% {utils.get_performance_indicator(revenue_growth)}
+                </div>
+            """ if comparison != "None" else ""
+        
+            st.markdown(f"""
+                <div class="metric-card" style="background: linear-gradient(135deg, #8E2DE2 0%, #4A00E0 100%)">
+                    <div class="metric-label">Total Revenue</div>
+                    <div class="metric-value">₹{total_revenue:,.2f}</div>
+                    {delta_html}
+                </div>
+            """, unsafe_allow_html=True)
+
+        with col3:
+            st.markdown(f"""
+                <div class="metric-card" style="background: linear-gradient(135deg, #4776E6 0%, #8E54E9 100%)">
+                    <div class="metric-label">Total Royalties</div>
+                    <div class="metric-value">₹{total_royalties:,.2f}</div>
+                </div>
+            """, unsafe_allow_html=True)
+
+        with col4:
+            st.markdown(f"""
+                <div class="metric-card" style="background: linear-gradient(135deg, #0052D4 0%, #4364F7 100%)">
+                    <div class="metric-label">Unique Books Sold</div>
+                    <div class="metric-value">{num_books_sold}</div>
+                </div>
+            """, unsafe_allow_html=True)
+
+        with col5:
+            st.markdown(f"""
+                <div class="metric-card" style="background: linear-gradient(135deg, #396afc 0%, #2948ff 100%)">
+                    <div class="metric-label">Average Sale Price</div>
+                    <div class="metric-value">₹{avg_sale_price:.2f}</div>
+                </div>
+            """, unsafe_allow_html=True)
+
+    key_metrics_section(username, time_period, selected_book, filtered_data)
 
     # Sales trend chart
     st.subheader("Sales Trend")
 
-    sales_trend = data_manager.get_sales_trend(username, time_period)
+    def build_trend_figure():
+        if selected_book == "All Books":
+            sales_trend = data_manager.get_sales_trend(username, time_period)
+            trend_title = 'Book Sales'
+        else:
+            selected_book_id = user_books[user_books['title'] == selected_book]['id'].iloc[0]
+            sales_trend = data_manager.get_book_sales_trend(username, time_period, selected_book_id)
+            trend_title = f'Sales: {selected_book}'
+
+        if sales_trend.empty:
+            return None
+
+        granularity_label = utils.GRANULARITY_LABELS[sales_trend.attrs['granularity']]
 
-    if not sales_trend.empty and selected_book == "All Books":
         fig = px.line(
             sales_trend, 
             x='date', 
             y='sales',
-            title='Daily Book Sales',
+            title=f'{granularity_label} {trend_title}',
             labels={'date': 'Date', 'sales': 'Books Sold'}
         )
         fig.update_layout(height=400)
-        st.plotly_chart(fig, use_container_width=True)
-    elif not filtered_data.empty and selected_book != "All Books":
-        # Create a clean copy and ensure date is datetime
-        book_sales = filtered_data.copy()
-        book_sales.loc[:, 'date'] = pd.to_datetime(book_sales['date'])
+        return fig
 
-        book_sales = book_sales.groupby(book_sales['date'].dt.date)['quantity'].sum().reset_index()
-        book_sales.columns = ['date', 'sales']
+    fig = charts.cached_figure(
+        'dashboard_sales_trend', build_trend_figure,
+        username=username, time_period=time_period, book=selected_book
+    )
 
-        fig = px.line(
-            book_sales, 
-            x='date', 
-            y='sales',
-            title=f'Daily Sales: {selected_book}',
-            labels={'date': 'Date', 'sales': 'Books Sold'}
-        )
-        fig.update_layout(height=400)
+    if fig is not None:
         st.plotly_chart(fig, use_container_width=True)
     else:
         st.info("No trend data available for the selected filters.")
@@ -266,9 +311,12 @@ else:
         # Top selling books chart
         st.subheader("Top Selling Books")
 
-        top_books = data_manager.get_top_books(username, time_period)
+        def build_top_books_figure():
+            top_books = data_manager.get_top_books(username, time_period)
+
+            if top_books.empty:
+                return None
 
-        if not top_books.empty:
             fig = px.bar(
                 top_books,
                 y='title',
@@ -280,6 +328,14 @@ else:
                 orientation='h'
             )
             fig.update_layout(height=400, yaxis={'categoryorder': 'total ascending'})
+            return fig
+
+        fig = charts.cached_figure(
+            'dashboard_top_books', build_top_books_figure,
+            username=username, time_period=time_period
+        )
+
+        if fig is not None:
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("No top books data available for the selected filters.")
@@ -288,9 +344,12 @@ else:
         # Sales by genre chart
         st.subheader("Sales by Genre")
 
-        genre_sales = data_manager.get_sales_by_genre(username, time_period)
+        def build_genre_figure():
+            genre_sales = data_manager.get_sales_by_genre(username, time_period)
+
+            if genre_sales.empty:
+                return None
 
-        if not genre_sales.empty:
             fig = px.pie(
                 genre_sales,
                 values='sales',
@@ -299,6 +358,14 @@ else:
                 hole=0.4
             )
             fig.update_layout(height=400)
+            return fig
+
+        fig = charts.cached_figure(
+            'dashboard_genre_sales', build_genre_figure,
+            username=username, time_period=time_period
+        )
+
+        if fig is not None:
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("No genre distribution data available for the selected filters.")
@@ -306,7 +373,7 @@ else:
     # Royalties by Book Section
     st.subheader("Royalties by Book")
 
-    try:
+    def build_royalties_figure():
         # Get royalties by book
         royalties_by_book = data_manager.get_royalties_by_book(username, time_period)
 
@@ -314,18 +381,29 @@ else:
         required_cols = ['title', 'royalties']
         has_required_cols = all(col in royalties_by_book.columns for col in required_cols)
 
-        if not royalties_by_book.empty and has_required_cols:
-            fig = px.bar(
-                royalties_by_book,
-                y='title',
-                x='royalties',
-                title='Royalties Earned by Book',
-                labels={'title': 'Book Title', 'royalties': 'Royalties Earned'},
-                color='royalties',
-                color_continuous_scale=px.colors.sequential.Greens,
-                orientation='h'
-            )
-            fig.update_layout(height=400, yaxis={'categoryorder': 'total ascending'})
+        if royalties_by_book.empty or not has_required_cols:
+            return None
+
+        fig = px.bar(
+            royalties_by_book,
+            y='title',
+            x='royalties',
+            title='Royalties Earned by Book',
+            labels={'title': 'Book Title', 'royalties': 'Royalties Earned'},
+            color='royalties',
+            color_continuous_scale=px.colors.sequential.Greens,
+            orientation='h'
+        )
+        fig.update_layout(height=400, yaxis={'categoryorder': 'total ascending'})
+        return fig
+
+    try:
+        fig = charts.cached_figure(
+            'dashboard_royalties_by_book', build_royalties_figure,
+            username=username, time_period=time_period
+        )
+
+        if fig is not None:
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("No royalty data available for the selected filters.")
@@ -333,40 +411,45 @@ else:
         st.error(f"Error displaying royalties by book: {str(e)}")
         st.info("We're having trouble loading the royalty data. Please try a different filter.")
 
-    # Detailed sales table
-    st.subheader("Detailed Sales Data")
-
-    if not filtered_data.empty:
-        # Sort by date in descending order
-        detailed_sales = filtered_data.sort_values('date', ascending=False)
+    # The table and its export button rerun on their own, without reloading the page
+    @st.fragment
+    def detailed_sales_section(filtered_data):
+        # Detailed sales table
+        st.subheader("Detailed Sales Data")
+
+        if not filtered_data.empty:
+            # Sort by date in descending order
+            detailed_sales = filtered_data.sort_values('date', ascending=False)
+
+            # Check if royalty column exists
+            display_columns = ['date', 'title', 'quantity', 'price', 'revenue']
+            column_config = {
+                "date": "Date",
+                "title": "Book Title",
+                "quantity": "Copies Sold",
+                "price": st.column_config.NumberColumn("Price", format="₹%.2f"),
+                "revenue": st.column_config.NumberColumn("Revenue", format="₹%.2f")
+            }
 
-        # Check if royalty column exists
-        display_columns = ['date', 'title', 'quantity', 'price', 'revenue']
-        column_config = {
-            "date": "Date",
-            "title": "Book Title",
-            "quantity": "Copies Sold",
-            "price": st.column_config.NumberColumn("Price", format="₹%.2f"),
-            "revenue": st.column_config.NumberColumn("Revenue", format="₹%.2f")
-        }
+            if 'royalty' in detailed_sales.columns:
+                display_columns.append('royalty')
+                column_config["royalty"] = st.column_config.NumberColumn("Royalty", format="₹%.2f")
 
-        if 'royalty' in detailed_sales.columns:
-            display_columns.append('royalty')
-            column_config["royalty"] = st.column_config.NumberColumn("Royalty", format="₹%.2f")
+            st.dataframe(
+                detailed_sales[display_columns],
+                use_container_width=True,
+                column_config=column_config
+            )
 
-        st.dataframe(
-            detailed_sales[display_columns],
-            use_container_width=True,
-            column_config=column_config
-        )
+            # Export option
+            if st.button("Export to CSV"):
+                st.download_button(
+                    label="Download Sales Data",
+                    data=detailed_sales.to_csv(index=False).encode('utf-8'),
+                    file_name=f"sales_data_{datetime.now().strftime('%Y%m%d')}.csv",
+                    mime="text/csv"
+                )
+        else:
+            st.info("No detailed sales data available for the selected filters.")
 
-        # Export option
-        if st.button("Export to CSV"):
-            st.download_button(
-                label="Download Sales Data",
-                data=detailed_sales.to_csv(index=False).encode('utf-8'),
-                file_name=f"sales_data_{datetime.now().strftime('%Y%m%d')}.csv",
-                mime="text/csv"
-            )
-    else:
-        st.info("No detailed sales data available for the selected filters.")
\ No newline at end of file
+    detailed_sales_section(filtered_data)
\ No newline at end of file
@@ -3,9 +3,15 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
+import charts
+import cohorts
 import data_manager
+import forecasting
+import session_memory
+import storage
 import utils
 import auth
+import widgets
 
 # Set page config
 st.set_page_config(
@@ -14,6 +20,9 @@ st.set_page_config(
     layout="wide"
 )
 
+# Read one consistent version of the data for the whole render
+storage.begin_snapshot()
+
 # Display logo in sidebar
 with st.sidebar:
     st.image("attached_assets/logo.png", width=200)
@@ -43,11 +52,18 @@ if user_books.empty:
     st.stop()
 
 # Book selection
-selected_book_title = st.selectbox("Select Book for Analysis", user_books['title'].tolist())
+book_id = widgets.book_search_picker(
+    "Select Book for Analysis",
+    key="analytics_book",
+    owner=None if username == 'admin' else username
+)
+
+if book_id is None or book_id not in user_books['id'].values:
+    st.stop()
 
 # Get selected book details
-selected_book = user_books[user_books['title'] == selected_book_title].iloc[0]
-book_id = selected_book['id']
+selected_book = user_books[user_books['id'] == book_id].iloc[0]
+selected_book_title = selected_book['title']
 
 # Time period selection
 time_period = st.selectbox(
@@ -56,8 +72,8 @@ time_period = st.selectbox(
     index=1
 )
 
-# Get all sales data for the user
-all_sales = data_manager.get_user_sales(username)
+# Get all sales data for the user, shared with other sessions viewing the same sales
+all_sales = session_memory.remember('user_sales', data_manager.get_user_sales, username, shared=True)
 
 # Filter for selected book
 book_sales = all_sales[all_sales['book_id'] == book_id] if not all_sales.empty else pd.DataFrame()
@@ -67,7 +83,7 @@ if book_sales.empty:
     st.stop()
 
 # Filter by time period
-filtered_sales = data_manager.filter_sales_by_time_period(username, time_period)
+filtered_sales = session_memory.remember('filtered_sales', data_manager.filter_sales_by_time_period, username, time_period, shared=True)
 filtered_sales = filtered_sales[filtered_sales['book_id'] == book_id] if not filtered_sales.empty else pd.DataFrame()
 
 # Book details card
@@ -86,15 +102,14 @@ with col2:
         st.markdown(f"**ISBN:** {selected_book['isbn']}")
 
 with col3:
-    total_sold = book_sales['quantity'].sum()
-    total_revenue = book_sales['revenue'].sum()
-    total_royalties = book_sales['royalty'].sum() if 'royalty' in book_sales.columns else 0
-    st.markdown(f"**Total Copies Sold:** {total_sold:,}")
-    st.markdown(f"**Total Revenue:** ₹{total_revenue:,.2f}")
+    # All-time totals come from the precomputed seasonality cube
+    book_totals = data_manager.get_book_totals(book_id)
+    st.markdown(f"**Total Copies Sold:** {book_totals['quantity']:,}")
+    st.markdown(f"**Total Revenue:** ₹{book_totals['revenue']:,.2f}")
     if 'royalty_percentage' in selected_book:
         st.markdown(f"**Royalty Rate:** {selected_book['royalty_percentage']}%")
     if 'royalty' in book_sales.columns:
-        st.markdown(f"**Total Royalties Earned:** ₹{total_royalties:,.2f}")
+        st.markdown(f"**Total Royalties Earned:** ₹{book_totals['royalty']:,.2f}")
 
 # Sales metrics for the selected period
 st.header(f"Sales Metrics ({time_period})")
@@ -186,117 +201,121 @@ else:
     if not isinstance(filtered_sales['date'].iloc[0], pd.Timestamp):
         filtered_sales['date'] = pd.to_datetime(filtered_sales['date'])
 
-    # Group by date for the trend chart
-    sales_by_date = filtered_sales.groupby(filtered_sales['date'].dt.date)['quantity'].sum().reset_index()
-    sales_by_date.columns = ['date', 'sales']
-
-    # Sort by date
-    sales_by_date = sales_by_date.sort_values('date')
-
-    # Fill in missing dates with zero sales
-    date_range = pd.date_range(sales_by_date['date'].min(), sales_by_date['date'].max())
-    full_date_df = pd.DataFrame({'date': date_range})
-    full_date_df['date'] = full_date_df['date'].dt.date
-
-    sales_trend = pd.merge(full_date_df, sales_by_date, on='date', how='left')
-    sales_trend['sales'] = sales_trend['sales'].fillna(0)
+    def build_trend_figure():
+        # Trend at a granularity suited to the period, downsampled to a fixed point budget
+        sales_trend = data_manager.build_sales_trend(filtered_sales)
+        granularity_label = utils.GRANULARITY_LABELS[sales_trend.attrs['granularity']]
+
+        fig = px.line(
+            sales_trend, 
+            x='date', 
+            y='sales',
+            title=f'{granularity_label} Sales: {selected_book_title}',
+            labels={'date': 'Date', 'sales': 'Copies Sold'}
+        )
+        fig.update_layout(height=400)
+        return fig
 
-    fig = px.line(
-        sales_trend, 
-        x='date', 
-        y='sales',
-        title=f'Daily Sales: {selected_book_title}',
-        labels={'date': 'Date', 'sales': 'Copies Sold'}
+    fig = charts.cached_figure(
+        'analytics_sales_trend', build_trend_figure,
+        username=username, book_id=book_id, time_period=time_period
     )
-    fig.update_layout(height=400)
     st.plotly_chart(fig, use_container_width=True)
 
-    # Sales distribution charts
+    # Seasonality charts, read from the precomputed cube over all of the book's sales
+    monthly_sales = data_manager.get_book_seasonality(book_id, by='month')
+    daily_sales = data_manager.get_book_seasonality(book_id, by='weekday')
+
     col1, col2 = st.columns(2)
 
     with col1:
         # Monthly distribution
         st.subheader("Monthly Sales Distribution")
+        st.caption("Across all sales of this book")
+
+        def build_monthly_figure():
+            fig = px.bar(
+                monthly_sales,
+                x='label',
+                y='quantity',
+                title='Monthly Sales Distribution',
+                labels={'label': 'Month', 'quantity': 'Copies Sold'},
+                color='quantity',
+                color_continuous_scale=px.colors.sequential.Blues
+            )
+            fig.update_layout(height=400)
+            return fig
 
-        # Create a copy to avoid SettingWithCopyWarning
-        sales_analysis = filtered_sales.copy()
-        sales_analysis['month'] = sales_analysis['date'].dt.strftime('%b')
-        sales_analysis['month_num'] = sales_analysis['date'].dt.month
-
-        monthly_sales = sales_analysis.groupby(['month', 'month_num'])['quantity'].sum().reset_index()
-        monthly_sales = monthly_sales.sort_values('month_num')
-
-        fig = px.bar(
-            monthly_sales,
-            x='month',
-            y='quantity',
-            title='Monthly Sales Distribution',
-            labels={'month': 'Month', 'quantity': 'Copies Sold'},
-            color='quantity',
-            color_continuous_scale=px.colors.sequential.Blues
+        fig = charts.cached_figure(
+            'analytics_monthly_sales', build_monthly_figure,
+            username=username, book_id=book_id
         )
-        fig.update_layout(height=400)
         st.plotly_chart(fig, use_container_width=True)
 
     with col2:
         # Day of week distribution
         st.subheader("Day of Week Sales Distribution")
+        st.caption("Across all sales of this book")
+
+        def build_weekday_figure():
+            fig = px.bar(
+                daily_sales,
+                x='label',
+                y='quantity',
+                title='Day of Week Sales Distribution',
+                labels={'label': 'Day', 'quantity': 'Copies Sold'},
+                color='quantity',
+                color_continuous_scale=px.colors.sequential.Blues
+            )
+            fig.update_layout(height=400)
+            return fig
 
-        # Create a copy for day analysis
-        day_analysis = filtered_sales.copy()
-        day_analysis['day'] = day_analysis['date'].dt.day_name()
-        day_analysis['day_num'] = day_analysis['date'].dt.dayofweek
-
-        daily_sales = day_analysis.groupby(['day', 'day_num'])['quantity'].sum().reset_index()
-        daily_sales = daily_sales.sort_values('day_num')
-
-        fig = px.bar(
-            daily_sales,
-            x='day',
-            y='quantity',
-            title='Day of Week Sales Distribution',
-            labels={'day': 'Day', 'quantity': 'Copies Sold'},
-            color='quantity',
-            color_continuous_scale=px.colors.sequential.Blues
+        fig = charts.cached_figure(
+            'analytics_weekday_sales', build_weekday_figure,
+            username=username, book_id=book_id
         )
-        fig.update_layout(height=400)
         st.plotly_chart(fig, use_container_width=True)
 
-    # Sales data table
-    st.subheader("Detailed Sales Data")
-
-    # Sort by date in descending order
-    detailed_sales = filtered_sales.sort_values('date', ascending=False)
-
-    # Prepare display columns and configuration
-    display_columns = ['date', 'quantity', 'price', 'revenue']
-    column_config = {
-        "date": "Date",
-        "quantity": "Copies Sold",
-        "price": st.column_config.NumberColumn("Price", format="₹%.2f"),
-        "revenue": st.column_config.NumberColumn("Revenue", format="₹%.2f")
-    }
-
-    # Add royalty column if it exists
-    if 'royalty' in detailed_sales.columns:
-        display_columns.append('royalty')
-        column_config["royalty"] = st.column_config.NumberColumn("Royalty", format="₹%.2f")
-
-    st.dataframe(
-        detailed_sales[display_columns],
-        use_container_width=True,
-        column_config=column_config
-    )
-
-    # Export option
-    if st.button("Export to CSV"):
-        st.download_button(
-            label="Download Sales Data",
-            data=detailed_sales.to_csv(index=False).encode('utf-8'),
-            file_name=f"{selected_book_title.replace(' ', '_')}_sales_{datetime.now().strftime('%Y%m%d')}.csv",
-            mime="text/csv"
+    # The table and its export button rerun on their own, without reloading the page
+    @st.fragment
+    def detailed_sales_section(filtered_sales, selected_book_title):
+        # Sales data table
+        st.subheader("Detailed Sales Data")
+
+        # Sort by date in descending order
+        detailed_sales = filtered_sales.sort_values('date', ascending=False)
+
+        # Prepare display columns and configuration
+        display_columns = ['date', 'quantity', 'price', 'revenue']
+        column_config = {
+            "date": "Date",
+            "quantity": "Copies Sold",
+            "price": st.column_config.NumberColumn("Price", format="₹%.2f"),
+            "revenue": st.column_config.NumberColumn("Revenue", format="₹%.2f")
+        }
+
+        # Add royalty column if it exists
+        if 'royalty' in detailed_sales.columns:
+            display_columns.append('royalty')
+            column_config["royalty"] = st.column_config.NumberColumn("Royalty", format="₹%.2f")
+
+        st.dataframe(
+            detailed_sales[display_columns],
+            use_container_width=True,
+            column_config=column_config
         )
 
+        # Export option
+        if st.button("Export to CSV"):
+            st.download_button(
+                label="Download Sales Data",
+                data=detailed_sales.to_csv(index=False).encode('utf-8'),
+                file_name=f"{selected_book_title.replace(' ', '_')}_sales_{datetime.now().strftime('%Y%m%d')}.csv",
+                mime="text/csv"
+            )
+
+    detailed_sales_section(filtered_sales, selected_book_title)
+
     # Sales performance summary
     st.subheader("Performance Summary")
 
@@ -330,6 +349,14 @@ else:
         """
         summary_text += royalty_text
 
+    # Seasonal highlights from the cube
+    if not monthly_sales.empty:
+        best_month = monthly_sales.loc[monthly_sales['quantity'].idxmax()]
+        best_day = daily_sales.loc[daily_sales['quantity'].idxmax()]
+        summary_text += f"""
+    - Historically the strongest month is **{best_month['label']}** ({best_month['quantity']:,} copies) and the busiest day is **{best_day['label']}** ({best_day['quantity']:,} copies).
+    """
+
     st.markdown(summary_text)
 
     # Performance rating
@@ -342,4 +369,91 @@ else:
     elif sales_growth > -20:
         st.warning("⭐⭐ Performance needs attention. Sales are slightly decreasing.")
     else:
-        st.error("⭐ Poor performance. Sales are declining significantly.")
\ No newline at end of file
+        st.error("⭐ Poor performance. Sales are declining significantly.")
+
+# Lifecycle since publication, compared with the average of books in the same genre
+st.subheader("Lifecycle Since Publication")
+
+def build_lifecycle_figure():
+    curve = cohorts.book_curve(book_id, unit='week', max_age=104)
+    if curve.empty:
+        return None
+
+    genre_curves = cohorts.cohort_curves(by='genre', unit='week', max_age=int(curve['age'].max()))
+    genre_curve = genre_curves[genre_curves['cohort'] == str(selected_book['genre'])]
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=curve['age'], y=curve['cumulative'], mode='lines', name=selected_book_title, line=dict(color='#1E88E5')))
+    fig.add_trace(go.Scatter(x=genre_curve['age'], y=genre_curve['cumulative'], mode='lines', name=f"{selected_book['genre']} average", line=dict(color='#9E9E9E', dash='dash')))
+    fig.update_layout(
+        title='Cumulative Copies Sold by Weeks Since Publication',
+        xaxis_title='Weeks Since Publication',
+        yaxis_title='Copies Sold',
+        height=400
+    )
+    return fig
+
+fig = charts.cached_figure('analytics_lifecycle', build_lifecycle_figure, book_id=book_id)
+
+if fig is not None:
+    st.plotly_chart(fig, use_container_width=True)
+else:
+    st.info("No publication date available to align this book's sales.")
+
+# Forward-looking view, independent of the selected time period
+@st.fragment
+def forecast_section(book_id, book_sales):
+    st.subheader("Sales Forecast")
+
+    horizon = st.selectbox(
+        "Forecast Horizon",
+        [30, 90, 180],
+        index=1,
+        format_func=lambda days: f"Next {days} Days",
+        key="forecast_horizon"
+    )
+
+    def build_forecast_figure():
+        forecast = forecasting.get_book_forecast(book_id, horizon)
+        if forecast.empty:
+            return None
+
+        # Recent daily history leading into the forecast
+        history = book_sales.assign(date=pd.to_datetime(book_sales['date'])).groupby('date')['quantity'].sum()
+        history_start = forecast['date'].iloc[0] - pd.Timedelta(days=90)
+        history = history.reindex(pd.date_range(history_start, forecast['date'].iloc[0] - pd.Timedelta(days=1)), fill_value=0)
+
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(
+            x=pd.concat([forecast['date'], forecast['date'][::-1]]),
+            y=pd.concat([forecast['upper'], forecast['lower'][::-1]]),
+            fill='toself',
+            fillcolor='rgba(30, 136, 229, 0.15)',
+            line=dict(color='rgba(0, 0, 0, 0)'),
+            hoverinfo='skip',
+            name='95% Interval'
+        ))
+        fig.add_trace(go.Scatter(x=history.index, y=history.values, mode='lines', name='Actual', line=dict(color='#424242')))
+        fig.add_trace(go.Scatter(x=forecast['date'], y=forecast['forecast'], mode='lines', name='Forecast', line=dict(color='#1E88E5', dash='dash')))
+        fig.update_layout(
+            title='Daily Copies Sold: Recent and Forecast',
+            xaxis_title='Date',
+            yaxis_title='Copies Sold',
+            height=400
+        )
+        return fig
+
+    fig = charts.cached_figure('analytics_forecast', build_forecast_figure, book_id=book_id, horizon=horizon)
+
+    if fig is None:
+        st.info("Not enough sales history to forecast this book.")
+    else:
+        forecast = forecasting.get_book_forecast(book_id, horizon)
+        st.plotly_chart(fig, use_container_width=True)
+        st.caption(
+            f"Expected {forecast['forecast'].sum():,.0f} copies over the next {horizon} days, "
+            f"from a seasonal exponential smoothing model fitted to the last year of daily sales. "
+            f"The shaded band is the 95% interval for each day's sales."
+        )
+
+forecast_section(book_id, book_sales)
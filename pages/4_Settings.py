@@ -1,6 +1,8 @@
 import streamlit as st
 import pandas as pd
 import data_manager
+import storage
+import digests
 import auth
 import os
 from datetime import datetime
@@ -12,6 +14,9 @@ st.set_page_config(
     layout="wide"
 )
 
+# Read one consistent version of the data for the whole render
+storage.begin_snapshot()
+
 # Check authentication
 if not st.session_state.get('authenticated', False):
     st.warning("Please log in to access this page.")
@@ -48,7 +53,10 @@ if st.session_state.user_role == "admin":
                 empty_sales = pd.DataFrame(columns=[
                     'date', 'book_id', 'quantity', 'price', 'revenue'
                 ])
-                empty_sales.to_csv('data/sales.csv', index=False)
+                with storage.write_lock():
+                    with storage.atomic_writer('data/sales.csv') as sales_file:
+                        empty_sales.to_csv(sales_file, index=False)
+                    storage.bump_version('sales')
                 st.success("All sales data has been cleared successfully.")
             else:
                 st.error("Sales data file not found.")
@@ -60,7 +68,10 @@ if st.session_state.user_role == "admin":
                 empty_books = pd.DataFrame(columns=[
                     'id', 'title', 'author', 'genre', 'owner', 'price', 'publication_date'
                 ])
-                empty_books.to_csv('data/books.csv', index=False)
+                with storage.write_lock():
+                    with storage.atomic_writer('data/books.csv') as books_file:
+                        empty_books.to_csv(books_file, index=False)
+                    storage.bump_version('books')
                 st.success("All book data has been cleared successfully.")
             else:
                 st.error("Books data file not found.")
@@ -76,7 +87,7 @@ if st.session_state.user_role == "admin":
         with col1:
             if st.button("Export Books Data"):
                 if os.path.exists('data/books.csv'):
-                    books_df = pd.read_csv('data/books.csv')
+                    books_df = pd.read_csv(storage.open_table('books'))
                     st.download_button(
                         label="Download Books Data",
                         data=books_df.to_csv(index=False).encode('utf-8'),
@@ -89,7 +100,7 @@ if st.session_state.user_role == "admin":
         with col2:
             if st.button("Export Sales Data"):
                 if os.path.exists('data/sales.csv'):
-                    sales_df = pd.read_csv('data/sales.csv')
+                    sales_df = pd.read_csv(storage.open_table('sales'))
                     st.download_button(
                         label="Download Sales Data",
                         data=sales_df.to_csv(index=False).encode('utf-8'),
@@ -113,7 +124,10 @@ if st.session_state.user_role == "admin":
                     required_columns = ['id', 'title', 'author', 'genre', 'owner', 'price', 'publication_date']
                     
                     if all(col in books_df.columns for col in required_columns):
-                        books_df.to_csv('data/books.csv', index=False)
+                        with storage.write_lock():
+                            with storage.atomic_writer('data/books.csv') as books_file:
+                                books_df.to_csv(books_file, index=False)
+                            storage.bump_version('books')
                         st.success("Books data imported successfully!")
                     else:
                         st.error("Invalid CSV format. Missing required columns.")
@@ -128,7 +142,10 @@ if st.session_state.user_role == "admin":
                     required_columns = ['date', 'book_id', 'quantity', 'price', 'revenue']
                     
                     if all(col in sales_df.columns for col in required_columns):
-                        sales_df.to_csv('data/sales.csv', index=False)
+                        with storage.write_lock():
+                            with storage.atomic_writer('data/sales.csv') as sales_file:
+                                sales_df.to_csv(sales_file, index=False)
+                            storage.bump_version('sales')
                         st.success("Sales data imported successfully!")
                     else:
                         st.error("Invalid CSV format. Missing required columns.")
@@ -150,12 +167,34 @@ st.info("Theme settings will be applied on the next login.")
 
 # Notification settings
 st.subheader("Notification Settings")
-email_notifications = st.checkbox("Enable email notifications for sales updates", value=False)
-daily_summary = st.checkbox("Receive daily sales summary", value=False)
-weekly_summary = st.checkbox("Receive weekly sales summary", value=True)
+preferences = digests.get_preferences(st.session_state.username)
+current_email = (auth.get_user(st.session_state.username) or {}).get('email', '')
+email = st.text_input("Email address", value=current_email, help="Where sales summaries are sent.")
+email_notifications = st.checkbox("Enable email notifications for sales updates", value=preferences['email_notifications'])
+daily_summary = st.checkbox("Receive daily sales summary", value=preferences['daily_summary'])
+weekly_summary = st.checkbox("Receive weekly sales summary", value=preferences['weekly_summary'])
+
+if (daily_summary or weekly_summary) and not email_notifications:
+    st.caption("Summaries are only emailed while email notifications are enabled.")
+if email_notifications and not email.strip():
+    st.caption("Add an email address to receive summaries.")
 
 if st.button("Save Settings"):
-    st.success("Settings saved successfully!")
+    email = email.strip()
+    if email and '@' not in email:
+        success, message = False, "Please enter a valid email address."
+    elif email != current_email:
+        success, message = auth.update_user(st.session_state.username, email=email)
+    else:
+        success = True
+    if success:
+        success, message = digests.set_preferences(
+            st.session_state.username, email_notifications, daily_summary, weekly_summary
+        )
+    if success:
+        st.success(message)
+    else:
+        st.error(message)
 
 # Display app information
 st.header("About")
@@ -0,0 +1,270 @@
+import bisect
+import heapq
+import re
+import threading
+from collections import defaultdict
+
+import data_manager
+import storage
+
+# Field weights used when ranking matches; a title hit outranks an author hit,
+# which outranks an ISBN hit.
+FIELD_WEIGHTS = {'title': 3, 'author': 2, 'isbn': 1}
+
+_TOKEN_PATTERN = re.compile(r"[0-9a-z]+")
+
+# (books version, index) it was built from
+_index = None
+_lock = threading.Lock()
+
+
+def tokenize(text):
+    """Split text into lowercase alphanumeric tokens."""
+    if text is None or text != text:  # None or NaN
+        return []
+    return _TOKEN_PATTERN.findall(str(text).lower())
+
+
+def _isbn_tokens(isbn):
+    """Return the tokens for an ISBN: its hyphenated parts plus the bare digits."""
+    tokens = tokenize(isbn)
+    digits = ''.join(tokens)
+    if digits and digits not in tokens:
+        tokens.append(digits)
+    return tokens
+
+
+class BookSearchIndex:
+    """Inverted index mapping title, author and ISBN tokens to book IDs.
+
+    Tokens are kept in a sorted list so that prefix lookups are a bisect plus
+    a scan over the matching range, which keeps typeahead queries fast on
+    catalogs with tens of thousands of titles. The index is shared between
+    sessions and updated in place by writes, so every method holds its lock.
+    """
+
+    def __init__(self):
+        self._postings = defaultdict(dict)  # token -> {book_id: field weight}
+        self._tokens = []                   # sorted list of distinct tokens
+        self._books = {}                    # book_id -> display fields and tokens
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._books)
+
+    def add(self, book_id, title, author='', isbn='', owner=''):
+        """Index a book, replacing any existing entry with the same ID."""
+        with self._lock:
+            for token in self._index_book(book_id, title, author, isbn, owner):
+                bisect.insort(self._tokens, token)
+
+    def add_all(self, books):
+        """Index many (book_id, title, author, isbn, owner) rows, sorting the token list once."""
+        with self._lock:
+            new_tokens = []
+            for book_id, title, author, isbn, owner in books:
+                new_tokens.extend(self._index_book(book_id, title, author, isbn, owner))
+            if new_tokens:
+                self._tokens = sorted(self._postings)
+
+    def _index_book(self, book_id, title, author, isbn, owner):
+        """Add a book's postings and return the tokens new to the index, which the caller sorts in."""
+        if book_id in self._books:
+            self.remove(book_id)
+
+        field_tokens = {
+            'title': tokenize(title),
+            'author': tokenize(author),
+            'isbn': _isbn_tokens(isbn),
+        }
+
+        weights = {}
+        for field, tokens in field_tokens.items():
+            for token in tokens:
+                weights[token] = max(weights.get(token, 0), FIELD_WEIGHTS[field])
+
+        new_tokens = []
+        for token, weight in weights.items():
+            postings = self._postings[token]
+            if not postings:
+                new_tokens.append(token)
+            postings[book_id] = weight
+
+        self._books[book_id] = {
+            'id': book_id,
+            'title': '' if title != title else str(title),
+            'author': '' if author != author else str(author),
+            'isbn': '' if isbn is None or isbn != isbn else str(isbn),
+            'owner': owner,
+            'tokens': list(weights),
+        }
+        return new_tokens
+
+    def remove(self, book_id):
+        """Remove a book from the index. Unknown IDs are ignored."""
+        with self._lock:
+            book = self._books.pop(book_id, None)
+            if book is None:
+                return
+
+            for token in book['tokens']:
+                postings = self._postings.get(token)
+                if postings is None:
+                    continue
+                postings.pop(book_id, None)
+                if not postings:
+                    del self._postings[token]
+                    position = bisect.bisect_left(self._tokens, token)
+                    if position < len(self._tokens) and self._tokens[position] == token:
+                        del self._tokens[position]
+
+    def _prefix_matches(self, prefix):
+        """Return {book_id: score} for every book with a token starting with prefix."""
+        matches = {}
+        position = bisect.bisect_left(self._tokens, prefix)
+        while position < len(self._tokens) and self._tokens[position].startswith(prefix):
+            token = self._tokens[position]
+            # Exact token matches rank above pure prefix matches
+            bonus = 1 if token == prefix else 0
+            for book_id, weight in self._postings[token].items():
+                score = weight + bonus
+                if score > matches.get(book_id, 0):
+                    matches[book_id] = score
+            position += 1
+        return matches
+
+    def search(self, query, limit=10, owner=None):
+        """Return up to `limit` books matching every token of the query.
+
+        Each query token is treated as a prefix, so partially typed words
+        match. Results are ranked by field weight and then by title.
+        """
+        with self._lock:
+            return self._search(tokenize(query), limit, owner)
+
+    def _search(self, query_tokens, limit, owner):
+        if not query_tokens:
+            candidates = (
+                book for book in self._books.values()
+                if owner is None or book['owner'] == owner
+            )
+            return [
+                self._result(book)
+                for book in heapq.nsmallest(limit, candidates, key=lambda b: (b['title'].lower(), b['id']))
+            ]
+
+        scores = None
+        # Start with the most selective token to keep intersections small
+        for token in sorted(set(query_tokens), key=len, reverse=True):
+            matches = self._prefix_matches(token)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {
+                    book_id: score + matches[book_id]
+                    for book_id, score in scores.items()
+                    if book_id in matches
+                }
+            if not scores:
+                return []
+
+        if owner is not None:
+            scores = {
+                book_id: score for book_id, score in scores.items()
+                if self._books[book_id]['owner'] == owner
+            }
+
+        best = heapq.nsmallest(
+            limit,
+            scores.items(),
+            key=lambda item: (-item[1], self._books[item[0]]['title'].lower(), item[0])
+        )
+        return [self._result(self._books[book_id]) for book_id, _ in best]
+
+    @staticmethod
+    def _result(book):
+        return {key: book[key] for key in ('id', 'title', 'author', 'isbn', 'owner')}
+
+
+def build_index(books_df):
+    """Build a search index from a books DataFrame."""
+    index = BookSearchIndex()
+
+    if books_df.empty:
+        return index
+
+    authors = books_df['author'] if 'author' in books_df.columns else [''] * len(books_df)
+    isbns = books_df['isbn'] if 'isbn' in books_df.columns else [''] * len(books_df)
+    owners = books_df['owner'] if 'owner' in books_df.columns else [''] * len(books_df)
+
+    index.add_all(
+        (int(book_id), title, author, isbn, owner)
+        for book_id, title, author, isbn, owner in zip(books_df['id'], books_df['title'], authors, isbns, owners)
+    )
+
+    return index
+
+
+def get_index():
+    """Return the shared search index, rebuilding it if books.csv has changed."""
+    global _index
+
+    with storage.snapshot(), _lock:
+        version = data_manager.get_table_version('books')
+        if _index is not None and _index[0] == version:
+            return _index[1]
+
+        index = build_index(data_manager.get_books())
+        # A reader pinned to an older catalog doesn't replace an index built from a newer one
+        if _index is None or not storage.is_older(version, _index[0]):
+            _index = (version, index)
+        return index
+
+
+def search_books(query, limit=10, owner=None):
+    """Search the catalog by title, author or ISBN and return the top matches."""
+    return get_index().search(query, limit=limit, owner=owner)
+
+
+def apply_book_change(previous_version, current_version, book_id, book=None):
+    """Apply a single book write to the cached index.
+
+    `book` holds the new field values, or is None when the book was deleted.
+    The update is only applied when the index was built from the version of
+    books.csv that the write started from; otherwise the index is left stale
+    and rebuilt on the next lookup.
+    """
+    global _index
+
+    with _lock:
+        if _index is None or _index[0] != previous_version:
+            return
+
+        index = _index[1]
+        if book is None:
+            index.remove(book_id)
+        else:
+            index.add(
+                book_id,
+                book.get('title', ''),
+                book.get('author', ''),
+                book.get('isbn', ''),
+                book.get('owner', '')
+            )
+        _index = (current_version, index)
+
+
+def apply_books_added(previous_version, current_version, books_df):
+    """Apply a bulk append of books to the cached index."""
+    global _index
+
+    with _lock:
+        if _index is None or _index[0] != previous_version:
+            return
+
+        index = _index[1]
+        index.add_all(
+            (int(book['id']), book.get('title', ''), book.get('author', ''), book.get('isbn', ''), book.get('owner', ''))
+            for book in books_df.to_dict('records')
+        )
+        _index = (current_version, index)
@@ -0,0 +1,210 @@
+import os
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import data_manager
+
+# Most memory one session may keep in its own remembered items; past it the
+# largest items are dropped and rebuilt the next time they are asked for
+SESSION_MEMORY_LIMIT_MB = float(os.environ.get('SESSION_MEMORY_LIMIT_MB', 64))
+
+# Most memory the frames shared between sessions may use in total
+SHARED_MEMORY_LIMIT_MB = float(os.environ.get('SHARED_MEMORY_LIMIT_MB', 256))
+
+LEDGER_KEY = '_memory_ledger'
+
+# Shared frames keyed by (name, inputs, data version, day), least recently used first
+_shared = OrderedDict()
+_shared_lock = threading.Lock()
+
+# Ledgers of the sessions alive in this process; a ledger leaves the set
+# when its session's state is discarded
+_ledgers = weakref.WeakSet()
+
+
+def measure(value):
+    """Return the bytes a value holds, counting the contents of object columns."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    return sys.getsizeof(value)
+
+
+class Ledger:
+    """The items one session keeps between reruns, with their sizes.
+
+    Each name holds one item at a time; remembering a name again with
+    other inputs replaces it. Private items belong to the session alone;
+    shared items only record the key of a frame in the process-wide cache,
+    so a frame evicted from there is freed rather than kept alive by the
+    sessions that used it.
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:8]
+        self.username = None
+        self.started = time.time()
+        self.items = {}
+
+    def private_bytes(self):
+        return sum(item['size'] for item in self.items.values() if not item['shared'])
+
+    def shared_keys(self):
+        return [item['key'] for item in self.items.values() if item['shared']]
+
+    def shared_bytes(self):
+        with _shared_lock:
+            return sum(_shared[key]['size'] for key in self.shared_keys() if key in _shared)
+
+    def enforce_limit(self, limit_bytes, keep=None):
+        """Drop the largest private items until the session is within its limit.
+
+        Returns the names dropped. The item named `keep` (the one just
+        remembered) goes last.
+        """
+        dropped = []
+        while self.private_bytes() > limit_bytes:
+            private = [(name, item) for name, item in self.items.items() if not item['shared']]
+            private.sort(key=lambda entry: (entry[0] == keep, -entry[1]['size']))
+            name = private[0][0]
+            del self.items[name]
+            dropped.append(name)
+        return dropped
+
+
+def get_ledger():
+    """Return the current session's ledger, creating it on first use."""
+    ledger = st.session_state.get(LEDGER_KEY)
+    if ledger is None:
+        ledger = Ledger()
+        st.session_state[LEDGER_KEY] = ledger
+        _ledgers.add(ledger)
+    ledger.username = st.session_state.get('username')
+    return ledger
+
+
+def _shared_frame(key, build, args):
+    """Return the shared frame for a key, building it if no session has yet."""
+    with _shared_lock:
+        entry = _shared.get(key)
+        if entry is not None:
+            _shared.move_to_end(key)
+            entry['used'] = time.time()
+            return entry
+
+    value = build(*args)
+    entry = {'value': value, 'size': measure(value), 'used': time.time()}
+
+    with _shared_lock:
+        entry = _shared.setdefault(key, entry)
+        _shared.move_to_end(key)
+        limit = SHARED_MEMORY_LIMIT_MB * 1024 * 1024
+        while len(_shared) > 1 and sum(cached['size'] for cached in _shared.values()) > limit:
+            _shared.popitem(last=False)
+    return entry
+
+
+def remember(name, build, *args, shared=False, key=None):
+    """Return build(*args), kept in the session until the inputs or the data change.
+
+    The item is keyed by `key` (default: `args`), the books and sales
+    versions and the day (time periods are relative to today). With
+    `shared`, one frame is kept for every session asking for the same
+    thing and each caller gets a shallow copy: the data is shared, so
+    callers may add or replace columns but must not modify values in
+    place. Private items count towards the session's
+    SESSION_MEMORY_LIMIT_MB; past it the largest are dropped and rebuilt
+    on their next use.
+    """
+    ledger = get_ledger()
+    key = (name, args if key is None else key, data_manager.get_data_version(), date.today())
+
+    item = ledger.items.get(name)
+    if item is not None and item['key'] == key and not item['shared']:
+        return item['value']
+
+    if shared:
+        # Looked up on every use: if the frame was evicted it is built once more for everyone
+        entry = _shared_frame(key, build, args)
+        ledger.items[name] = {'key': key, 'shared': True}
+        return entry['value'].copy(deep=False)
+
+    value = build(*args)
+    ledger.items[name] = {'key': key, 'shared': False, 'value': value, 'size': measure(value)}
+    ledger.enforce_limit(SESSION_MEMORY_LIMIT_MB * 1024 * 1024, keep=name)
+    return value
+
+
+def forget(name=None):
+    """Drop one remembered item from the current session, or all of them."""
+    ledger = get_ledger()
+    if name is None:
+        ledger.items.clear()
+    else:
+        ledger.items.pop(name, None)
+
+
+def get_session_usage():
+    """Get memory kept by each live session in this process, largest first.
+
+    `shared` is the size of the shared frames a session refers to; they
+    are counted once in get_shared_usage, not per session.
+    """
+    rows = [
+        {
+            'session': ledger.id,
+            'username': ledger.username,
+            'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ledger.started)),
+            'items': len(ledger.items),
+            'private': ledger.private_bytes(),
+            'shared': ledger.shared_bytes()
+        }
+        for ledger in list(_ledgers)
+    ]
+    usage = pd.DataFrame(rows, columns=['session', 'username', 'started', 'items', 'private', 'shared'])
+    return usage.sort_values('private', ascending=False, kind='mergesort').reset_index(drop=True)
+
+
+def get_shared_usage():
+    """Get the frames shared between sessions, with their size and the sessions using them."""
+    users = {}
+    for ledger in list(_ledgers):
+        for key in ledger.shared_keys():
+            users[key] = users.get(key, 0) + 1
+
+    with _shared_lock:
+        rows = [
+            {
+                'name': key[0],
+                'inputs': ', '.join(str(arg) for arg in key[1]) if isinstance(key[1], tuple) else str(key[1]),
+                'rows': len(entry['value']) if hasattr(entry['value'], '__len__') else None,
+                'size': entry['size'],
+                'sessions': users.get(key, 0),
+                'last_used': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['used']))
+            }
+            for key, entry in _shared.items()
+        ]
+    usage = pd.DataFrame(rows, columns=['name', 'inputs', 'rows', 'size', 'sessions', 'last_used'])
+    return usage.sort_values('size', ascending=False, kind='mergesort').reset_index(drop=True)
+
+
+def clear_shared():
+    """Drop every shared frame; sessions using one build it again on their next rerun."""
+    with _shared_lock:
+        _shared.clear()
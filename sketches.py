@@ -0,0 +1,272 @@
+import os
+import random
+import threading
+
+import numpy as np
+import pandas as pd
+
+import data_manager
+import storage
+
+# HyperLogLog precision: 2**12 registers, about 1.6% standard error on distinct counts
+HLL_PRECISION = 12
+
+# KLL accuracy parameter: larger k keeps more items and gives tighter ranks
+KLL_K = 200
+
+# (sales version, sketches) they were built from
+_sketches = None
+_lock = threading.Lock()
+
+
+def _hash64(values):
+    """Hash integers to well-mixed 64-bit values (splitmix64 finaliser)."""
+    with np.errstate(over='ignore'):
+        x = np.asarray(values, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+class HyperLogLog:
+    """Mergeable approximate distinct counter.
+
+    Each register keeps the longest run of leading zero bits seen among
+    the hashes routed to it; two sketches merge by taking the register-wise
+    maximum, so per-month sketches combine into any range.
+    """
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, values):
+        """Add a batch of integer values."""
+        if len(values) == 0:
+            return
+        hashes = _hash64(values)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        remainder = hashes << np.uint64(self.precision)
+
+        # Rank is the position of the first set bit in the remaining bits
+        rank = np.full(len(hashes), 64 - self.precision + 1, dtype=np.uint8)
+        for bit in range(64 - self.precision):
+            is_set = (remainder >> np.uint64(63 - bit)) & np.uint64(1) == 1
+            rank = np.where(is_set & (rank == 64 - self.precision + 1), bit + 1, rank).astype(np.uint8)
+
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        """Fold another sketch into this one."""
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        """Estimate the number of distinct values added."""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -self.registers.astype(float))
+
+        # Small ranges are counted more accurately from the empty registers
+        empty = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and empty:
+            estimate = m * np.log(m / empty)
+
+        return float(estimate)
+
+    def relative_error(self):
+        """Return the standard error of count() as a fraction of the estimate."""
+        return 1.04 / np.sqrt(len(self.registers))
+
+
+class KLLSketch:
+    """Mergeable approximate quantile sketch (Karnin, Lang and Liberty).
+
+    Items are kept in a hierarchy of compactors; when a level fills up it
+    is sorted and every other item (from a random offset) is promoted to
+    the next level with twice the weight. Memory stays around a few times
+    k regardless of how many items are added, and two sketches merge by
+    concatenating their levels and compacting.
+    """
+
+    def __init__(self, k=KLL_K):
+        self.k = k
+        self.levels = [[]]
+        self.count = 0
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def _compress(self):
+        while sum(len(items) for items in self.levels) > sum(self._capacity(level) for level in range(len(self.levels))):
+            for level, items in enumerate(self.levels):
+                if len(items) >= self._capacity(level):
+                    if level + 1 == len(self.levels):
+                        self.levels.append([])
+                    # An odd item out stays behind so only pairs are compacted
+                    items.sort()
+                    kept = items[-1:] if len(items) % 2 else []
+                    pairs = items[:len(items) - len(kept)]
+                    self.levels[level + 1].extend(pairs[random.randint(0, 1)::2])
+                    self.levels[level] = kept
+                    break
+
+    def update(self, values):
+        """Add a batch of values."""
+        values = [float(value) for value in values]
+        if not values:
+            return
+        self.levels[0].extend(values)
+        self.count += len(values)
+        self._compress()
+
+    def merge(self, other):
+        """Fold another sketch into this one."""
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.count += other.count
+        self._compress()
+
+    def quantile(self, q):
+        """Estimate the value at quantile q (0 to 1)."""
+        items = []
+        weights = []
+        for level, values in enumerate(self.levels):
+            items.extend(values)
+            weights.extend([1 << level] * len(values))
+        if not items:
+            return float('nan')
+
+        order = np.argsort(items, kind='mergesort')
+        cumulative = np.cumsum(np.asarray(weights)[order])
+        position = np.searchsorted(cumulative, q * cumulative[-1], side='left')
+        return float(np.asarray(items)[order][min(position, len(items) - 1)])
+
+    def rank_error(self):
+        """Return the normalised rank error of quantile() at roughly 99% confidence."""
+        return 2.296 / self.k ** 0.9723
+
+
+def _month_sketches(chunk, sketches):
+    """Add a chunk of sales to the per-month sketches."""
+    months = pd.to_datetime(chunk['date']).dt.strftime('%Y-%m')
+    for month, sales in chunk.groupby(months.to_numpy()):
+        if month not in sketches:
+            sketches[month] = {'books': HyperLogLog(), 'quantity': KLLSketch(), 'revenue': KLLSketch(), 'sales': 0}
+        partition = sketches[month]
+        partition['books'].add(sales['book_id'].to_numpy())
+        partition['quantity'].update(sales['quantity'].to_numpy())
+        partition['revenue'].update(sales['revenue'].to_numpy())
+        partition['sales'] += len(sales)
+
+
+def build_sketches(chunksize=100000):
+    """Build per-month sketches from sales.csv in one chunked pass.
+
+    Each month holds a HyperLogLog of the books sold and KLL sketches of
+    sale quantities and sale revenue.
+    """
+    sketches = {}
+    if os.path.exists('data/sales.csv'):
+        for chunk in pd.read_csv(storage.open_table('sales'), usecols=['date', 'book_id', 'quantity', 'revenue'], chunksize=chunksize):
+            _month_sketches(chunk, sketches)
+    return sketches
+
+
+def get_sketches():
+    """Return the per-month sketches, rebuilding them only when sales have changed."""
+    global _sketches
+
+    with storage.snapshot(), _lock:
+        version = data_manager.get_table_version('sales')
+        if _sketches is not None and _sketches[0] == version:
+            return _sketches[1]
+
+        sketches = build_sketches()
+        # A reader pinned to older sales doesn't replace sketches built from newer ones
+        if _sketches is None or not storage.is_older(version, _sketches[0]):
+            _sketches = (version, sketches)
+        return sketches
+
+
+def apply_sales(previous_version, current_version, new_sales):
+    """Add newly written sales to the cached sketches if they were built from previous_version."""
+    global _sketches
+
+    with _lock:
+        if _sketches is None or _sketches[0] != previous_version:
+            return
+        _month_sketches(new_sales, _sketches[1])
+        _sketches = (current_version, _sketches[1])
+
+
+def _months_in_range(months, start_date, end_date):
+    """Return the months that overlap [start_date, end_date]."""
+    start = pd.Timestamp(start_date).strftime('%Y-%m') if start_date is not None else None
+    end = pd.Timestamp(end_date).strftime('%Y-%m') if end_date is not None else None
+    return [
+        month for month in sorted(months)
+        if (start is None or month >= start) and (end is None or month <= end)
+    ]
+
+
+def approximate_statistics(start_date=None, end_date=None):
+    """Estimate sales statistics for a date range by merging monthly sketches.
+
+    The work depends on the number of months in the range, not the number
+    of sales. Ranges are rounded out to whole months. Returns a dict of
+    estimates with their error bounds, plus distinct books sold per month.
+    """
+    sketches = get_sketches()
+    months = _months_in_range(sketches, start_date, end_date)
+
+    books = HyperLogLog()
+    quantity = KLLSketch()
+    revenue = KLLSketch()
+    sales = 0
+    monthly_books = []
+    for month in months:
+        partition = sketches[month]
+        books.merge(partition['books'])
+        quantity.merge(partition['quantity'])
+        revenue.merge(partition['revenue'])
+        sales += partition['sales']
+        monthly_books.append((month, partition['books'].count()))
+
+    return {
+        'sales': sales,
+        'distinct_books': books.count() if sales else 0.0,
+        'median_quantity': quantity.quantile(0.5),
+        'p95_quantity': quantity.quantile(0.95),
+        'median_revenue': revenue.quantile(0.5),
+        'p95_revenue': revenue.quantile(0.95),
+        'distinct_error': books.relative_error(),
+        'rank_error': quantity.rank_error(),
+        'monthly_books': pd.DataFrame(monthly_books, columns=['month', 'books'])
+    }
+
+
+def exact_statistics(start_date=None, end_date=None):
+    """Compute the same statistics as approximate_statistics with a full scan of the sales."""
+    sales_df = data_manager.get_sales()
+    columns = ['month', 'books']
+    if sales_df.empty:
+        return {'sales': 0, 'distinct_books': 0, 'median_quantity': float('nan'), 'p95_quantity': float('nan'),
+                'median_revenue': float('nan'), 'p95_revenue': float('nan'), 'monthly_books': pd.DataFrame(columns=columns)}
+
+    months = pd.to_datetime(sales_df['date']).dt.strftime('%Y-%m')
+    in_range = months.isin(_months_in_range(months.unique(), start_date, end_date))
+    sales_df = sales_df[in_range]
+    months = months[in_range]
+
+    return {
+        'sales': len(sales_df),
+        'distinct_books': sales_df['book_id'].nunique(),
+        'median_quantity': sales_df['quantity'].quantile(0.5, interpolation='lower'),
+        'p95_quantity': sales_df['quantity'].quantile(0.95, interpolation='lower'),
+        'median_revenue': sales_df['revenue'].quantile(0.5, interpolation='lower'),
+        'p95_revenue': sales_df['revenue'].quantile(0.95, interpolation='lower'),
+        'monthly_books': sales_df.groupby(months)['book_id'].nunique().reset_index().set_axis(columns, axis=1)
+    }
@@ -0,0 +1,141 @@
+import html
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+import data_manager
+import user_directory
+
+STATEMENT_COLUMNS = ['book_id', 'title', 'quantity', 'revenue', 'royalty']
+
+
+def build_statement_lines(sales_df, books_df, freq='M', periods=None):
+    """Compute royalty statement lines for every client in one groupby.
+
+    Returns one row per (owner, period, book) with copies sold, revenue and
+    royalty. `freq` is a pandas period frequency ('M' for monthly, 'Q' for
+    quarterly). When `periods` is given, only those periods are included.
+    """
+    columns = ['owner', 'period'] + STATEMENT_COLUMNS
+
+    if sales_df.empty or books_df.empty:
+        return pd.DataFrame(columns=columns)
+
+    sales = sales_df.copy()
+    if 'royalty' not in sales.columns:
+        sales['royalty'] = data_manager.calculate_royalties(sales, books_df)
+
+    sales = sales[['date', 'book_id', 'quantity', 'revenue', 'royalty']].copy()
+    sales['period'] = pd.to_datetime(sales['date']).dt.to_period(freq).astype(str)
+
+    if periods is not None:
+        sales = sales[sales['period'].isin([str(period) for period in periods])]
+
+    sales = sales.merge(
+        books_df[['id', 'title', 'owner']].rename(columns={'id': 'book_id'}),
+        on='book_id',
+        how='inner'
+    )
+
+    lines = (
+        sales.groupby(['owner', 'period', 'book_id', 'title'], sort=True)[['quantity', 'revenue', 'royalty']]
+        .sum()
+        .reset_index()
+    )
+
+    return lines[columns]
+
+
+def render_statement_html(client_name, username, period, lines):
+    """Render one client's statement for one period as a standalone HTML page."""
+    total_quantity = lines['quantity'].sum()
+    total_revenue = lines['revenue'].sum()
+    total_royalty = lines['royalty'].sum()
+
+    table = lines.to_html(
+        index=False,
+        columns=['title', 'quantity', 'revenue', 'royalty'],
+        header=['Book Title', 'Copies Sold', 'Revenue (₹)', 'Royalty (₹)'],
+        float_format=lambda value: f"{value:,.2f}",
+        border=0,
+        classes='statement'
+    )
+
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Royalty Statement {html.escape(period)} - {html.escape(client_name)}</title>
+<style>
+    body {{ font-family: sans-serif; color: #424242; margin: 40px; }}
+    h1 {{ color: #1E88E5; }}
+    table.statement {{ border-collapse: collapse; width: 100%; }}
+    table.statement th, table.statement td {{ padding: 8px; border-bottom: 1px solid #ddd; text-align: right; }}
+    table.statement th:first-child, table.statement td:first-child {{ text-align: left; }}
+    .totals {{ margin-top: 20px; font-weight: 600; }}
+</style>
+</head>
+<body>
+<h1>Khwaab Publication - Royalty Statement</h1>
+<p><strong>Client:</strong> {html.escape(client_name)} ({html.escape(username)})<br>
+<strong>Period:</strong> {html.escape(period)}</p>
+{table}
+<p class="totals">Total copies sold: {total_quantity:,} | Total revenue: ₹{total_revenue:,.2f} | Total royalties: ₹{total_royalty:,.2f}</p>
+</body>
+</html>
+"""
+
+
+def _write_client_statements(out_dir, username, client_name, client_lines, formats):
+    """Write every period's statement for one client and return the file paths."""
+    paths = []
+
+    for period, lines in client_lines.groupby('period'):
+        period_dir = os.path.join(out_dir, period)
+        os.makedirs(period_dir, exist_ok=True)
+        base_path = os.path.join(period_dir, username)
+        lines = lines[STATEMENT_COLUMNS]
+
+        if 'csv' in formats:
+            lines.to_csv(f"{base_path}.csv", index=False)
+            paths.append(f"{base_path}.csv")
+
+        if 'html' in formats:
+            with open(f"{base_path}.html", 'w', encoding='utf-8') as html_file:
+                html_file.write(render_statement_html(client_name, username, period, lines))
+            paths.append(f"{base_path}.html")
+
+    return paths
+
+
+def write_statements(out_dir, freq='M', periods=None, clients=None, formats=('csv', 'html'), workers=None, use_processes=True):
+    """Generate statement files for all clients from a single pass over the sales data.
+
+    Files are written to <out_dir>/<period>/<username>.csv and .html, one
+    client per worker. Returns the list of files written.
+    """
+    lines = build_statement_lines(data_manager.get_sales(), data_manager.get_books(), freq=freq, periods=periods)
+
+    if clients is not None:
+        lines = lines[lines['owner'].isin(clients)]
+
+    if lines.empty:
+        return []
+
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    paths = []
+
+    with executor_class(max_workers=workers) as executor:
+        futures = []
+        for username, client_lines in lines.groupby('owner'):
+            user = user_directory.get_user(username)
+            client_name = user['name'] if user else username
+            futures.append(executor.submit(
+                _write_client_statements, out_dir, username, client_name, client_lines, tuple(formats)
+            ))
+
+        for future in futures:
+            paths.extend(future.result())
+
+    return paths
@@ -0,0 +1,414 @@
+import contextlib
+import functools
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from stat import S_IMODE
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def file_version(path):
+    """Return a token identifying the current contents of a file, or None if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+@contextlib.contextmanager
+def atomic_writer(path, binary=False):
+    """Open a temporary file that replaces `path` atomically when the block completes.
+
+    The file is created in the same directory and moved over the target
+    with os.replace, so readers see either the old or the new contents,
+    never a partially written file. If the block raises, the target is
+    left untouched. The file is opened as UTF-8 text unless `binary`.
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        # mkstemp creates the file private to its owner; keep the target's permissions instead
+        try:
+            os.fchmod(fd, S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            os.fchmod(fd, 0o644)
+        with (os.fdopen(fd, 'wb') if binary else os.fdopen(fd, 'w', newline='', encoding='utf-8')) as temp_file:
+            yield temp_file
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def atomic_write_text(path, text):
+    """Write text to a file atomically."""
+    with atomic_writer(path) as temp_file:
+        temp_file.write(text)
+
+
+# Shared table version counters. Every write bumps its table's counter
+# under an exclusive file lock, so processes sharing data/ (several
+# replicas of the app, or the CLI next to it) see each other's writes.
+# Alongside each counter is the identity and size of the file it
+# published, which is what readers pin.
+VERSIONS_FILE = 'data/versions.json'
+LOCK_FILE = 'data/.write.lock'
+
+# Longest time a process trusts its parsed copy of the counters without
+# re-reading the file, even if the file looks unchanged
+VERSION_RECHECK_SECONDS = 1.0
+
+# Longest a thread's snapshot started with begin_snapshot() is kept, in
+# case the thread is reused without starting a new one
+SNAPSHOT_MAX_SECONDS = 60.0
+
+_write_lock = threading.RLock()
+_write_depth = 0
+_write_owner = None
+_lock_file = None
+
+_versions = None
+_versions_token = None
+_versions_checked = 0.0
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def write_lock():
+    """Hold the exclusive cross-process write lock.
+
+    The lock is an flock on data/.write.lock, taken once per process and
+    re-entrant within it, so writers that call other writers don't
+    deadlock. Where fcntl isn't available only threads are serialised.
+    While it is held, reads in the writing thread see the latest data
+    rather than any pinned snapshot, and when it is released the
+    thread's snapshot is dropped so the thread reads its own writes.
+    """
+    global _write_depth, _write_owner, _lock_file
+
+    with _write_lock:
+        if _write_depth == 0:
+            os.makedirs(os.path.dirname(LOCK_FILE), exist_ok=True)
+            _lock_file = open(LOCK_FILE, 'a')
+            if fcntl is not None:
+                fcntl.flock(_lock_file.fileno(), fcntl.LOCK_EX)
+            _write_owner = threading.get_ident()
+        _write_depth += 1
+        try:
+            yield
+        finally:
+            _write_depth -= 1
+            if _write_depth == 0:
+                _write_owner = None
+                if fcntl is not None:
+                    fcntl.flock(_lock_file.fileno(), fcntl.LOCK_UN)
+                _lock_file.close()
+                _lock_file = None
+
+                snapshot = getattr(_local, 'snapshot', None)
+                if snapshot is not None:
+                    snapshot.release()
+
+
+def write_locked(func):
+    """Decorator that runs a writer while holding write_lock()."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with write_lock():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _read_versions(force=False):
+    """Return the shared version counters, re-parsing the file only when it has changed.
+
+    The file is replaced atomically on every bump, so a stat is enough to
+    notice a change; it is re-read at least every VERSION_RECHECK_SECONDS
+    in case a replacement left the stat looking the same.
+    """
+    global _versions, _versions_token, _versions_checked
+
+    try:
+        stat = os.stat(VERSIONS_FILE)
+        token = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        token = None
+
+    now = time.monotonic()
+    if not force and _versions is not None and token == _versions_token and now - _versions_checked < VERSION_RECHECK_SECONDS:
+        return _versions
+
+    versions = {'epoch': None, 'tables': {}, 'files': {}}
+    if token is not None:
+        try:
+            with open(VERSIONS_FILE, encoding='utf-8') as versions_file:
+                versions = {**versions, **json.load(versions_file)}
+        except (FileNotFoundError, ValueError):
+            # Replaced or emptied under us; try again on the next check
+            token = None
+
+    _versions, _versions_token, _versions_checked = versions, token, now
+    return versions
+
+
+def bump_version(*names):
+    """Publish the current contents of one or more tables after writing them.
+
+    Increments each table's shared counter and records the identity and
+    size of the file written, then swaps in the new versions file.
+    """
+    with write_lock():
+        versions = _read_versions(force=True)
+        tables = dict(versions['tables'])
+        files = dict(versions['files'])
+        for name in names:
+            tables[name] = tables.get(name, 0) + 1
+            try:
+                stat = os.stat(f'data/{name}.csv')
+                files[name] = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+            except FileNotFoundError:
+                files.pop(name, None)
+
+        # A fresh epoch means counters never repeat if the file is deleted
+        updated = {'epoch': versions['epoch'] or uuid.uuid4().hex, 'tables': tables, 'files': files}
+        atomic_write_text(VERSIONS_FILE, json.dumps(updated))
+        _read_versions(force=True)
+
+
+@contextlib.contextmanager
+def appender(path):
+    """Open a table file for appending; the caller publishes the rows with bump_version().
+
+    Readers only see a file up to the size last published, so rows are
+    invisible until then. Any unpublished tail left by an interrupted
+    append is dropped first.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    with write_lock():
+        published = _read_versions(force=True)['files'].get(name)
+        with open(path, 'a', newline='', encoding='utf-8') as table_file:
+            stat = os.fstat(table_file.fileno())
+            if published and published[0] == stat.st_ino and stat.st_size > published[1]:
+                table_file.truncate(published[1])
+            yield table_file
+
+
+def _visible_version(name, stat, versions):
+    """Return the version token of the table contents readers can see, given the file's stat."""
+    if stat is None:
+        return (versions['epoch'], versions['tables'].get(name, 0), None)
+
+    published = versions['files'].get(name)
+    if published and published[0] == stat.st_ino and published[1] <= stat.st_size:
+        return (versions['epoch'], versions['tables'].get(name, 0), tuple(published))
+
+    # Not written through the app (or replaced from outside): the file as it is
+    return (versions['epoch'], versions['tables'].get(name, 0), (stat.st_ino, stat.st_size, stat.st_mtime_ns))
+
+
+class _Pin:
+    """An open handle on one published version of a table file.
+
+    Holding the descriptor keeps that version readable even after a writer
+    replaces the file; the operating system frees the old contents once
+    the last pin on them is closed.
+    """
+
+    def __init__(self, name):
+        path = f'data/{name}.csv'
+        self.fd = None
+        self.size = 0
+
+        for attempt in range(3):
+            versions = _read_versions(force=attempt > 0)
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                self.version = _visible_version(name, None, versions)
+                return
+
+            stat = os.fstat(fd)
+            published = versions['files'].get(name)
+            # A writer may have swapped the file between reading the versions and opening it
+            if published is None or published[0] == stat.st_ino or attempt == 2:
+                break
+            os.close(fd)
+
+        self.fd = fd
+        self.version = _visible_version(name, stat, versions)
+        self.size = self.version[2][1]
+        self._finalizer = weakref.finalize(self, os.close, fd)
+
+    def close(self):
+        if self.fd is not None:
+            self._finalizer()
+            self.fd = None
+
+
+class _PinnedReader(io.RawIOBase):
+    """A read-only binary stream over the published part of a pinned file."""
+
+    def __init__(self, pin):
+        self.pin = pin
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.pin.size}[whence]
+        self.position = max(base + offset, 0)
+        return self.position
+
+    def readinto(self, buffer):
+        remaining = self.pin.size - self.position
+        if remaining <= 0:
+            return 0
+        data = os.pread(self.pin.fd, min(len(buffer), remaining), self.position)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+class Snapshot:
+    """A set of pinned table versions, taken lazily as each table is first read."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self._pins = {}
+
+    def pin(self, name):
+        if name not in self._pins:
+            self._pins[name] = _Pin(name)
+        return self._pins[name]
+
+    def release(self):
+        for pin in self._pins.values():
+            pin.close()
+        self._pins = {}
+
+
+def _current_snapshot():
+    """Return the snapshot reads in this thread should use, or None to read the latest data."""
+    if _write_owner == threading.get_ident():
+        return None
+
+    snapshot = getattr(_local, 'snapshot', None)
+    if snapshot is not None and not getattr(_local, 'scoped', False) and time.monotonic() - snapshot.started > SNAPSHOT_MAX_SECONDS:
+        end_snapshot()
+        return None
+    return snapshot
+
+
+@contextlib.contextmanager
+def snapshot():
+    """Pin every table read inside the block to the version published when it is first read.
+
+    Nested blocks share the outer snapshot. Readers never take the write
+    lock, so a snapshot never waits on a writer, and writers never wait
+    on a snapshot.
+    """
+    if getattr(_local, 'snapshot', None) is not None:
+        yield _local.snapshot
+        return
+
+    _local.snapshot = Snapshot()
+    _local.scoped = True
+    try:
+        yield _local.snapshot
+    finally:
+        end_snapshot()
+
+
+def begin_snapshot():
+    """Pin the rest of this thread's reads, for script-style callers such as page renders.
+
+    The snapshot lasts until the next begin_snapshot() or end_snapshot()
+    in the thread, the thread's next write, or the thread ending.
+    """
+    end_snapshot()
+    _local.snapshot = Snapshot()
+    _local.scoped = False
+
+
+def end_snapshot():
+    """Release this thread's snapshot, if any."""
+    snapshot = getattr(_local, 'snapshot', None)
+    if snapshot is not None:
+        snapshot.release()
+    _local.snapshot = None
+    _local.scoped = False
+
+
+def open_table(name):
+    """Open the version of data/<name>.csv this thread should read, as a binary stream.
+
+    Inside a snapshot this is the pinned version; otherwise the latest
+    published one. Rows a writer is still appending are never included.
+    Raises FileNotFoundError if the table doesn't exist.
+    """
+    snapshot = _current_snapshot()
+    pin = snapshot.pin(name) if snapshot is not None else _Pin(name)
+    if pin.fd is None:
+        raise FileNotFoundError(f'data/{name}.csv')
+    return io.BufferedReader(_PinnedReader(pin))
+
+
+def table_version(name):
+    """Return a token that changes whenever data/<name>.csv is published by any process.
+
+    Inside a snapshot this is the version pinned. Combines the table's
+    shared counter with the published file's identity and size, so edits
+    made outside the app are noticed too.
+    """
+    snapshot = _current_snapshot()
+    if snapshot is not None:
+        return snapshot.pin(name).version
+
+    try:
+        stat = os.stat(f'data/{name}.csv')
+    except FileNotFoundError:
+        stat = None
+    return _visible_version(name, stat, _read_versions())
+
+
+def is_older(version, other):
+    """Return True if a version token is known to be older than another.
+
+    Table versions of the same epoch are ordered by their counter; tuples
+    of table versions (such as (books, sales)) are older if any table in
+    them is. Anything else, including versions from different epochs, is
+    not ordered. Caches use this so a reader pinned to an older snapshot
+    never replaces data built from a newer one.
+    """
+    if version is None or other is None:
+        return False
+    if _is_table_version(version) and _is_table_version(other):
+        return version[0] == other[0] and version[1] < other[1]
+    if isinstance(version, tuple) and isinstance(other, tuple) and len(version) == len(other):
+        return any(is_older(part, other_part) for part, other_part in zip(version, other))
+    return False
+
+
+def _is_table_version(version):
+    return isinstance(version, tuple) and len(version) == 3 and isinstance(version[1], int) and (version[2] is None or isinstance(version[2], tuple))
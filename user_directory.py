@@ -0,0 +1,212 @@
+import csv
+import hashlib
+import hmac
+import io
+import os
+import threading
+
+import storage
+
+USERS_FILE = 'data/users.csv'
+USER_COLUMNS = ['username', 'password', 'role', 'name', 'email']
+
+# (shared table version, directory keyed by username) it was loaded from
+_users = None
+_columns = list(USER_COLUMNS)
+_lock = threading.RLock()
+
+
+def hash_password(password):
+    """Hash password using SHA-256."""
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def _default_users():
+    """Return the default admin and client users."""
+    return [
+        {'username': 'admin', 'password': hash_password('admin123'), 'role': 'admin',
+         'name': 'Administrator', 'email': 'admin@example.com'},
+        {'username': 'client1', 'password': hash_password('client123'), 'role': 'client',
+         'name': 'John Smith', 'email': 'john@example.com'},
+        {'username': 'client2', 'password': hash_password('client123'), 'role': 'client',
+         'name': 'Emily Johnson', 'email': 'emily@example.com'},
+    ]
+
+
+def _save(users):
+    """Write the directory to users.csv atomically, bump its shared version and record it."""
+    global _users
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=_columns, extrasaction='ignore', lineterminator='\n')
+    writer.writeheader()
+    for user in users.values():
+        writer.writerow(user)
+
+    storage.atomic_write_text(USERS_FILE, buffer.getvalue())
+    storage.bump_version('users')
+    _users = (storage.table_version('users'), users)
+
+
+@storage.write_locked
+def _create_default_users():
+    """Create users.csv with the default admin and client users if it doesn't exist."""
+    with _lock:
+        if not os.path.exists(USERS_FILE):
+            if not os.path.exists('data'):
+                os.makedirs('data')
+            _save({user['username']: user for user in _default_users()})
+
+
+def _load():
+    """Return the directory, reloading users.csv only when its version has changed."""
+    global _users, _columns
+
+    version = storage.table_version('users')
+    cached = _users
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    # Writers take the write lock before _lock, so seeding the file does too
+    if not os.path.exists(USERS_FILE):
+        _create_default_users()
+
+    with _lock, storage.snapshot():
+        version = storage.table_version('users')
+        if _users is not None and _users[0] == version:
+            return _users[1]
+
+        with io.TextIOWrapper(storage.open_table('users'), encoding='utf-8', newline='') as users_file:
+            reader = csv.DictReader(users_file)
+            _columns = list(reader.fieldnames or [])
+            for column in USER_COLUMNS:
+                if column not in _columns:
+                    _columns.append(column)
+            users = {}
+            for row in reader:
+                for column in _columns:
+                    if row.get(column) is None:
+                        row[column] = ''
+                users[row['username']] = row
+
+        # A reader pinned to an older version doesn't replace a newer directory
+        if _users is None or not storage.is_older(version, _users[0]):
+            _users = (version, users)
+        return users
+
+
+def initialize_users():
+    """Create the users file with default users if it doesn't exist."""
+    _load()
+
+
+def get_user(username):
+    """Return a user's record without the password hash, or None if unknown."""
+    user = _load().get(username)
+    if user is None:
+        return None
+    return {column: value for column, value in user.items() if column != 'password'}
+
+
+def list_users():
+    """Return all user records without password hashes."""
+    return [
+        {column: value for column, value in user.items() if column != 'password'}
+        for user in _load().values()
+    ]
+
+
+def authenticate(username, password):
+    """Authenticate user with username and password."""
+    user = _load().get(username)
+    if user is None:
+        return False, None, None
+
+    if hmac.compare_digest(user['password'], hash_password(password)):
+        return True, user['role'], user['name']
+
+    return False, None, None
+
+
+@storage.write_locked
+def add_user(username, password, name, role, email=''):
+    """Add a new user to the system."""
+    with _lock:
+        users = _load()
+
+        if username in users:
+            return False, "Username already exists."
+
+        updated = dict(users)
+        updated[username] = {
+            'username': username,
+            'password': hash_password(password),
+            'role': role,
+            'name': name,
+            'email': email
+        }
+        _save(updated)
+
+    return True, "User created successfully!"
+
+
+@storage.write_locked
+def update_user(username, name=None, email=None, role=None):
+    """Update an existing user's information."""
+    with _lock:
+        users = _load()
+
+        if username not in users:
+            return False, "User does not exist."
+
+        user = dict(users[username])
+        if name:
+            user['name'] = name
+        if email is not None:
+            user['email'] = email
+        if role:
+            user['role'] = role
+
+        updated = dict(users)
+        updated[username] = user
+        _save(updated)
+
+    return True, "User updated successfully!"
+
+
+@storage.write_locked
+def change_password(username, new_password):
+    """Change a user's password."""
+    with _lock:
+        users = _load()
+
+        if username not in users:
+            return False, "User does not exist."
+
+        user = dict(users[username])
+        user['password'] = hash_password(new_password)
+
+        updated = dict(users)
+        updated[username] = user
+        _save(updated)
+
+    return True, "Password changed successfully!"
+
+
+@storage.write_locked
+def delete_user(username):
+    """Delete a user from the system."""
+    with _lock:
+        users = _load()
+
+        if username not in users:
+            return False, "User does not exist."
+
+        # Don't allow deleting the admin user
+        if username == 'admin':
+            return False, "Cannot delete the admin user."
+
+        updated = {name: user for name, user in users.items() if name != username}
+        _save(updated)
+
+    return True, "User deleted successfully!"
@@ -1,9 +1,10 @@
-import streamlit as st
-import pandas as pd
 from datetime import datetime, timedelta
 import os
 import io
 
+# pandas and numpy are imported inside the helpers that need them, so scripts
+# that only use the formatting and growth-rate helpers start quickly.
+
 
 
 
@@ -21,6 +22,68 @@ def get_days_in_period(time_period):
     else:  # All Time - approximate to 2 years
         return 730
 
+# Trend granularities as pandas resample rules and their chart labels
+GRANULARITY_LABELS = {
+    'D': 'Daily',
+    'W-MON': 'Weekly',
+    'MS': 'Monthly'
+}
+
+def choose_trend_granularity(start_date, end_date):
+    """Pick a daily, weekly or monthly resample rule for a date window."""
+    import pandas as pd
+    
+    window_days = (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days
+    
+    if window_days <= 180:
+        return 'D'
+    elif window_days <= 3 * 365:
+        return 'W-MON'
+    else:
+        return 'MS'
+
+def lttb_downsample(x, y, threshold):
+    """Return the indices kept by largest-triangle-three-buckets downsampling.
+    
+    The first and last points are always kept. The points in between are split
+    into threshold - 2 buckets, and each bucket keeps the point that forms the
+    largest triangle with the previously kept point and the next bucket's mean.
+    """
+    import numpy as np
+    
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        
+        # Mean of the next bucket (the last point for the final bucket)
+        if bucket == threshold - 3:
+            next_x, next_y = x[-1], y[-1]
+        else:
+            next_end = edges[bucket + 2]
+            next_x = x[end:next_end].mean()
+            next_y = y[end:next_end].mean()
+        
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        indices[bucket + 1] = previous
+    
+    return indices
+
 def format_date(date_str):
     """Format date string to a more readable format."""
     try:
@@ -62,16 +125,53 @@ def get_performance_color(value):
 
 def apply_date_filter(df, date_column, start_date, end_date):
     """Filter DataFrame by date range."""
+    import pandas as pd
+    
     if not isinstance(df[date_column].iloc[0], pd.Timestamp):
         df[date_column] = pd.to_datetime(df[date_column])
     
     filtered_df = df[(df[date_column] >= start_date) & (df[date_column] <= end_date)]
     return filtered_df
 
+def _isbn_digits(codes, length):
+    """Convert equal-length ISBN strings to a 2-D array of digit values ('X' counts as 10)."""
+    import numpy as np
+    
+    raw = np.frombuffer(''.join(codes).encode('ascii'), dtype=np.uint8).reshape(-1, length)
+    return np.where(raw == ord('X'), 10, raw.astype(np.int64) - ord('0'))
+
+def validate_isbns(isbns):
+    """Return a boolean Series that is True where an ISBN-10 or ISBN-13 has a valid check digit."""
+    import pandas as pd
+    import numpy as np
+    
+    cleaned = isbns.fillna('').astype(str).str.replace(r'[\s-]', '', regex=True).str.upper()
+    valid = pd.Series(False, index=isbns.index)
+
+    # ISBN-13: digits weighted alternately 1 and 3 must sum to a multiple of 10
+    # (matched with [0-9], not \d, which also matches digits of other scripts)
+    is_13 = cleaned.str.fullmatch(r'[0-9]{13}')
+    if is_13.any():
+        digits = _isbn_digits(cleaned[is_13].tolist(), 13)
+        weights = np.tile([1, 3], 7)[:13]
+        valid[is_13] = (digits @ weights) % 10 == 0
+
+    # ISBN-10: digits weighted 10 down to 1 must sum to a multiple of 11
+    is_10 = cleaned.str.fullmatch(r'[0-9]{9}[0-9X]')
+    if is_10.any():
+        digits = _isbn_digits(cleaned[is_10].tolist(), 10)
+        weights = np.arange(10, 0, -1)
+        valid[is_10] = (digits @ weights) % 11 == 0
+
+    return valid
+
 def get_book_title_by_id(book_id):
     """Get a book title for a given book ID."""
+    import pandas as pd
+    import storage
+    
     if os.path.exists('data/books.csv'):
-        books_df = pd.read_csv('data/books.csv')
+        books_df = pd.read_csv(storage.open_table('books'))
         book = books_df[books_df['id'] == book_id]
         
         if not book.empty:
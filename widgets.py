@@ -0,0 +1,56 @@
+import streamlit as st
+import search
+
+
+def format_book_label(book):
+    """Format a search result as a picker label."""
+    label = f"{book['id']} - {book['title']}"
+    if book.get('author'):
+        label += f" by {book['author']}"
+    if book.get('owner'):
+        label += f" ({book['owner']})"
+    return label
+
+
+def book_search_picker(label, key, owner=None, placeholder=None, limit=20):
+    """Display a typeahead book picker and return the selected book ID.
+
+    Only the top `limit` matches for the typed query are offered, so the
+    widget stays responsive regardless of catalog size. When `placeholder`
+    is given it is offered as the first option and selecting it returns None.
+    """
+    query = st.text_input(
+        f"Search {label}",
+        key=f"{key}_query",
+        placeholder="Type a title, author or ISBN"
+    )
+
+    results = search.search_books(query, limit=limit, owner=owner)
+    labels = {book['id']: format_book_label(book) for book in results}
+
+    options = list(labels)
+    if placeholder is not None:
+        options.insert(0, None)
+        labels[None] = placeholder
+
+    if not options:
+        st.info("No books match your search.")
+        return None
+
+    return st.selectbox(label, options, format_func=labels.get, key=f"{key}_select")
+
+
+def flash(message):
+    """Queue a success message to show after the next full-page rerun.
+
+    Used by fragments whose writes affect other sections of the page: they
+    queue the message and call st.rerun() so every section sees the change.
+    """
+    st.session_state['flash_message'] = message
+
+
+def show_flash():
+    """Show and clear the queued flash message, if any."""
+    message = st.session_state.pop('flash_message', None)
+    if message:
+        st.success(message)